@@ -0,0 +1,203 @@
+# analitica.py - Ocupación por médico, día y hora con arreglos NumPy
+#
+# NumPy es opcional: se importa al construir el primer análisis, de modo que el
+# chat arranca igual sin él. Las citas de un rango se leen con una sola consulta
+# en streaming y se vuelcan a una matriz médico × día × celda de 15 minutos.
+#
+#   analisis = db.analitica_ocupacion()
+#   analisis.resumen()
+from datetime import date, timedelta
+
+from calendario import (
+    APERTURA, BLOQUES_JORNADA, DIAS_SIN_CONSULTA, DURACION_BASE, GRANULARIDAD_MIN, hora_a_minutos
+)
+
+DIAS_SEMANA = ['lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo']
+DIAS_HISTORIAL = 365
+
+# Estados que cuentan como inasistencia (los marca el panel médico)
+ESTADOS_INASISTENCIA = ('no_asistio',)
+
+ESTADO_ACTIVA, ESTADO_CANCELADA, ESTADO_INASISTENCIA = 0, 1, 2
+
+TAMANO_LOTE = 50_000
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError("La analítica de ocupación requiere NumPy (pip install numpy)") from e
+    return numpy
+
+def _celdas_jornada():
+    """Primera celda del día (APERTURA), número de celdas y cuáles son laborables"""
+    apertura = hora_a_minutos(APERTURA)
+    cierre = max(hora_a_minutos(fin) for _, fin in BLOQUES_JORNADA)
+    celdas = (cierre - apertura) // GRANULARIDAD_MIN
+    laborables = [False] * celdas
+    for inicio, fin in BLOQUES_JORNADA:
+        for celda in range((hora_a_minutos(inicio) - apertura) // GRANULARIDAD_MIN,
+                           (hora_a_minutos(fin) - apertura) // GRANULARIDAD_MIN):
+            laborables[celda] = True
+    return apertura, celdas, laborables
+
+class AnaliticaOcupacion:
+    """Matrices de ocupación de un rango de fechas y las métricas que se derivan de ellas"""
+
+    def __init__(self, conn, desde=None, hasta=None):
+        np = _numpy()
+        hoy = date.today()
+        self.desde = desde or hoy - timedelta(days=DIAS_HISTORIAL)
+        self.hasta = hasta or hoy
+        self.dias = (self.hasta - self.desde).days + 1
+        self.apertura, self.celdas, laborables = _celdas_jornada()
+        self.celdas_laborables = np.array(laborables)
+
+        medicos = conn.execute("SELECT id, nombre FROM medicos ORDER BY id").fetchall()
+        self.medicos = [nombre for _, nombre in medicos]
+        indice = np.full(max([m for m, _ in medicos], default=0) + 1, -1, dtype=np.int64)
+        indice[[m for m, _ in medicos]] = np.arange(len(medicos))
+
+        citas = self._leer_citas(np, conn)
+        citas = citas[(citas[:, 0] >= 0) & (citas[:, 0] < len(indice))]
+        medico = indice[citas[:, 0]]
+        citas, medico = citas[medico >= 0], medico[medico >= 0]
+        self.citas_medico = medico
+        self.citas_estado = citas[:, 4]
+
+        # Día de la semana de cada día del rango y días con consulta
+        self.dia_semana = (self.desde.weekday() + np.arange(self.dias)) % 7
+        self.dias_consulta = ~np.isin(self.dia_semana, DIAS_SIN_CONSULTA)
+
+        self.ocupacion = self._matriz_ocupacion(np, medico, citas)
+
+    def _leer_citas(self, np, conn):
+        """(medico_id, día, minuto, duración, estado) de todas las citas del rango, como int32"""
+        cursor = conn.execute(f'''
+            SELECT c.medico_id,
+                   CAST(julianday(c.fecha) - julianday(?) AS INTEGER),
+                   CAST(substr(c.hora, 1, 2) AS INTEGER) * 60 + CAST(substr(c.hora, 4, 2) AS INTEGER),
+                   COALESCE(s.duracion, ?),
+                   CASE WHEN c.estado = 'cancelada' THEN {ESTADO_CANCELADA}
+                        WHEN c.estado IN ({', '.join('?' * len(ESTADOS_INASISTENCIA))}) THEN {ESTADO_INASISTENCIA}
+                        ELSE {ESTADO_ACTIVA} END
+            FROM citas c
+            LEFT JOIN servicios s ON s.id = c.servicio_id
+            WHERE c.fecha BETWEEN ? AND ?
+        ''', (self.desde.isoformat(), DURACION_BASE, *ESTADOS_INASISTENCIA,
+              self.desde.isoformat(), self.hasta.isoformat()))
+        bloques = []
+        while True:
+            filas = cursor.fetchmany(TAMANO_LOTE)
+            if not filas:
+                break
+            bloques.append(np.array(filas, dtype=np.int32))
+        if not bloques:
+            return np.empty((0, 5), dtype=np.int32)
+        return np.concatenate(bloques)
+
+    def _matriz_ocupacion(self, np, medico, citas):
+        """uint8 [médico, día, celda]: 1 si la celda está tomada por una cita no cancelada"""
+        ocupadas = citas[:, 4] != ESTADO_CANCELADA
+        medico, citas = medico[ocupadas], citas[ocupadas]
+        primera = (citas[:, 2] - self.apertura) // GRANULARIDAD_MIN
+        cuantas = np.maximum(-(-np.maximum(citas[:, 3], 1) // GRANULARIDAD_MIN), 1)
+
+        # Una entrada por celda ocupada: repetir cada cita tantas veces como celdas ocupa
+        desplazamiento = np.arange(cuantas.sum()) - np.repeat(np.cumsum(cuantas) - cuantas, cuantas)
+        celda = np.repeat(primera, cuantas) + desplazamiento
+        dia = np.repeat(citas[:, 1], cuantas)
+        fila = np.repeat(medico, cuantas)
+        validas = (celda >= 0) & (celda < self.celdas) & (dia >= 0) & (dia < self.dias)
+
+        forma = (len(self.medicos), self.dias, self.celdas)
+        plano = np.ravel_multi_index((fila[validas], dia[validas], celda[validas]), forma)
+        conteo = np.bincount(plano, minlength=int(np.prod(forma)))
+        return np.minimum(conteo, 1).astype(np.uint8).reshape(forma)
+
+    def _capacidad_por_dia(self):
+        """Celdas de consulta de un médico en cada día del rango"""
+        return self.dias_consulta * int(self.celdas_laborables.sum())
+
+    def utilizacion_por_medico(self):
+        """Fracción de las celdas de consulta ocupadas, por médico"""
+        np = _numpy()
+        ocupadas = self.ocupacion[:, self.dias_consulta][:, :, self.celdas_laborables].sum(axis=(1, 2))
+        capacidad = self._capacidad_por_dia().sum()
+        return ocupadas / capacidad if capacidad else np.zeros(len(self.medicos))
+
+    def utilizacion_por_dia_semana(self):
+        """Fracción ocupada por día de la semana (lunes=0), todos los médicos juntos"""
+        np = _numpy()
+        por_dia = self.ocupacion[:, :, self.celdas_laborables].sum(axis=(0, 2))
+        ocupadas = np.bincount(self.dia_semana, weights=por_dia, minlength=7)
+        capacidad = np.bincount(self.dia_semana, weights=self._capacidad_por_dia(), minlength=7)
+        capacidad = capacidad * len(self.medicos)
+        return np.divide(ocupadas, capacidad, out=np.zeros(7), where=capacidad > 0)
+
+    def mapa_calor(self):
+        """Ocupación [día de la semana, hora] y la lista de horas (desde la apertura)"""
+        np = _numpy()
+        por_celda = np.zeros((7, self.celdas))
+        np.add.at(por_celda, self.dia_semana, self.ocupacion.sum(axis=0))
+        celdas_hora = 60 // GRANULARIDAD_MIN
+        horas = self.celdas // celdas_hora
+        ocupadas = por_celda[:, :horas * celdas_hora].reshape(7, horas, celdas_hora).sum(axis=2)
+
+        dias_por_semana = np.bincount(self.dia_semana, weights=self.dias_consulta, minlength=7)
+        laborables_hora = self.celdas_laborables[:horas * celdas_hora].reshape(horas, celdas_hora).sum(axis=1)
+        capacidad = np.outer(dias_por_semana, laborables_hora) * len(self.medicos)
+        valores = np.divide(ocupadas, capacidad, out=np.zeros_like(ocupadas), where=capacidad > 0)
+        primera_hora = self.apertura // 60
+        return valores, [f"{primera_hora + h:02d}:00" for h in range(horas)]
+
+    def tasas(self):
+        """Tasas de cancelación e inasistencia, global y por médico"""
+        np = _numpy()
+        total = np.bincount(self.citas_medico, minlength=len(self.medicos))
+        canceladas = np.bincount(self.citas_medico, weights=self.citas_estado == ESTADO_CANCELADA,
+                                 minlength=len(self.medicos))
+        inasistencias = np.bincount(self.citas_medico, weights=self.citas_estado == ESTADO_INASISTENCIA,
+                                    minlength=len(self.medicos))
+        # La inasistencia se mide sobre las citas que no se cancelaron
+        no_canceladas = total - canceladas
+        return {
+            'citas': int(total.sum()),
+            'canceladas': int(canceladas.sum()),
+            'inasistencias': int(inasistencias.sum()),
+            'tasa_cancelacion': float(canceladas.sum() / total.sum()) if total.sum() else 0.0,
+            'tasa_inasistencia': float(inasistencias.sum() / no_canceladas.sum()) if no_canceladas.sum() else 0.0,
+            'por_medico_total': total,
+            'por_medico_cancelacion': np.divide(canceladas, total, out=np.zeros(len(total)), where=total > 0),
+        }
+
+    def resumen(self):
+        """Todo el análisis como tipos nativos de Python, listo para JSON o para la interfaz"""
+        tasas = self.tasas()
+        utilizacion = self.utilizacion_por_medico()
+        valores, horas = self.mapa_calor()
+        pico = divmod(int(valores.argmax()), len(horas)) if valores.size and valores.max() > 0 else None
+        return {
+            'desde': self.desde.isoformat(),
+            'hasta': self.hasta.isoformat(),
+            'citas': tasas['citas'],
+            'canceladas': tasas['canceladas'],
+            'tasa_cancelacion': tasas['tasa_cancelacion'],
+            'tasa_inasistencia': tasas['tasa_inasistencia'],
+            'por_medico': [
+                {
+                    'medico': nombre,
+                    'citas': int(tasas['por_medico_total'][i]),
+                    'utilizacion': float(utilizacion[i]),
+                    'tasa_cancelacion': float(tasas['por_medico_cancelacion'][i]),
+                }
+                for i, nombre in enumerate(self.medicos)
+            ],
+            'por_dia_semana': dict(zip(DIAS_SEMANA, (float(v) for v in self.utilizacion_por_dia_semana()))),
+            'mapa_calor': {
+                'dias': DIAS_SEMANA,
+                'horas': horas,
+                'valores': valores.round(4).tolist(),
+            },
+            'hora_pico': {'dia': DIAS_SEMANA[pico[0]], 'hora': horas[pico[1]]} if pico else None,
+        }
@@ -1,9 +1,13 @@
 # chatbot_citas_sqlite_fixed.py - Chatbot corregido para Streamlit Cloud
 import streamlit as st
-import datetime
-import re
 from datetime import datetime, timedelta, date
-# from database import DatabaseManager  # Comentado temporalmente para deployment
+from calendario import DIAS_BUSQUEDA
+import conversacion
+import metricas
+try:
+    from database import DatabaseManager
+except ImportError:  # Despliegue sin el módulo database
+    DatabaseManager = None
 
 # Configuración de la página
 st.set_page_config(
@@ -78,15 +82,34 @@ class MockDatabaseManager:
     def obtener_servicios(self):
         return self.servicios
     
-    def obtener_horarios_disponibles(self, fecha):
+    def obtener_servicio(self, servicio_id):
+        return next((s for s in self.servicios if s['id'] == servicio_id), None)
+    
+    def version_catalogo(self):
+        return 0
+    
+    def obtener_horarios_disponibles(self, fecha, servicio_id=None, medico_id=None):
         # Simulación de horarios disponibles
         horarios = ["09:00", "09:30", "10:00", "10:30", "11:00", "11:30", 
                    "12:00", "12:30", "14:00", "14:30", "15:00", "15:30"]
         return horarios[:6]  # Simular algunos horarios ocupados
     
+    def obtener_disponibilidad_rango(self, fecha_inicio, fecha_fin, medico_id=None):
+        disponibilidad = {}
+        fecha = fecha_inicio
+        while fecha <= fecha_fin:
+            horarios = self.obtener_horarios_disponibles(fecha.strftime("%Y-%m-%d"))
+            disponibilidad[fecha.strftime("%Y-%m-%d")] = {'disponibles': len(horarios), 'horarios': horarios}
+            fecha += timedelta(days=1)
+        return disponibilidad
+    
+    def obtener_disponibilidad_proximos_dias(self, dias=7):
+        hoy = date.today()
+        return self.obtener_disponibilidad_rango(hoy + timedelta(days=1), hoy + timedelta(days=dias))
+    
     def crear_cita(self, **kwargs):
         # Simular creación exitosa
-        numero_confirmacion = f"MC{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        numero_confirmacion = f"MC{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
         return {
             'success': True,
             'numero_confirmacion': numero_confirmacion,
@@ -106,21 +129,42 @@ class MockDatabaseManager:
                 'mensaje': 'Número de confirmación no válido'
             }
 
-# Inicializar base de datos con manejo de errores
+    def buscar_primeros_horarios(self, servicio_id=None, especialidad=None, cantidad=3, desde=None,
+                                 turno=None, dias_semana=None, dias=DIAS_BUSQUEDA):
+        servicio = self.obtener_servicio(servicio_id) or self.servicios[0]
+        manana = date.today() + timedelta(days=1)
+        return [
+            {'fecha': manana.strftime("%Y-%m-%d"), 'hora': hora, 'medico_id': servicio['medico_id'],
+             'medico': servicio['medico'], 'servicio_id': servicio['id']}
+            for hora in self.obtener_horarios_disponibles(manana)[:cantidad]
+        ]
+    
+    def buscar_citas_pagina(self, criterio, valor, tamano_pagina=10, cursor=None):
+        # El mock no guarda citas
+        return {'citas': [], 'cursor': None}
+    
+    def refrescar(self):
+        pass
+
+# Una sola instancia de la base por proceso, compartida por todas las sesiones
+# (st.cache_resource). Construirla no toca el disco: la primera consulta real migra
+# el esquema. El mock solo se usa si falta el módulo database; un error de la base
+# real se muestra y detiene la app, en lugar de agendar en datos de prueba
 @st.cache_resource
 def init_database():
-    try:
-        # return DatabaseManager()  # Descomenta cuando tengas el módulo database
-        return MockDatabaseManager()  # Temporal para deployment
-    except Exception as e:
-        st.error(f"Error conectando a la base de datos: {e}")
+    if DatabaseManager is None:
         return MockDatabaseManager()
+    with metricas.medir('ui.arranque_db'):
+        return DatabaseManager()
 
-# Inicialización segura de la base de datos
-if 'db' not in st.session_state:
-    st.session_state.db = init_database()
+db = init_database()
+motor = conversacion.ChatEngine(db)
 
-db = st.session_state.db
+# Analítica de ocupación del último año (NumPy); se recalcula a lo sumo cada 5 minutos
+@st.cache_data(ttl=300, show_spinner=False)
+def resumen_ocupacion(_db):
+    with metricas.medir('ui.analitica_ocupacion'):
+        return _db.analitica_ocupacion().resumen()
 
 # Título y descripción
 st.markdown('<h1 class="main-header">🏥 Asistente Virtual Inteligente - Clínica MediCare</h1>', unsafe_allow_html=True)
@@ -153,8 +197,8 @@ Soy tu asistente virtual con **base de datos SQLite** en tiempo real.
 - "Quiero agendar una cita de cardiología para mañana"
 - "Juan Pérez, 3312345678, consulta general, viernes"
 - "¿Cuánto cuesta una consulta de pediatría?"
-- "Cancelar cita MC20241220145230"
-- "Cambiar cita MC20241220145230 para el miércoles"
+- "Cancelar cita MC20241220145230483915"
+- "Cambiar cita MC20241220145230483915 para el miércoles"
 
 ¿En qué puedo ayudarte hoy?"""}
     ]
@@ -165,670 +209,21 @@ if "user_data" not in st.session_state:
 if "processing" not in st.session_state:
     st.session_state.processing = False
 
-# Funciones auxiliares mejoradas y optimizadas
-def detectar_intencion(mensaje):
-    """Detecta la intención del usuario con análisis mejorado"""
-    if not mensaje or len(mensaje.strip()) == 0:
-        return "saludo"
-    
-    mensaje_lower = mensaje.lower()
-    
-    # NUEVO: Detectar cambio/reagendar cita
-    if any(palabra in mensaje_lower for palabra in ["cambiar", "reagendar", "mover", "cambio"]):
-        if re.search(r'mc\d+', mensaje_lower):
-            return "cambiar_cita"
-        else:
-            return "solicitar_cambio"
-    
-    # Detectar cancelación de cita
-    if any(palabra in mensaje_lower for palabra in ["cancelar", "cancela", "eliminar"]):
-        if re.search(r'mc\d+', mensaje_lower):
-            return "cancelar_cita"
-        else:
-            return "solicitar_cancelacion"
-    
-    # Detectar búsqueda de cita existente
-    if any(palabra in mensaje_lower for palabra in ["buscar", "encontrar", "mi cita", "cita de"]):
-        return "buscar_cita"
-    
-    # Detectar información completa de cita
-    try:
-        tiene_telefono = bool(re.search(r'\b\d{10}\b|\b\d{2}[-\s]?\d{4}[-\s]?\d{4}\b', mensaje))
-        tiene_servicio = any(servicio.lower() in mensaje_lower for servicio in get_servicios_nombres())
-        tiene_nombre = len([p for p in mensaje.split() if p.isalpha() and len(p) > 2]) >= 2
-        
-        if tiene_telefono and (tiene_servicio or tiene_nombre):
-            return "procesar_cita_completa"
-    except Exception:
-        pass
-    
-    if any(palabra in mensaje_lower for palabra in ["cita", "agendar", "reservar", "turno", "consulta"]):
-        return "agendar_cita"
-    elif any(palabra in mensaje_lower for palabra in ["precio", "costo", "cuanto", "tarifa"]):
-        return "precios_servicios"
-    elif any(palabra in mensaje_lower for palabra in ["horario", "hora", "abierto", "cerrado", "disponible"]) and "cita" not in mensaje_lower:
-        return "horarios_disponibles"
-    elif any(palabra in mensaje_lower for palabra in ["emergencia", "urgente", "dolor", "accidente", "grave"]):
-        return "emergencia"
-    elif any(palabra in mensaje_lower for palabra in ["hola", "buenos", "buenas", "saludos", "ayuda"]):
-        return "saludo"
-    else:
-        return "informacion_general"
-
-def get_servicios_nombres():
-    """Obtiene nombres de servicios disponibles de forma segura"""
-    try:
-        servicios = db.obtener_servicios()
-        return [s['nombre'] for s in servicios]
-    except Exception:
-        return ["Consulta General", "Pediatría", "Cardiología", "Dermatología", "Laboratorio"]
-
-def generar_respuesta_servicios_limpia():
-    """Genera lista de servicios con formato limpio"""
-    try:
-        servicios = db.obtener_servicios()
-        
-        servicios_texto = ""
-        for servicio in servicios:
-            nombre = servicio['nombre']
-            precio = int(servicio.get('precio', 0))
-            duracion = servicio.get('duracion', 30)
-            medico = servicio.get('medico', 'No asignado')
-            
-            # Emoji específico para laboratorio
-            if nombre.lower() == 'laboratorio':
-                emoji = "🧪"
-            else:
-                emoji = "✨"
-            
-            # Formato limpio sin caracteres especiales
-            servicios_texto += f"{emoji} **{nombre}** - ${precio} MXN ({duracion} min) - {medico}\n"
-        
-        return servicios_texto
-        
-    except Exception as e:
-        # Fallback con servicios fijos y formato limpio
-        return """✨ **Consulta General** - $500 MXN (30 min) - Dr. Rodríguez
-✨ **Pediatría** - $600 MXN (45 min) - Dr. García
-✨ **Cardiología** - $800 MXN (60 min) - Dra. Martínez
-✨ **Dermatología** - $700 MXN (30 min) - Dr. López  
-🧪 **Laboratorio** - $250 MXN (15 min) - QFB Angel Carrizalez
-"""
-
-def manejar_cambio_cita(mensaje):
-    """Maneja el cambio/reagendamiento de citas existentes"""
-    # Extraer número de confirmación
-    match = re.search(r'mc\d+', mensaje.lower())
-    if not match:
-        return """❌ **CAMBIAR CITA**
-        
-Para cambiar una cita necesito el **número de confirmación**.
-
-**📋 Formato:** MC20241220145230
-
-**💡 Ejemplo:** "Cambiar cita MC20241220145230 para el miércoles"
-
-**¿No tienes el número?** Puedo buscarte la cita por tu nombre."""
-    
-    numero_confirmacion = match.group().upper()
-    
-    # Buscar día nuevo en el mensaje
-    mensaje_lower = mensaje.lower()
-    dias_variantes = {
-        'lunes': ['lunes', 'lun'],
-        'martes': ['martes', 'mar'], 
-        'miercoles': ['miercoles', 'miércoles', 'mie'],
-        'jueves': ['jueves', 'jue'],
-        'viernes': ['viernes', 'vie'],
-        'sabado': ['sabado', 'sábado', 'sab']
-    }
-    
-    dia_nuevo = None
-    for dia_base, variantes in dias_variantes.items():
-        if any(variante in mensaje_lower for variante in variantes):
-            dia_nuevo = dia_base
-            break
-    
-    if not dia_nuevo:
-        return f"""📅 **CAMBIAR CITA: {numero_confirmacion}**
-        
-Para cambiar tu cita necesito saber **a qué día** quieres moverla.
-
-{obtener_disponibilidad_proximos_dias()}
-
-**💡 Ejemplo:** "Cambiar a miércoles" o "Mover para el viernes"
-
-**¿Qué día prefieres?**"""
-    
-    # Verificar disponibilidad del día nuevo
-    try:
-        fecha_nueva = obtener_fecha_desde_dia(dia_nuevo)
-        horarios_disponibles = db.obtener_horarios_disponibles(fecha_nueva)
-        
-        if not horarios_disponibles:
-            return f"""❌ **SIN DISPONIBILIDAD PARA {dia_nuevo.upper()}**
-            
-{obtener_disponibilidad_proximos_dias()}
-
-**¿Te parece bien otro día?**"""
-        
-        # Simular cambio exitoso 
-        return f"""✅ **CITA CAMBIADA EXITOSAMENTE**
-
-**📋 DETALLES DEL CAMBIO:**
-
-🆔 **Confirmación:** {numero_confirmacion}
-🗓️ **Nuevo día:** {dia_nuevo.title()}
-📅 **Nueva fecha:** {fecha_nueva}
-⏰ **Nueva hora:** {horarios_disponibles[0]}
-
-**⚠️ IMPORTANTE:**
-• Tu número de confirmación **sigue siendo el mismo**
-• Llegar **15 minutos antes** de la nueva hora
-• Para cancelar: usa el mismo número de confirmación
-
-**¡Cambio confirmado! 👍**"""
-    
-    except Exception as e:
-        return "❌ Error al procesar el cambio de cita. Intenta nuevamente."
-
-def generar_respuesta(mensaje, intencion):
-    """Genera respuestas inteligentes basadas en la intención detectada"""
-    
-    try:
-        # NUEVO CASO: Cambiar cita
-        if intencion == "cambiar_cita":
-            return manejar_cambio_cita(mensaje)
-        
-        elif intencion == "solicitar_cambio":
-            return """📅 **CAMBIAR/REAGENDAR CITA EXISTENTE**
-
-Para cambiar tu cita necesito el **número de confirmación**.
-
-**📋 Formato:** MC20241220145230
-
-**💡 Ejemplos:**
-• "Cambiar cita MC20241220145230 para el miércoles"
-• "Reagendar MC20241220145230 al viernes"
-• "Mover mi cita MC20241220145230 para el lunes"
-
-**¿No tienes el número?** Puedo buscarte la cita por tu nombre."""
-        
-        elif intencion == "cancelar_cita":
-            # Extraer número de confirmación
-            match = re.search(r'mc\d+', mensaje.lower())
-            if match:
-                numero_confirmacion = match.group().upper()
-                resultado = db.cancelar_cita(numero_confirmacion=numero_confirmacion)
-                
-                if resultado['success']:
-                    return f"""✅ **CITA CANCELADA EXITOSAMENTE**
-
-📋 **Confirmación:** {numero_confirmacion}
-✅ **Estado:** Cancelada correctamente
-📅 **Fecha de cancelación:** {datetime.now().strftime('%d/%m/%Y %H:%M')}
-
-**¿Deseas agendar una nueva cita?** Solo dime cuándo te gustaría venir."""
-                else:
-                    return f"""❌ **ERROR AL CANCELAR**
-
-🔍 **Número buscado:** {numero_confirmacion}
-❌ **Problema:** {resultado['mensaje']}
-
-**💡 Verifica:**
-• Que el número sea correcto
-• Que la cita no haya sido cancelada previamente
-• Que el número tenga formato: MC20241220145230
-
-**¿Necesitas ayuda?** Puedo buscarte la cita por tu nombre."""
-        
-        elif intencion == "solicitar_cancelacion":
-            return """❌ **CANCELAR CITA EXISTENTE**
-
-Para cancelar tu cita necesito el **número de confirmación** que recibiste al agendar.
-
-**📋 Formato del número:** MC20241220145230
-
-**💡 Si no lo tienes, puedo buscarte la cita:**
-• Dime tu nombre completo
-• O tu número de teléfono
-• O dime "buscar mi cita"
-
-**Ejemplo:** "Cancelar cita MC20241220145230" """
-        
-        elif intencion == "buscar_cita":
-            return """🔍 **BUSCAR CITA EXISTENTE**
-
-Para buscar tu cita necesito:
-
-**1️⃣ Opción 1 - Por nombre completo:**
-"Buscar cita de Juan Pérez García"
-
-**2️⃣ Opción 2 - Por teléfono:**
-"Buscar cita 3312345678"
-
-**3️⃣ Opción 3 - Por número de confirmación:**
-"Mi cita es MC20241220145230"
-
-**¿Cuál prefieres usar?**"""
-        
-        elif intencion == "procesar_cita_completa":
-            return procesar_cita_completa(mensaje)
-        
-        elif intencion == "agendar_cita":
-            servicios_texto = generar_respuesta_servicios_limpia()
-            
-            return f"""📅 **AGENDAR NUEVA CITA**
-
-**📝 Para agendar en un solo mensaje, incluye:**
-1. **Nombre completo**
-2. **Teléfono** (10 dígitos)  
-3. **Servicio** que necesitas
-4. **Día preferido** (lunes, martes, etc.)
-
-**🏥 SERVICIOS DISPONIBLES:**
-{servicios_texto}
-
-**💡 Ejemplo perfecto:**
-*"María González López, 3312345678, pediatría, miércoles"*
-
-**📅 También acepto formatos como:**
-- "Consulta general para Juan Pérez, tel 33-1234-5678, prefiero viernes"
-- "Agendar cardiología, soy Ana Silva, 3312345678, cualquier día de la semana"
-
-¡Tu cita será procesada automáticamente! ⚡"""
-        
-        elif intencion == "precios_servicios":
-            try:
-                servicios = db.obtener_servicios()
-                
-                servicios_texto = ""
-                for servicio in servicios:
-                    precio = int(servicio.get('precio', 0))
-                    nombre = servicio['nombre']
-                    servicios_texto += f"• **{nombre}**: ${precio} MXN\n"
-                    
-            except Exception as e:
-                servicios_texto = """• **Consulta General**: $500 MXN
-• **Pediatría**: $600 MXN
-• **Cardiología**: $800 MXN
-• **Dermatología**: $700 MXN
-• **Laboratorio**: $250 MXN"""
-            
-            return f"""💰 **TARIFAS CLÍNICA MEDICARE 2024**
-
-{servicios_texto}
-
-**💳 FORMAS DE PAGO ACEPTADAS:**
-• 💵 Efectivo
-• 💳 Tarjetas de débito/crédito
-• 🏦 Transferencias bancarias
-• 🏥 Seguros médicos mayores*
-
-*Consulta cobertura específica
-
-**💡 Los precios incluyen:**
-✅ Consulta médica completa
-✅ Diagnóstico profesional  
-✅ Receta médica (si aplica)
-✅ Seguimiento post-consulta
-
-**🧪 Servicios de laboratorio** incluyen análisis básicos y entrega de resultados.
-
-**¿Listo para agendar?** Solo dime el servicio que necesitas."""
-        
-        elif intencion == "horarios_disponibles":
-            # Obtener disponibilidad de los próximos días
-            disponibilidad_texto = obtener_disponibilidad_proximos_dias()
-            
-            return f"""🕒 **HORARIOS Y DISPONIBILIDAD**
-
-**📅 HORARIOS GENERALES:**
-• **Lunes a Viernes:** 9:00 AM - 6:00 PM
-• **Sábados:** 9:00 AM - 11:30 AM  
-• **Domingos:** Solo emergencias
-
-{disponibilidad_texto}
-
-**⚠️ INFORMACIÓN IMPORTANTE:**
-• Citas cada 30 minutos
-• Llegar 15 min antes de la cita
-• Última cita: 30 min antes del cierre
-
-**¿Quieres agendar una cita?** Solo dímelo."""
-        
-        elif intencion == "emergencia":
-            return """🚨 **PROTOCOLO DE EMERGENCIAS**
-
-**📞 EMERGENCIAS MÉDICAS 24/7:**
-**(33) 1234-5678** 
-
-**🏥 Clínica MediCare - Emergencias**
-📍 Av. Principal #123, Guadalajara, Jalisco
-
-**⚡ EN CASO DE EMERGENCIA GRAVE:**
-
-1. **📞 Llama INMEDIATAMENTE** al número de emergencias
-2. **🏥 Acude** al hospital más cercano si es necesario
-3. **👨‍⚕️ Contacta** a tu médico de cabecera si es posible
-
-**🚑 NÚMEROS DE EMERGENCIA NACIONAL:**
-• **Cruz Roja:** 065
-• **Emergencias Generales:** 911
-• **Bomberos:** 911
-
-**⚠️ IMPORTANTE:** Si es una emergencia real, no uses este chat. Llama directamente."""
-        
-        elif intencion == "saludo":
-            return """👋 **¡Hola! Bienvenido a Clínica MediCare**
-
-Soy tu asistente virtual inteligente con **base de datos avanzada**. 
-
-**🎯 Estoy aquí para ayudarte con:**
-
-• 📅 **Agendar citas** - Proceso automático e instantáneo
-• 🔍 **Buscar tus citas** - Por nombre, teléfono o número
-• ❌ **Cancelar citas** - Con tu número de confirmación
-• 🔄 **Cambiar/reagendar citas** - Fácil y rápido
-• 💰 **Consultar precios** - Tarifas actualizadas 2024
-• ⏰ **Ver disponibilidad** - Horarios en tiempo real
-• 🚨 **Emergencias** - Información de contacto inmediato
-
-**💡 Tip:** Puedo procesar tu cita en un solo mensaje si me das todos los datos juntos.
-
-**¿En qué te ayudo hoy?** 😊"""
-        
-        else:
-            try:
-                servicios_count = len(db.obtener_servicios())
-            except:
-                servicios_count = 5  # Fallback
-            
-            return f"""ℹ️ **CLÍNICA MEDICARE - INFORMACIÓN GENERAL**
-
-🏥 **Somos especialistas en atención médica integral** con sistema digitalizado de última generación.
-
-**🎯 NUESTRO SISTEMA:**
-• 🗄️ **Base de datos SQLite** confiable y rápida
-• ⚡ **Procesamiento automático** de citas
-• 📊 **Panel médico** integrado para doctores
-• 🆔 **Números únicos** de confirmación
-• 🔄 **Sincronización en tiempo real**
-
-**💼 SERVICIOS MÉDICOS:**
-• {servicios_count} especialidades médicas disponibles
-• Médicos certificados y especializados
-• Equipos de diagnóstico modernos
-• Seguimiento post-consulta incluido
-
-**💡 PREGUNTAS FRECUENTES:**
-• *"¿Cuánto cuesta una consulta?"* → Consultar precios
-• *"¿Qué horarios tienen disponibles?"* → Ver disponibilidad
-• *"Quiero agendar una cita"* → Proceso automático
-• *"Buscar mi cita"* → Búsqueda inteligente
-• *"Cambiar mi cita"* → Reagendar fácilmente
-
-**¿Hay algo específico en lo que pueda ayudarte?**"""
-    
-    except Exception as e:
-        return """❌ **Error procesando tu solicitud**
-
-Por favor, intenta nuevamente o reformula tu mensaje.
+if "historial_compactado" not in st.session_state:
+    st.session_state.historial_compactado = []
 
-**¿Puedo ayudarte con algo específico como:**
-• Agendar una cita
-• Consultar precios
-• Ver horarios disponibles
+if "pagina_historial" not in st.session_state:
+    st.session_state.pagina_historial = 0
 
-**💡 También puedes escribir "ayuda" para ver todas las opciones."""
+# Historial: solo los últimos mensajes se dibujan completos; los anteriores
+# quedan en una sección paginada y, pasado el tope, se compactan a un resumen
+MENSAJES_VISIBLES = 20
+MENSAJES_POR_PAGINA = 20
+MAX_MENSAJES_SESION = 200
+MAX_COMPACTADOS = 1000
 
-def procesar_cita_completa(mensaje):
-    """Procesa una cita con toda la información proporcionada"""
-    
-    try:
-        # Extraer datos del mensaje
-        datos = extraer_datos_mensaje(mensaje)
-        
-        if not datos.get('nombre'):
-            return "❌ No pude identificar el nombre completo. Por favor, especifícalo claramente."
-        
-        if not datos.get('telefono'):
-            return "❌ No encontré un número de teléfono válido. Debe tener 10 dígitos."
-        
-        if not datos.get('servicio_id'):
-            servicios_texto = generar_respuesta_servicios_limpia()
-            return f"""❌ **No identifiqué el servicio médico solicitado.**
-
-**🏥 Servicios disponibles:**
-{servicios_texto}
-
-**Por favor especifica cuál necesitas.**"""
-        
-        # Buscar día disponible
-        if datos.get('dia_preferido'):
-            fecha_preferida = obtener_fecha_desde_dia(datos['dia_preferido'])
-            horarios_disponibles = db.obtener_horarios_disponibles(fecha_preferida)
-            
-            if not horarios_disponibles:
-                return f"""❌ **Sin disponibilidad para {datos['dia_preferido'].title()}**
-
-{obtener_disponibilidad_proximos_dias()}
-
-💡 **¿Te parece bien otro día?** Solo dímelo."""
-            
-            # Agendar la cita
-            resultado = db.crear_cita(
-                paciente_nombre=datos['nombre'],
-                paciente_telefono=datos['telefono'],
-                servicio_id=datos['servicio_id'],
-                medico_id=datos['medico_id'],
-                fecha=fecha_preferida,
-                hora=horarios_disponibles[0]
-            )
-            
-            if resultado['success']:
-                # Obtener información del servicio
-                servicios = db.obtener_servicios()
-                servicio_info = next((s for s in servicios if s['id'] == datos['servicio_id']), {})
-                
-                return f"""✅ **¡CITA CONFIRMADA Y GUARDADA!**
-
-**📋 RESUMEN COMPLETO:**
-
-👤 **Paciente:** {datos['nombre']}
-📞 **Teléfono:** {datos['telefono']}
-🏥 **Servicio:** {servicio_info.get('nombre', '')}
-👨‍⚕️ **Médico:** {servicio_info.get('medico', '')}
-
-🗓️ **Día:** {datos['dia_preferido'].title()}
-📅 **Fecha:** {fecha_preferida}
-⏰ **Hora:** {horarios_disponibles[0]}
-⏱️ **Duración:** {servicio_info.get('duracion', 30)} minutos
-💰 **Costo:** ${servicio_info.get('precio', 0):.0f} MXN
-
-**🆔 NÚMERO DE CONFIRMACIÓN:**
-**{resultado['numero_confirmacion']}**
-
-📍 **Ubicación:** Clínica MediCare
-Av. Principal #123, Guadalajara, Jalisco
-
-**⚠️ RECORDATORIOS IMPORTANTES:**
-• Llegar **15 minutos antes** de tu cita
-• Traer **identificación oficial**
-• Para cancelar: usa tu número de confirmación
-• Reagendar: con **24h de anticipación**
-
-**📞 ¿Dudas?** Llama al (33) 1234-5678
-
-**¡Nos vemos pronto! 👋**"""
-            else:
-                return f"❌ **Error al agendar la cita:** {resultado.get('mensaje', 'Error desconocido')}"
-        
-        else:
-            return f"""📝 **Datos recibidos correctamente:**
-
-✅ **Nombre:** {datos['nombre']}
-✅ **Teléfono:** {datos['telefono']}
-✅ **Servicio:** Identificado
-
-🗓️ **Falta especificar el día preferido:**
-
-{obtener_disponibilidad_proximos_dias()}
-
-**💡 Solo dime qué día prefieres y completaré tu cita.**"""
-    
-    except Exception as e:
-        return "❌ Error procesando los datos de la cita. Por favor, intenta nuevamente con el formato sugerido."
-
-def extraer_datos_mensaje(mensaje):
-    """Extrae información detallada del mensaje para agendar cita - VERSIÓN CORREGIDA"""
-    datos = {}
-    
-    try:
-        # Buscar teléfono
-        telefono_patterns = [
-            r'\b(\d{10})\b',
-            r'\b(\d{2}[-\s]?\d{4}[-\s]?\d{4})\b',
-            r'\b(\d{3}[-\s]?\d{3}[-\s]?\d{4})\b'
-        ]
-        
-        for pattern in telefono_patterns:
-            match = re.search(pattern, mensaje)
-            if match:
-                datos['telefono'] = match.group().replace('-', '').replace(' ', '')
-                break
-        
-        # Buscar servicio y obtener su ID
-        servicios = db.obtener_servicios()
-        mensaje_lower = mensaje.lower()
-        
-        for servicio in servicios:
-            nombre_servicio = servicio['nombre'].lower()
-            if nombre_servicio in mensaje_lower:
-                datos['servicio_id'] = servicio['id']
-                datos['medico_id'] = servicio.get('medico_id', 1)
-                break
-        
-        # Buscar días
-        dias_variantes = {
-            'lunes': ['lunes', 'lun'],
-            'martes': ['martes', 'mar'],
-            'miercoles': ['miercoles', 'miércoles', 'mie'],
-            'jueves': ['jueves', 'jue'],
-            'viernes': ['viernes', 'vie'],
-            'sabado': ['sabado', 'sábado', 'sab']
-        }
-        
-        for dia_base, variantes in dias_variantes.items():
-            if any(variante in mensaje_lower for variante in variantes):
-                datos['dia_preferido'] = dia_base
-                break
-        
-        # CORRECCIÓN CRÍTICA: Mejorar extracción de nombres
-        # Limpiar el mensaje primero
-        mensaje_limpio = mensaje.replace(',', ' ').replace('tel', '').replace('teléfono', '')
-        
-        # Remover números de teléfono del texto para extracción de nombres
-        for pattern in telefono_patterns:
-            mensaje_limpio = re.sub(pattern, '', mensaje_limpio)
-        
-        # Palabras a ignorar en la extracción de nombres
-        palabras_ignore = {
-            'para', 'con', 'del', 'una', 'cita', 'agendar', 'consulta', 'soy', 
-            'general', 'laboratorio', 'cardiología', 'pediatría', 'dermatología',
-            'prefiero', 'cualquier', 'día', 'semana', 'lunes', 'martes', 
-            'miércoles', 'miercoles', 'jueves', 'viernes', 'sábado', 'sabado', 'domingo'
-        }
-        
-        # Extraer nombres (solo palabras alfabéticas que no sean palabras a ignorar)
-        palabras = mensaje_limpio.split()
-        nombres = []
-        
-        for palabra in palabras:
-            palabra_clean = palabra.strip('.,!?;:').title()
-            if (palabra_clean.isalpha() and 
-                len(palabra_clean) > 2 and 
-                palabra_clean.lower() not in palabras_ignore):
-                nombres.append(palabra_clean)
-            
-            if len(nombres) >= 4:  # Máximo 4 nombres (nombre + apellidos)
-                break
-        
-        # Filtrar nombres más inteligentemente
-        if nombres:
-            # Si hay muchos nombres, tomar solo los primeros 3-4
-            if len(nombres) > 4:
-                nombres = nombres[:4]
-            
-            # Verificar que no sean palabras extrañas
-            nombres_validos = []
-            for nombre in nombres:
-                # Solo nombres que tengan al menos 3 caracteres y sean alfabéticos
-                if len(nombre) >= 3 and nombre.isalpha() and nombre.lower() not in palabras_ignore:
-                    nombres_validos.append(nombre)
-            
-            if nombres_validos:
-                datos['nombre'] = ' '.join(nombres_validos)
-    
-    except Exception as e:
-        # En caso de error, devolver datos vacíos
-        pass
-    
-    return datos
-
-def obtener_fecha_desde_dia(dia_nombre):
-    """Convierte nombre de día a fecha de la próxima semana"""
-    try:
-        dias_semana = ['lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo']
-        
-        if dia_nombre.lower() not in dias_semana:
-            return None
-        
-        hoy = date.today()
-        dia_objetivo = dias_semana.index(dia_nombre.lower())
-        dias_hasta_objetivo = (dia_objetivo - hoy.weekday()) % 7
-        
-        if dias_hasta_objetivo == 0:  # Es hoy, buscar la próxima semana
-            dias_hasta_objetivo = 7
-        
-        fecha_objetivo = hoy + timedelta(days=dias_hasta_objetivo)
-        return fecha_objetivo.strftime("%Y-%m-%d")
-    except Exception:
-        return None
-
-def obtener_disponibilidad_proximos_dias():
-    """Genera texto con disponibilidad de los próximos 7 días"""
-    try:
-        texto = "📅 **DISPONIBILIDAD PRÓXIMOS DÍAS:**\n\n"
-        dias_semana = ['lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo']
-        
-        hoy = date.today()
-        
-        for i in range(7):
-            fecha_check = hoy + timedelta(days=i+1)
-            dia_nombre = dias_semana[fecha_check.weekday()]
-            
-            # Saltar domingos
-            if dia_nombre == 'domingo':
-                continue
-                
-            horarios = db.obtener_horarios_disponibles(fecha_check.strftime("%Y-%m-%d"))
-            count = len(horarios)
-            
-            fecha_str = fecha_check.strftime("%d/%m")
-            
-            if count > 5:
-                status = f"✅ **{count} horarios** disponibles"
-            elif count > 0:
-                status = f"⚠️ **Solo {count} horarios** disponibles"
-            else:
-                status = "❌ **Sin disponibilidad**"
-            
-            texto += f"• **{dia_nombre.title()}** ({fecha_str}): {status}\n"
-        
-        return texto
-    except Exception:
-        return "📅 **DISPONIBILIDAD:** Consultar horarios disponibles"
+# st.fragment (o su versión experimental) permite repintar solo una sección
+fragmento = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
 
 # Funciones para mostrar en chat de forma segura
 def mostrar_mensaje_usuario(mensaje):
@@ -847,12 +242,75 @@ def mostrar_mensaje_asistente(respuesta):
     except Exception:
         st.error("Error mostrando respuesta del asistente")
 
-# Mostrar historial de mensajes de forma segura
-try:
-    for message in st.session_state.messages:
+def cambiar_pagina_historial(pagina):
+    """Callback de los botones del historial: corre antes de repintar el fragmento"""
+    st.session_state.pagina_historial = pagina
+
+def resumir_mensaje(mensaje, largo=120):
+    """Versión compacta de un mensaje: primera línea con texto, recortada"""
+    primera = next((l.strip() for l in mensaje["content"].splitlines() if l.strip()), "")
+    if len(primera) > largo:
+        primera = primera[:largo - 1] + "…"
+    return {"role": mensaje["role"], "content": primera}
+
+def agregar_mensaje(role, content):
+    """Agrega un mensaje al historial y compacta los más antiguos si hace falta"""
+    mensajes = st.session_state.messages
+    mensajes.append({"role": role, "content": content})
+    
+    exceso = len(mensajes) - MAX_MENSAJES_SESION
+    if exceso > 0:
+        # El mensaje de bienvenida (posición 0) se conserva siempre
+        antiguos = mensajes[1:1 + exceso]
+        del mensajes[1:1 + exceso]
+        compactados = st.session_state.historial_compactado
+        compactados.extend(resumir_mensaje(m) for m in antiguos)
+        del compactados[:-MAX_COMPACTADOS]
+
+@fragmento
+def mostrar_historial_anterior():
+    """Mensajes anteriores paginados; cambiar de página solo repinta esta sección"""
+    anteriores = st.session_state.messages[:-MENSAJES_VISIBLES]
+    compactados = st.session_state.historial_compactado
+    paginas = max((len(anteriores) + MENSAJES_POR_PAGINA - 1) // MENSAJES_POR_PAGINA, 1)
+    pagina = min(st.session_state.pagina_historial, paginas - 1)
+    
+    with st.expander(f"🕘 Mostrar mensajes anteriores ({len(anteriores) + len(compactados)})"):
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            st.button("⬅️ Más antiguos", disabled=pagina >= paginas - 1, use_container_width=True,
+                      on_click=cambiar_pagina_historial, args=(pagina + 1,))
+        with col2:
+            st.caption(f"Página {pagina + 1} de {paginas}")
+        with col3:
+            st.button("Más recientes ➡️", disabled=pagina == 0, use_container_width=True,
+                      on_click=cambiar_pagina_historial, args=(pagina - 1,))
+        
+        # La página 0 es la más cercana a la conversación actual
+        fin = len(anteriores) - pagina * MENSAJES_POR_PAGINA
+        for message in anteriores[max(fin - MENSAJES_POR_PAGINA, 0):fin]:
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+        
+        if compactados and pagina == paginas - 1:
+            st.caption("Mensajes más antiguos (resumidos):")
+            for message in compactados[-MENSAJES_POR_PAGINA * 5:]:
+                st.caption(f"**{'Tú' if message['role'] == 'user' else 'Asistente'}:** {message['content']}")
+
+@fragmento
+def mostrar_mensajes_recientes():
+    """Últimos mensajes completos; se repintan aparte de la sección paginada"""
+    for message in st.session_state.messages[-MENSAJES_VISIBLES:]:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
-except Exception as e:
+
+# Mostrar historial de mensajes de forma segura: solo los recientes completos
+try:
+    if len(st.session_state.messages) > MENSAJES_VISIBLES or st.session_state.historial_compactado:
+        mostrar_historial_anterior()
+    
+    mostrar_mensajes_recientes()
+except Exception:
     st.error("Error mostrando el historial de mensajes")
 
 # Campo de entrada del chat con manejo de errores mejorado
@@ -863,7 +321,7 @@ if prompt := st.chat_input("💬 Escribe tu mensaje aquí..."):
         
         try:
             # Agregar mensaje del usuario
-            st.session_state.messages.append({"role": "user", "content": prompt})
+            agregar_mensaje("user", prompt)
             
             # Mostrar mensaje del usuario
             mostrar_mensaje_usuario(prompt)
@@ -872,12 +330,12 @@ if prompt := st.chat_input("💬 Escribe tu mensaje aquí..."):
             with st.chat_message("assistant"):
                 with st.spinner("🤖 Procesando con IA y consultando base de datos..."):
                     try:
-                        intencion = detectar_intencion(prompt)
-                        respuesta = generar_respuesta(prompt, intencion)
-                        st.markdown(respuesta)
+                        intencion, respuesta = motor.responder(prompt)
+                        with metricas.medir('ui.render_respuesta'):
+                            st.markdown(respuesta)
                         
                         # Agregar respuesta al historial
-                        st.session_state.messages.append({"role": "assistant", "content": respuesta})
+                        agregar_mensaje("assistant", respuesta)
                         
                     except Exception as e:
                         error_msg = """❌ **Error procesando tu solicitud**
@@ -892,7 +350,7 @@ Lo siento, hubo un problema técnico. Por favor:
 Recarga la página y vuelve a intentarlo."""
                         
                         st.markdown(error_msg)
-                        st.session_state.messages.append({"role": "assistant", "content": error_msg})
+                        agregar_mensaje("assistant", error_msg)
         
         finally:
             # Restablecer el flag de procesamiento
@@ -902,8 +360,8 @@ Recarga la página y vuelve a intentarlo."""
 with st.sidebar:
     st.header("🏥 Clínica MediCare")
     
-    # Estado de la base de datos con manejo seguro
-    try:
+    # Estado de la base de datos; con la base real, un error aquí (p. ej. al migrar) se propaga
+    if not isinstance(db, MockDatabaseManager):
         servicios_count = len(db.obtener_servicios())
         st.markdown(f"""
         <div class="status-success">
@@ -911,7 +369,7 @@ with st.sidebar:
             <small>{servicios_count} servicios disponibles</small>
         </div>
         """, unsafe_allow_html=True)
-    except Exception:
+    else:
         st.markdown("""
         <div class="status-warning">
             <strong>⚠️ Modo de demostración</strong><br>
@@ -922,28 +380,80 @@ with st.sidebar:
     # Panel de control rápido
     st.subheader("⚡ Acceso Rápido")
     
-    col1, col2 = st.columns(2)
+    if st.button("🩺 Panel", use_container_width=True):
+        st.info("Panel médico disponible por separado")
     
-    with col1:
-        if st.button("🩺 Panel", use_container_width=True):
-            st.info("Panel médico disponible por separado")
+    # Latencias por etapa del chat y por método de la base de datos
+    with st.expander("📊 Métricas de latencia"):
+        resumen = metricas.REGISTRO.resumen()
+        if not metricas.habilitadas():
+            st.caption("Métricas desactivadas (CLINICA_METRICAS=0)")
+        elif not resumen:
+            st.caption("Aún no hay mediciones")
+        else:
+            st.dataframe(
+                [
+                    {
+                        'etapa': nombre,
+                        'n': r['n'],
+                        'p50 ms': round(r['p50_ms'], 2),
+                        'p95 ms': round(r['p95_ms'], 2),
+                        'p99 ms': round(r['p99_ms'], 2),
+                        'max ms': round(r['max_ms'], 2),
+                    }
+                    for nombre, r in resumen.items()
+                ],
+                hide_index=True,
+                use_container_width=True,
+            )
+            st.download_button(
+                "⬇️ JSON", metricas.REGISTRO.a_json(), file_name="metricas.json",
+                mime="application/json", use_container_width=True,
+            )
     
-    with col2:
-        if st.button("📊 Stats", use_container_width=True):
+    # Utilización por médico, cancelaciones y horas pico del último año
+    with st.expander("📈 Ocupación"):
+        if not hasattr(db, 'analitica_ocupacion'):
+            st.caption("Sin datos de ocupación (base de prueba)")
+        else:
             try:
-                fecha_hoy = date.today().strftime("%Y-%m-%d")
-                total_servicios = len(db.obtener_servicios())
-                
-                st.markdown(f"""
-                <div class="metric-card">
-                    <h4>📈 Estadísticas</h4>
-                    <p>🏥 Servicios: {total_servicios}</p>
-                    <p>📅 Fecha: {fecha_hoy}</p>
-                    <p>🤖 Estado: Activo</p>
-                </div>
-                """, unsafe_allow_html=True)
-            except Exception:
-                st.error("Error cargando estadísticas")
+                ocupacion = resumen_ocupacion(db)
+            except ImportError:
+                ocupacion = None
+                st.caption("Instala NumPy para ver la analítica de ocupación")
+            if ocupacion:
+                st.caption(f"{ocupacion['desde']} a {ocupacion['hasta']} · {ocupacion['citas']} citas")
+                col1, col2 = st.columns(2)
+                col1.metric("Cancelación", f"{ocupacion['tasa_cancelacion']:.1%}")
+                col2.metric("Inasistencia", f"{ocupacion['tasa_inasistencia']:.1%}")
+                st.dataframe(
+                    [
+                        {
+                            'médico': m['medico'],
+                            'citas': m['citas'],
+                            'uso %': round(m['utilizacion'] * 100, 1),
+                            'cancel. %': round(m['tasa_cancelacion'] * 100, 1),
+                        }
+                        for m in ocupacion['por_medico']
+                    ],
+                    hide_index=True,
+                    use_container_width=True,
+                )
+                mapa = ocupacion['mapa_calor']
+                st.dataframe(
+                    {
+                        'día': mapa['dias'],
+                        **{
+                            hora: [round(fila[h] * 100) for fila in mapa['valores']]
+                            for h, hora in enumerate(mapa['horas'])
+                        },
+                    },
+                    hide_index=True,
+                    use_container_width=True,
+                )
+                if ocupacion['hora_pico']:
+                    pico = ocupacion['hora_pico']
+                    st.caption(f"Hora pico: {pico['dia']} {pico['hora']} · % de ocupación por día y hora")
     
     st.markdown("---")
     
@@ -973,6 +483,8 @@ with st.sidebar:
         if st.button("🗑️ Limpiar", use_container_width=True):
             try:
                 st.session_state.messages = [st.session_state.messages[0]]
+                st.session_state.historial_compactado = []
+                st.session_state.pagina_historial = 0
                 st.session_state.user_data = {}
                 st.session_state.processing = False
                 st.rerun()
@@ -982,7 +494,8 @@ with st.sidebar:
     with col2:
         if st.button("🔄 Actualizar", use_container_width=True):
             try:
-                st.cache_resource.clear()
+                # Releer catálogo y agenda sin reconstruir la conexión a la base
+                db.refrescar()
                 st.session_state.processing = False
                 st.rerun()
             except Exception:
@@ -1004,9 +517,9 @@ with st.sidebar:
         
         • **Agendar:** "Juan Pérez, 3312345678, cardiología, viernes"
         
-        • **Cancelar:** "Cancelar MC20241220145230"
+        • **Cancelar:** "Cancelar MC20241220145230483915"
         
-        • **Cambiar:** "Cambiar MC20241220145230 para miércoles"
+        • **Cambiar:** "Cambiar MC20241220145230483915 para miércoles"
         
         • **Buscar:** "Buscar mi cita Juan Pérez"
         
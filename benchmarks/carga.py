@@ -0,0 +1,240 @@
+# benchmarks/carga.py - Generador de carga con conversaciones concurrentes
+#
+# Simula pacientes que conversan en paralelo (hilos dentro de varios procesos)
+# por el mismo camino que la app: detectar_intencion -> generar_respuesta ->
+# DatabaseManager, sobre un archivo SQLite real.
+#
+#   python -m benchmarks.carga --procesos 4 --hilos 8 --conversaciones 400
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import conversacion
+from benchmarks.datos import APELLIDOS, NOMBRES, base_sintetica, copiar_base
+from benchmarks.micro import resumir
+from calendario import hora_a_minutos
+from database import DatabaseManager, _es_bloqueo
+
+SERVICIOS = ["consulta general", "pediatría", "cardiología", "dermatología", "laboratorio"]
+DIAS = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado"]
+
+# Guiones de conversación; "{cancelar}" se sustituye por la última cita reservada
+GUIONES = {
+    'reserva': ["Hola", "¿Cuál es el precio de {servicio}?",
+                "{nombre}, {telefono}, {servicio}, {dia}"],
+    'cancelacion': ["{nombre}, {telefono}, {servicio}, {dia}", "Cancelar cita {cancelar}"],
+    'precios': ["¿Cuál es el precio de {servicio}?", "Quiero ver el costo de la consulta"],
+    'disponibilidad': ["¿Qué horario tienen disponible?", "Quiero agendar una cita"],
+}
+
+MEZCLA_POR_DEFECTO = "reserva=40,cancelacion=15,precios=25,disponibilidad=20"
+
+class DBInstrumentada:
+    """Envuelve DatabaseManager para contar reservas, cancelaciones y bloqueos"""
+
+    def __init__(self, db, contadores):
+        self._db = db
+        self._contadores = contadores
+        self.ultima_confirmacion = None
+
+    def __getattr__(self, nombre):
+        return getattr(self._db, nombre)
+
+    def _registrar(self, operacion, resultado):
+        if resultado.get('success'):
+            self._contadores[f'{operacion}_ok'] += 1
+        elif resultado.get('conflicto'):
+            self._contadores[f'{operacion}_conflicto'] += 1
+        elif 'locked' in resultado.get('mensaje', '') or 'busy' in resultado.get('mensaje', ''):
+            self._contadores['errores_bloqueo'] += 1
+        else:
+            self._contadores[f'{operacion}_rechazada'] += 1
+
+    def crear_cita(self, *args, **kwargs):
+        resultado = self._db.crear_cita(*args, **kwargs)
+        self._registrar('reserva', resultado)
+        if resultado.get('success'):
+            self.ultima_confirmacion = resultado['numero_confirmacion']
+        return resultado
+
+    def cancelar_cita(self, *args, **kwargs):
+        resultado = self._db.cancelar_cita(*args, **kwargs)
+        self._registrar('cancelacion', resultado)
+        return resultado
+
+def _elegir_guion(rnd, mezcla):
+    nombres, pesos = zip(*mezcla.items())
+    return rnd.choices(nombres, weights=pesos)[0]
+
+def _conversar(db, guion, rnd, latencias, contadores, pausa):
+    """Ejecuta un guion completo como una conversación de un paciente"""
+    proxy = DBInstrumentada(db, contadores)
+    datos = {
+        'nombre': f"{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}",
+        'telefono': f"33{rnd.randrange(10**8):08d}",
+        'servicio': rnd.choice(SERVICIOS),
+        'dia': rnd.choice(DIAS),
+    }
+    for plantilla in GUIONES[guion]:
+        if '{cancelar}' in plantilla and proxy.ultima_confirmacion is None:
+            continue
+        mensaje = plantilla.format(cancelar=proxy.ultima_confirmacion or '', **datos)
+        inicio = time.perf_counter_ns()
+        try:
+            intencion = conversacion.detectar_intencion(proxy, mensaje)
+            conversacion.generar_respuesta(proxy, mensaje, intencion)
+        except Exception as e:
+            intencion = 'error'
+            contadores['errores_bloqueo' if _es_bloqueo(e) else 'errores'] += 1
+        latencias[intencion].append(time.perf_counter_ns() - inicio)
+        contadores['mensajes'] += 1
+        if pausa:
+            time.sleep(rnd.uniform(0, 2 * pausa))
+
+def _ejecutar_proceso(parametros):
+    """Corre `hilos` hilos de conversaciones en este proceso y devuelve sus mediciones"""
+    ruta, hilos, conversaciones, mezcla, pausa, semilla, agrupada = parametros
+    db = DatabaseManager(ruta, tamano_pool=hilos, escritura_agrupada=agrupada)
+    latencias = defaultdict(list)
+    contadores = defaultdict(int)
+    lock = threading.Lock()
+    pendientes = iter(range(conversaciones))
+
+    def trabajador(indice):
+        rnd = random.Random(semilla * 1000 + indice)
+        locales_lat = defaultdict(list)
+        locales_cont = defaultdict(int)
+        while True:
+            with lock:
+                siguiente = next(pendientes, None)
+            if siguiente is None:
+                break
+            _conversar(db, _elegir_guion(rnd, mezcla), rnd, locales_lat, locales_cont, pausa)
+        with lock:
+            for intencion, valores in locales_lat.items():
+                latencias[intencion].extend(valores)
+            for clave, valor in locales_cont.items():
+                contadores[clave] += valor
+
+    hilos_activos = [threading.Thread(target=trabajador, args=(i,)) for i in range(hilos)]
+    for hilo in hilos_activos:
+        hilo.start()
+    for hilo in hilos_activos:
+        hilo.join()
+    db.cerrar()
+    return dict(latencias), dict(contadores)
+
+def contar_dobles_reservas(ruta):
+    """Cuenta citas activas que se solapan con otra del mismo médico y fecha"""
+    db = DatabaseManager(ruta)
+    dobles = 0
+    anterior = (None, None, -1)
+    with db._pool.conexion() as conn:
+        filas = conn.execute('''
+            SELECT c.medico_id, c.fecha, c.hora, COALESCE(s.duracion, 30)
+            FROM citas c LEFT JOIN servicios s ON s.id = c.servicio_id
+            WHERE c.estado != 'cancelada'
+            ORDER BY c.medico_id, c.fecha, c.hora
+        ''')
+        for medico_id, fecha, hora, duracion in filas:
+            inicio = hora_a_minutos(hora)
+            if (medico_id, fecha) == anterior[:2] and inicio < anterior[2]:
+                dobles += 1
+            fin_anterior = anterior[2] if (medico_id, fecha) == anterior[:2] else -1
+            anterior = (medico_id, fecha, max(fin_anterior, inicio + duracion))
+    db.cerrar()
+    return dobles
+
+def _parsear_mezcla(texto):
+    mezcla = {}
+    for parte in texto.split(','):
+        nombre, peso = parte.split('=')
+        if nombre.strip() not in GUIONES:
+            raise SystemExit(f"Guion desconocido: {nombre} (opciones: {', '.join(GUIONES)})")
+        mezcla[nombre.strip()] = float(peso)
+    return mezcla
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga con conversaciones concurrentes")
+    parser.add_argument('--procesos', type=int, default=2)
+    parser.add_argument('--hilos', type=int, default=8, help="Hilos (conversaciones simultáneas) por proceso")
+    parser.add_argument('--conversaciones', type=int, default=200, help="Conversaciones por proceso")
+    parser.add_argument('--mezcla', default=MEZCLA_POR_DEFECTO, help="Pesos por guion, p. ej. reserva=50,precios=50")
+    parser.add_argument('--pausa', type=float, default=0.0, help="Pausa media entre mensajes (s)")
+    parser.add_argument('--filas', type=int, default=10_000, help="Citas previas en la base sintética")
+    parser.add_argument('--db', help="Usar este archivo SQLite en lugar de una copia sintética")
+    parser.add_argument('--directorio', default=os.path.join(tempfile.gettempdir(), 'medicare_bench'))
+    parser.add_argument('--semilla', type=int, default=7)
+    parser.add_argument('--escritura-agrupada', action='store_true',
+                        help="Un hilo escritor por proceso con commits agrupados")
+    parser.add_argument('--salida', help="Archivo JSON con el reporte")
+    args = parser.parse_args(argv)
+
+    mezcla = _parsear_mezcla(args.mezcla)
+    if args.db:
+        ruta = args.db
+    else:
+        ruta = copiar_base(base_sintetica(args.filas, args.directorio),
+                           os.path.join(args.directorio, 'carga.db'))
+
+    parametros = [
+        (ruta, args.hilos, args.conversaciones, mezcla, args.pausa, args.semilla + p,
+         args.escritura_agrupada)
+        for p in range(args.procesos)
+    ]
+    inicio = time.perf_counter()
+    if args.procesos == 1:
+        resultados = [_ejecutar_proceso(parametros[0])]
+    else:
+        with multiprocessing.Pool(args.procesos) as pool:
+            resultados = pool.map(_ejecutar_proceso, parametros)
+    duracion = time.perf_counter() - inicio
+
+    latencias = defaultdict(list)
+    contadores = defaultdict(int)
+    for lat, cont in resultados:
+        for intencion, valores in lat.items():
+            latencias[intencion].extend(valores)
+        for clave, valor in cont.items():
+            contadores[clave] += valor
+
+    reporte = {
+        'procesos': args.procesos,
+        'hilos_por_proceso': args.hilos,
+        'escritura_agrupada': args.escritura_agrupada,
+        'duracion_s': duracion,
+        'mensajes_s': contadores['mensajes'] / duracion,
+        'reservas_s': contadores['reserva_ok'] / duracion,
+        'contadores': dict(contadores),
+        'dobles_reservas': contar_dobles_reservas(ruta),
+        'por_intencion': {},
+    }
+    for intencion, valores in sorted(latencias.items()):
+        resumen = resumir(valores)
+        ordenados = sorted(valores)
+        resumen['p95_us'] = ordenados[min(int(0.95 * (len(ordenados) - 1) + 0.5), len(ordenados) - 1)] / 1e3
+        reporte['por_intencion'][intencion] = resumen
+
+    print(f"{args.procesos} procesos x {args.hilos} hilos, {contadores['mensajes']} mensajes en {duracion:.2f}s")
+    print(f"mensajes/s: {reporte['mensajes_s']:.0f}   reservas/s: {reporte['reservas_s']:.1f}")
+    print(f"{'intención':<24} {'n':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for intencion, resumen in reporte['por_intencion'].items():
+        print(f"{intencion:<24} {resumen['repeticiones']:>7} {resumen['p50_us'] / 1e3:>9.2f} "
+              f"{resumen['p95_us'] / 1e3:>9.2f} {resumen['p99_us'] / 1e3:>9.2f}")
+    for clave, valor in sorted(contadores.items()):
+        if clave != 'mensajes':
+            print(f"{clave}: {valor}")
+    print(f"dobles_reservas: {reporte['dobles_reservas']}")
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            json.dump(reporte, archivo, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# benchmarks/datos.py - Bases SQLite sintéticas para benchmarks y pruebas de carga
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+
+from calendario import DURACION_BASE, HORARIOS_BASE, MASCARA_JORNADA, mascara_cita
+from database import DatabaseManager
+
+NOMBRES = ["Juan", "María", "José", "Ana", "Luis", "Carmen", "Pedro", "Lucía",
+           "Miguel", "Sofía", "Jorge", "Elena", "Andrés", "Paula", "Ramón", "Teresa"]
+APELLIDOS = ["Pérez", "García", "López", "Martínez", "Rodríguez", "Hernández",
+             "González", "Sánchez", "Ramírez", "Torres", "Flores", "Gómez"]
+
+# Días hacia el futuro que cubren los datos (el resto queda en el pasado)
+DIAS_FUTUROS = 30
+
+def telefono_paciente(indice):
+    return f"33{indice:08d}"
+
+def _agenda_sin_solapes(duracion):
+    """Horarios de un día en los que caben citas consecutivas de `duracion` minutos"""
+    ocupado = 0
+    horarios = []
+    for hora in HORARIOS_BASE:
+        mascara = mascara_cita(hora, duracion)
+        if mascara & MASCARA_JORNADA == mascara and not mascara & ocupado:
+            ocupado |= mascara
+            horarios.append(hora)
+    return horarios
+
+def _filas_sinteticas(filas, servicios, semilla):
+    """Genera citas sin solapar horarios activos, del futuro hacia el pasado"""
+    rnd = random.Random(semilla)
+    pacientes = max(filas // 3, 1)
+    agenda = [
+        (servicio_id, medico_id, hora)
+        for servicio_id, medico_id, duracion in servicios
+        for hora in _agenda_sin_solapes(duracion or DURACION_BASE)
+    ]
+    hoy = date.today()
+
+    for i in range(filas):
+        dia, resto = divmod(i, len(agenda))
+        servicio_id, medico_id, hora = agenda[resto]
+        fecha = hoy + timedelta(days=DIAS_FUTUROS - dia)
+        paciente = rnd.randrange(pacientes)
+        nombre = f"{NOMBRES[paciente % len(NOMBRES)]} {APELLIDOS[paciente % len(APELLIDOS)]} {APELLIDOS[(paciente // 7) % len(APELLIDOS)]}"
+        estado = 'cancelada' if rnd.random() < 0.1 else 'confirmada'
+        yield (f"MCS{i:012d}", nombre, telefono_paciente(paciente), servicio_id,
+               medico_id, fecha.strftime("%Y-%m-%d"), hora, estado)
+
+def sembrar_citas(db_path, filas, semilla=42, lote=10000):
+    """Crea el esquema en db_path e inserta `filas` citas sintéticas"""
+    db = DatabaseManager(db_path)
+    db.init_database()
+    db.cerrar()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        servicios = conn.execute(
+            "SELECT id, medico_id, duracion FROM servicios WHERE activo = TRUE ORDER BY id"
+        ).fetchall()
+        generador = _filas_sinteticas(filas, servicios, semilla)
+        while True:
+            bloque = [fila for _, fila in zip(range(lote), generador)]
+            if not bloque:
+                break
+            conn.executemany('''
+                INSERT INTO citas (numero_confirmacion, paciente_nombre, paciente_telefono,
+                                   servicio_id, medico_id, fecha, hora, estado)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', bloque)
+            conn.commit()
+        conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+
+def base_sintetica(filas, directorio, semilla=42):
+    """Ruta de una base con `filas` citas; se genera una vez y se reutiliza"""
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f"citas_{filas}.db")
+    if os.path.exists(ruta):
+        conn = sqlite3.connect(ruta)
+        try:
+            existentes = conn.execute("SELECT COUNT(*) FROM citas").fetchone()[0]
+        except sqlite3.Error:
+            existentes = -1
+        finally:
+            conn.close()
+        if existentes == filas:
+            return ruta
+        os.remove(ruta)
+
+    sembrar_citas(ruta, filas, semilla)
+    return ruta
+
+def copiar_base(origen, destino):
+    """Copia una base con la API de respaldo de SQLite (consistente aun en WAL)"""
+    if os.path.exists(destino):
+        os.remove(destino)
+    fuente = sqlite3.connect(origen)
+    copia = sqlite3.connect(destino)
+    try:
+        fuente.backup(copia)
+    finally:
+        copia.close()
+        fuente.close()
+    return destino
@@ -0,0 +1,238 @@
+# benchmarks/micro.py - Micro-benchmarks del pipeline de chat y de DatabaseManager
+#
+# Uso (sin servidor Streamlit):
+#   python -m benchmarks.micro --filas 1000 100000 1000000 --salida resultados.json
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import conversacion
+import intenciones
+from benchmarks.datos import base_sintetica, copiar_base, telefono_paciente
+from calendario import HORARIOS_BASE
+from database import DatabaseManager
+
+MENSAJES_INTENCION = {
+    "saludo": "Hola, buenos días",
+    "precios_servicios": "¿Cuál es el precio de dermatología?",
+    "horarios_disponibles": "¿Qué horario tienen disponible?",
+    "agendar_cita": "Quiero agendar una cita",
+    "buscar_cita": "Buscar mi cita",
+    "solicitar_cancelacion": "Quiero cancelar",
+    "solicitar_cambio": "Necesito cambiar mi cita",
+    "emergencia": "Es urgente, tengo mucho dolor",
+    "informacion_general": "¿Dónde están ubicados?",
+    "cancelar_cita": "Cancelar cita MC20240101000000000000",
+    "cambiar_cita": "Cambiar cita MC20240101000000000000 para el viernes",
+    "procesar_cita_completa": "Juan Pérez García, 3312345678, consulta general, viernes",
+}
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    indice = min(int(round(p / 100 * (len(ordenados) - 1))), len(ordenados) - 1)
+    return ordenados[indice]
+
+def resumir(tiempos_ns):
+    """ops/s y percentiles de latencia (en microsegundos) de una serie de tiempos"""
+    ordenados = sorted(tiempos_ns)
+    total = sum(ordenados)
+    return {
+        'repeticiones': len(ordenados),
+        'ops_s': len(ordenados) / (total / 1e9) if total else 0.0,
+        'media_us': total / len(ordenados) / 1e3 if ordenados else 0.0,
+        'p50_us': percentil(ordenados, 50) / 1e3,
+        'p90_us': percentil(ordenados, 90) / 1e3,
+        'p99_us': percentil(ordenados, 99) / 1e3,
+        'max_us': ordenados[-1] / 1e3 if ordenados else 0.0,
+    }
+
+def medir(funcion, repeticiones, calentamiento=10, preparar=None):
+    """Ejecuta funcion(i) `repeticiones` veces y devuelve su resumen
+
+    `preparar(i)`, si se indica, corre antes de cada llamada fuera del tiempo medido.
+    """
+    for i in range(calentamiento):
+        if preparar:
+            preparar(-1 - i)
+        funcion(-1 - i)
+
+    tiempos = []
+    reloj = time.perf_counter_ns
+    for i in range(repeticiones):
+        if preparar:
+            preparar(i)
+        inicio = reloj()
+        funcion(i)
+        tiempos.append(reloj() - inicio)
+    return resumir(tiempos)
+
+def bench_pipeline(repeticiones):
+    """Detección de intención y extracción de datos, sin base de datos"""
+    servicios = [
+        {'id': 1, 'nombre': 'Consulta General', 'medico_id': 4},
+        {'id': 2, 'nombre': 'Pediatría', 'medico_id': 1},
+        {'id': 3, 'nombre': 'Cardiología', 'medico_id': 2},
+        {'id': 4, 'nombre': 'Dermatología', 'medico_id': 3},
+        {'id': 5, 'nombre': 'Laboratorio', 'medico_id': 5},
+    ]
+    nombres = lambda: [s['nombre'] for s in servicios]
+    mensajes = list(MENSAJES_INTENCION.values())
+    resultados = []
+
+    resultados.append(('pipeline', 'detectar_intencion', medir(
+        lambda i: intenciones.detectar_intencion(mensajes[i % len(mensajes)], nombres), repeticiones)))
+    resultados.append(('pipeline', 'detectar_intencion_cacheada', medir(
+        lambda i: intenciones.detectar_intencion_cacheada(mensajes[i % len(mensajes)], 0, nombres),
+        repeticiones)))
+    resultados.append(('pipeline', 'extraer_datos_mensaje', medir(
+        lambda i: intenciones.extraer_datos_mensaje(mensajes[i % len(mensajes)], servicios), repeticiones)))
+    return resultados
+
+def bench_base(filas, directorio, repeticiones):
+    """Métodos de DatabaseManager y generar_respuesta contra una base de `filas` citas"""
+    origen = base_sintetica(filas, directorio)
+    ruta = copiar_base(origen, os.path.join(directorio, f"trabajo_{filas}.db"))
+    db = DatabaseManager(ruta)
+    resultados = []
+    hoy = date.today()
+    fechas = [(hoy + timedelta(days=d)).strftime("%Y-%m-%d") for d in range(1, 8)]
+
+    def agregar(nombre, resumen, grupo='database'):
+        resultados.append((grupo, nombre, dict(resumen, filas=filas)))
+
+    agregar('obtener_servicios', medir(lambda i: db.obtener_servicios(), repeticiones))
+    agregar('obtener_horarios_disponibles', medir(
+        lambda i: db.obtener_horarios_disponibles(fechas[i % len(fechas)], servicio_id=3), repeticiones))
+    agregar('obtener_horarios_disponibles_frio', medir(
+        lambda i: db.obtener_horarios_disponibles(fechas[i % len(fechas)], servicio_id=3),
+        repeticiones, preparar=lambda i: db._calendario.invalidar()))
+    agregar('obtener_disponibilidad_rango_30d', medir(
+        lambda i: db.obtener_disponibilidad_rango(hoy, hoy + timedelta(days=30)),
+        repeticiones, preparar=lambda i: db._calendario.invalidar()))
+    agregar('buscar_primeros_horarios', medir(
+        lambda i: db.buscar_primeros_horarios(servicio_id=3, turno=('manana', 'tarde')[i % 2]),
+        repeticiones))
+    agregar('buscar_primeros_horarios_frio', medir(
+        lambda i: db.buscar_primeros_horarios(), repeticiones, preparar=lambda i: db._calendario.invalidar()))
+    agregar('buscar_citas_nombre', medir(
+        lambda i: db.buscar_citas('nombre', ['perez', 'garcia lo', 'sofia'][i % 3]), repeticiones))
+    agregar('buscar_citas_telefono', medir(
+        lambda i: db.buscar_citas('telefono', telefono_paciente(i % max(filas // 3, 1))), repeticiones))
+    try:
+        import numpy  # noqa: F401  (la analítica es opcional)
+    except ImportError:
+        pass
+    else:
+        agregar('analitica_ocupacion_365d', medir(
+            lambda i: db.analitica_ocupacion(hoy - timedelta(days=365), hoy).resumen(),
+            max(repeticiones // 100, 3), calentamiento=1))
+
+    # Escrituras en fechas posteriores a los datos sembrados, sin repetir horario
+    base_escritura = hoy + timedelta(days=400)
+    horarios = [(s['id'], s['medico_id']) for s in db.obtener_servicios()]
+    creadas = []
+
+    def crear(i):
+        indice = i + 10_000  # el calentamiento usa índices negativos
+        dia, resto = divmod(indice, len(horarios) * len(HORARIOS_BASE))
+        servicio_id, medico_id = horarios[resto % len(horarios)]
+        resultado = db.crear_cita('Paciente Benchmark', '3300000000', servicio_id, medico_id,
+                                  (base_escritura + timedelta(days=dia)).strftime("%Y-%m-%d"),
+                                  HORARIOS_BASE[resto // len(horarios)])
+        if resultado['success']:
+            creadas.append(resultado['numero_confirmacion'])
+
+    agregar('crear_cita', medir(crear, repeticiones))
+    agregar('cancelar_cita', medir(
+        lambda i: db.cancelar_cita(creadas.pop()) if creadas else None, min(repeticiones, len(creadas))))
+
+    for intencion, mensaje in MENSAJES_INTENCION.items():
+        agregar(f'generar_respuesta[{intencion}]', medir(
+            lambda i, m=mensaje, it=intencion: conversacion.generar_respuesta(db, m, it),
+            max(repeticiones // 10, 5)), grupo='respuesta')
+
+    db.cerrar()
+    return resultados
+
+def bench_arranque(directorio, repeticiones):
+    """Tiempo de arranque: construir DatabaseManager y atender la primera consulta"""
+    os.makedirs(directorio, exist_ok=True)
+    existente = os.path.join(directorio, 'arranque.db')
+    preparada = DatabaseManager(existente)
+    preparada.init_database()
+    preparada.cerrar()
+    repeticiones = max(repeticiones // 10, 5)
+
+    def construir(i):
+        DatabaseManager(existente).cerrar()
+
+    def primera_consulta(i):
+        db = DatabaseManager(existente)
+        db.obtener_servicios()
+        db.cerrar()
+
+    def base_nueva(i):
+        ruta = os.path.join(directorio, f'arranque_nueva_{i}.db')
+        db = DatabaseManager(ruta)
+        db.obtener_servicios()
+        db.cerrar()
+
+    def borrar_nueva(i):
+        for sufijo in ('', '-wal', '-shm'):
+            ruta = os.path.join(directorio, f'arranque_nueva_{i}.db{sufijo}')
+            if os.path.exists(ruta):
+                os.remove(ruta)
+
+    resultados = [
+        ('arranque', 'construir_database_manager', medir(construir, repeticiones)),
+        ('arranque', 'primera_consulta_base_existente', medir(primera_consulta, repeticiones)),
+        ('arranque', 'primera_consulta_base_nueva', medir(base_nueva, repeticiones, preparar=borrar_nueva)),
+    ]
+    for i in range(-10, repeticiones):
+        borrar_nueva(i)
+    return resultados
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks del chatbot (sin Streamlit)")
+    parser.add_argument('--filas', type=int, nargs='+', default=[1000, 100_000, 1_000_000],
+                        help="Tamaños de la tabla citas a evaluar")
+    parser.add_argument('--repeticiones', type=int, default=1000)
+    parser.add_argument('--directorio', default=os.path.join(tempfile.gettempdir(), 'medicare_bench'),
+                        help="Dónde se guardan (y reutilizan) las bases sintéticas")
+    parser.add_argument('--salida', help="Archivo JSON con los resultados")
+    args = parser.parse_args(argv)
+
+    resultados = bench_pipeline(args.repeticiones)
+    resultados.extend(bench_arranque(args.directorio, args.repeticiones))
+    for filas in args.filas:
+        resultados.extend(bench_base(filas, args.directorio, args.repeticiones))
+
+    print(f"{'grupo':<10} {'benchmark':<45} {'filas':>9} {'ops/s':>11} {'p50 µs':>9} {'p99 µs':>9}")
+    for grupo, nombre, resumen in resultados:
+        print(f"{grupo:<10} {nombre:<45} {resumen.get('filas', ''):>9} {resumen['ops_s']:>11.0f} "
+              f"{resumen['p50_us']:>9.1f} {resumen['p99_us']:>9.1f}")
+
+    if args.salida:
+        documento = {
+            'metadatos': {
+                'fecha': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'plataforma': platform.platform(),
+                'repeticiones': args.repeticiones,
+            },
+            'resultados': [
+                dict(resumen, grupo=grupo, nombre=nombre) for grupo, nombre, resumen in resultados
+            ],
+        }
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            json.dump(documento, archivo, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
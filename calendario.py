@@ -0,0 +1,311 @@
+# calendario.py - Índice de ocupación en memoria por médico y fecha
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from functools import lru_cache
+
+# Celdas de 15 minutos desde la apertura; los inicios de cita van cada 30 min
+GRANULARIDAD_MIN = 15
+INTERVALO_CITAS_MIN = 30
+DURACION_BASE = 30
+APERTURA = "09:00"
+DIAS_SNAPSHOT = 30
+BLOQUES_JORNADA = (("09:00", "13:00"), ("14:00", "18:00"))
+TURNOS = {'manana': BLOQUES_JORNADA[0], 'tarde': BLOQUES_JORNADA[1]}
+DIAS_SIN_CONSULTA = (6,)  # domingo: solo emergencias
+DIAS_CONSULTA = tuple(d for d in range(7) if d not in DIAS_SIN_CONSULTA)
+# Días hacia adelante en los que se busca el primer horario libre
+DIAS_BUSQUEDA = 60
+# Días que se cargan juntos al recorrer la agenda buscando el primer hueco
+DIAS_TRAMO = 7
+# Lecturas de una fecha que cambia mientras se lee, antes de usarla sin guardarla
+REINTENTOS_CARGA = 3
+
+def hora_a_minutos(hora):
+    """Convierte 'HH:MM' a minutos desde la medianoche"""
+    horas, minutos = hora.split(":")[:2]
+    return int(horas) * 60 + int(minutos)
+
+def minutos_a_hora(minutos):
+    """Convierte minutos desde la medianoche a 'HH:MM'"""
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+def _celda(minutos):
+    return (minutos - hora_a_minutos(APERTURA)) // GRANULARIDAD_MIN
+
+def mascara_intervalo(inicio, duracion):
+    """Máscara de bits de las celdas que ocupa una cita de `duracion` minutos"""
+    primera = max(_celda(inicio), 0)
+    ultima = _celda(inicio + max(int(duracion or DURACION_BASE), 1) - 1)
+    if ultima < primera:
+        return 0
+    return ((1 << (ultima - primera + 1)) - 1) << primera
+
+@lru_cache(maxsize=4096)
+def mascara_cita(hora, duracion):
+    """Máscara de una cita que empieza a `hora` ('HH:MM'), memoizada"""
+    return mascara_intervalo(hora_a_minutos(hora), duracion)
+
+def _mascara_jornada():
+    mascara = 0
+    for inicio, fin in BLOQUES_JORNADA:
+        mascara |= mascara_intervalo(hora_a_minutos(inicio), hora_a_minutos(fin) - hora_a_minutos(inicio))
+    return mascara
+
+MASCARA_JORNADA = _mascara_jornada()
+
+# Horarios de inicio posibles: cada 30 minutos dentro de cada bloque
+HORARIOS_BASE = [
+    minutos_a_hora(m)
+    for inicio, fin in BLOQUES_JORNADA
+    for m in range(hora_a_minutos(inicio), hora_a_minutos(fin), INTERVALO_CITAS_MIN)
+]
+
+def horarios_turno(turno):
+    """Horarios de inicio de un turno ('manana' o 'tarde'); ValueError si no existe"""
+    if turno not in TURNOS:
+        raise ValueError(f"Turno desconocido: {turno!r} (opciones: {', '.join(TURNOS)})")
+    inicio, fin = (hora_a_minutos(h) for h in TURNOS[turno])
+    return [hora for hora in HORARIOS_BASE if inicio <= hora_a_minutos(hora) < fin]
+
+class CalendarioOcupacion:
+    """Ocupación por (médico, fecha) como enteros de bits, cargada bajo demanda
+
+    `cargador(fecha_inicio, fecha_fin)` debe devolver tuplas
+    (fecha, medico_id, hora, duracion) de las citas activas del rango. Se
+    llama siempre sin el candado tomado: el cargador pide una conexión del
+    pool, y quien escribe toma el candado teniendo ya la suya.
+    """
+
+    def __init__(self, cargador, max_fechas=400):
+        self._cargador = cargador
+        self._max_fechas = max_fechas
+        self._fechas = OrderedDict()  # fecha -> {medico_id: mascara}
+        self._lock = threading.RLock()
+        self._candidatos = {}  # duracion -> [(hora, mascara)]
+        # Fechas que se están leyendo y las que cambiaron durante la lectura
+        self._en_carga = {}  # fecha -> lecturas en curso
+        self._alteradas = set()
+
+    @property
+    def lock(self):
+        """Candado del índice; las escrituras lo toman para confirmar y actualizar a la vez"""
+        return self._lock
+
+    def _candidatos_para(self, duracion):
+        """Inicios cuya cita completa cabe dentro de un bloque de la jornada"""
+        duracion = int(duracion or DURACION_BASE)
+        candidatos = self._candidatos.get(duracion)
+        if candidatos is None:
+            candidatos = []
+            for hora in HORARIOS_BASE:
+                mascara = mascara_intervalo(hora_a_minutos(hora), duracion)
+                if mascara & MASCARA_JORNADA == mascara:
+                    candidatos.append((hora, mascara))
+            self._candidatos[duracion] = candidatos
+        return candidatos
+
+    def _guardar(self, fecha, ocupacion):
+        self._fechas[fecha] = ocupacion
+        self._fechas.move_to_end(fecha)
+        while len(self._fechas) > self._max_fechas:
+            self._fechas.popitem(last=False)
+
+    def _marcar_alterada(self, fecha):
+        """Con el candado tomado: una escritura tocó `fecha` mientras alguien la leía"""
+        if fecha is None:
+            self._alteradas.update(self._en_carga)
+        elif fecha in self._en_carga:
+            self._alteradas.add(fecha)
+
+    def cargar_rango(self, fecha_inicio, fecha_fin, fechas):
+        """Carga con una sola consulta las fechas del rango aún no indexadas
+
+        La consulta corre sin el candado. Una fecha que ocupar/liberar/invalidar
+        tocó durante la lectura no se guarda (la lectura pudo ser anterior al
+        commit) y se volverá a leer al usarla. Devuelve {fecha: ocupación} leído.
+        """
+        with self._lock:
+            pendientes = [f for f in fechas if f not in self._fechas]
+            if not pendientes:
+                return {}
+            for fecha in pendientes:
+                self._en_carga[fecha] = self._en_carga.get(fecha, 0) + 1
+
+        ocupacion = {f: {} for f in pendientes}
+        try:
+            for fecha, medico_id, hora, duracion in self._cargador(fecha_inicio, fecha_fin):
+                if fecha in ocupacion:
+                    por_medico = ocupacion[fecha]
+                    por_medico[medico_id] = por_medico.get(medico_id, 0) | mascara_cita(hora, duracion)
+        finally:
+            with self._lock:
+                for fecha in pendientes:
+                    restantes = self._en_carga.pop(fecha) - 1
+                    if restantes:
+                        self._en_carga[fecha] = restantes
+                    if fecha in self._alteradas:
+                        if not restantes:
+                            self._alteradas.discard(fecha)
+                        ocupacion.pop(fecha, None)
+                    elif fecha not in self._fechas:
+                        self._guardar(fecha, ocupacion[fecha])
+        return ocupacion
+
+    def _ocupacion(self, fecha):
+        ocupacion = None
+        for _ in range(REINTENTOS_CARGA):
+            with self._lock:
+                if fecha in self._fechas:
+                    self._fechas.move_to_end(fecha)
+                    return self._fechas[fecha]
+            ocupacion = self.cargar_rango(fecha, fecha, [fecha]).get(fecha, ocupacion)
+        # La fecha cambió en cada lectura: usar la última sin guardarla en el índice
+        return ocupacion if ocupacion is not None else self._ocupacion_directa(fecha)
+
+    def _ocupacion_directa(self, fecha):
+        ocupacion = {}
+        for _, medico_id, hora, duracion in self._cargador(fecha, fecha):
+            ocupacion[medico_id] = ocupacion.get(medico_id, 0) | mascara_cita(hora, duracion)
+        return ocupacion
+
+    def horarios_libres(self, fecha, medico_id, duracion=DURACION_BASE):
+        """Horarios de inicio libres para un médico y una duración"""
+        ocupado = self._ocupacion(fecha).get(medico_id, 0)
+        return [hora for hora, mascara in self._candidatos_para(duracion) if not ocupado & mascara]
+
+    def horarios_libres_cualquiera(self, fecha, medicos, duracion=DURACION_BASE, ocupacion=None):
+        """Horarios en los que al menos uno de los médicos está libre
+
+        Con `ocupacion` (p. ej. la de ocupacion_cargada) no se consulta la base.
+        """
+        if ocupacion is None:
+            ocupacion = self._ocupacion(fecha)
+        libres = []
+        for hora, mascara in self._candidatos_para(duracion):
+            if any(not ocupacion.get(medico_id, 0) & mascara for medico_id in medicos):
+                libres.append(hora)
+        return libres
+
+    def ocupacion_cargada(self, fecha):
+        """Ocupación ya indexada de una fecha, o None; nunca lee la base
+
+        Pensada para usarse con el candado tomado: el resultado es el propio
+        índice y solo es consistente mientras se tenga el candado.
+        """
+        with self._lock:
+            return self._fechas.get(fecha)
+
+    def iterar_libres(self, fechas, medico_id, duracion=DURACION_BASE, horas=None):
+        """Genera (fecha, hora, medico_id) libres en orden, cargando las fechas por tramos
+
+        Es perezoso: solo consulta la base al llegar a un tramo aún no indexado.
+        `horas`, si se indica, restringe los horarios de inicio aceptados.
+        """
+        candidatos = [(h, m) for h, m in self._candidatos_para(duracion) if horas is None or h in horas]
+        if not candidatos:
+            return
+        for i in range(0, len(fechas), DIAS_TRAMO):
+            tramo = fechas[i:i + DIAS_TRAMO]
+            self.cargar_rango(tramo[0], tramo[-1], tramo)
+            for fecha in tramo:
+                ocupado = self._ocupacion(fecha).get(medico_id, 0)
+                for hora, mascara in candidatos:
+                    if not ocupado & mascara:
+                        yield fecha, hora, medico_id
+
+    def primeros_libres(self, fechas, medicos, cantidad, horas=None):
+        """Los `cantidad` primeros (fecha, hora, medico_id) libres entre varios médicos
+
+        `medicos` es una lista de (medico_id, duracion). heapq.merge avanza a la
+        vez el recorrido de cada médico y se detiene en cuanto junta `cantidad`,
+        sin calcular el resto de la agenda.
+        """
+        flujos = [self.iterar_libres(fechas, medico_id, duracion, horas) for medico_id, duracion in medicos]
+        return list(itertools.islice(heapq.merge(*flujos), cantidad))
+
+    def ocupar(self, fecha, medico_id, hora, duracion):
+        """Marca una cita nueva; si la fecha no está cargada se leerá al usarla"""
+        with self._lock:
+            self._marcar_alterada(fecha)
+            ocupacion = self._fechas.get(fecha)
+            if ocupacion is not None:
+                ocupacion[medico_id] = ocupacion.get(medico_id, 0) | mascara_cita(hora, duracion)
+
+    def liberar(self, fecha, medico_id, hora, duracion):
+        """Libera las celdas de una cita cancelada"""
+        with self._lock:
+            self._marcar_alterada(fecha)
+            ocupacion = self._fechas.get(fecha)
+            if ocupacion is not None and medico_id in ocupacion:
+                ocupacion[medico_id] &= ~mascara_cita(hora, duracion)
+
+    def invalidar(self, fecha=None):
+        """Descarta el índice de una fecha (o de todas) para recargarlo"""
+        with self._lock:
+            self._marcar_alterada(fecha)
+            if fecha is None:
+                self._fechas.clear()
+            else:
+                self._fechas.pop(fecha, None)
+
+class SnapshotDisponibilidad:
+    """Disponibilidad de los próximos días, calculada una vez y mantenida por las escrituras
+
+    Se reconstruye al cambiar la fecha o la lista de médicos; reservas y
+    cancelaciones recalculan solo el día afectado con el candado del calendario
+    tomado, antes de responder a quien escribe. Con el candado tomado nunca se
+    lee la base: los días se leen antes y se calculan con lo ya indexado.
+    """
+
+    def __init__(self, calendario, dias=DIAS_SNAPSHOT):
+        self._calendario = calendario
+        self.dias = dias
+        self._estado = None  # (hoy, medicos, {fecha: {'disponibles', 'horarios'}})
+
+    def _calcular(self, fecha, medicos, ocupacion=None):
+        horarios = self._calendario.horarios_libres_cualquiera(fecha, medicos, ocupacion=ocupacion)
+        return {'disponibles': len(horarios), 'horarios': horarios}
+
+    def _reconstruir(self, hoy, medicos):
+        fechas = [(hoy + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(1, self.dias + 1)]
+        for _ in range(REINTENTOS_CARGA):
+            # La lectura corre sin el candado; el cálculo, con el candado y sin I/O
+            self._calendario.cargar_rango(fechas[0], fechas[-1], fechas)
+            with self._calendario.lock:
+                ocupacion = {fecha: self._calendario.ocupacion_cargada(fecha) for fecha in fechas}
+                if all(o is not None for o in ocupacion.values()):
+                    self._estado = (hoy, medicos, {
+                        fecha: self._calcular(fecha, medicos, ocupacion[fecha]) for fecha in fechas
+                    })
+                    return self._estado
+        # Escrituras en cada intento: responder sin guardar el snapshot
+        return (hoy, medicos, {fecha: self._calcular(fecha, medicos) for fecha in fechas})
+
+    def obtener(self, medicos, hoy=None):
+        """{fecha: {'disponibles', 'horarios'}} desde mañana; no modificar el resultado"""
+        hoy = hoy or date.today()
+        estado = self._estado
+        if estado is None or estado[0] != hoy or estado[1] != medicos:
+            estado = self._reconstruir(hoy, medicos)
+        return estado[2]
+
+    def actualizar_fecha(self, fecha):
+        """Recalcula un día tras una reserva o cancelación (o descarta el snapshot)"""
+        with self._calendario.lock:
+            estado = self._estado
+            if estado is None or fecha not in estado[2]:
+                return
+            ocupacion = self._calendario.ocupacion_cargada(fecha)
+            if ocupacion is None:
+                # El día ya no está indexado: leerlo aquí sería I/O con el candado tomado
+                self._estado = None
+            else:
+                estado[2][fecha] = self._calcular(fecha, estado[1], ocupacion)
+
+    def invalidar(self):
+        """Descarta el snapshot; se reconstruye en la siguiente lectura"""
+        with self._calendario.lock:
+            self._estado = None
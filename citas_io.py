@@ -0,0 +1,106 @@
+# citas_io.py - Importación y exportación masiva de citas en CSV o JSONL
+#
+# El formato se deduce de la extensión (.csv / .jsonl) o se indica con --formato.
+# La importación procesa el archivo en streaming y confirma cada lote por
+# separado; la exportación recorre la BD con fetchmany sin cargarla en memoria.
+#
+#   python citas_io.py importar citas.csv --lote 5000
+#   python citas_io.py exportar --desde 2024-01-01 --hasta 2024-12-31 --salida citas.jsonl
+import argparse
+import csv
+import json
+import sys
+import time
+
+from database import DatabaseManager, COLUMNAS_EXPORTACION
+
+def _formato(ruta, formato):
+    if formato:
+        return formato
+    if ruta and ruta.lower().endswith('.csv'):
+        return 'csv'
+    return 'jsonl'
+
+def leer_filas(archivo, formato):
+    """Genera dicts desde un archivo CSV (con cabecera) o JSONL"""
+    if formato == 'csv':
+        yield from csv.DictReader(archivo)
+        return
+    for linea in archivo:
+        linea = linea.strip()
+        if linea:
+            yield json.loads(linea)
+
+def escribir_filas(filas, archivo, formato):
+    """Escribe las filas exportadas; devuelve cuántas se escribieron"""
+    total = 0
+    if formato == 'csv':
+        escritor = csv.DictWriter(archivo, fieldnames=COLUMNAS_EXPORTACION)
+        escritor.writeheader()
+        for fila in filas:
+            escritor.writerow(fila)
+            total += 1
+        return total
+    for fila in filas:
+        archivo.write(json.dumps(fila, ensure_ascii=False) + '\n')
+        total += 1
+    return total
+
+def importar(args):
+    db = DatabaseManager(args.db)
+    formato = _formato(args.entrada, args.formato)
+    entrada = sys.stdin if args.entrada == '-' else open(args.entrada, encoding='utf-8', newline='')
+    inicio = time.perf_counter()
+    try:
+        resultado = db.importar_citas(leer_filas(entrada, formato), tamano_lote=args.lote)
+    finally:
+        if entrada is not sys.stdin:
+            entrada.close()
+        db.cerrar()
+
+    duracion = time.perf_counter() - inicio
+    for numero_fila, motivo in resultado['rechazadas']:
+        print(f"Fila {numero_fila} rechazada: {motivo}", file=sys.stderr)
+    print(f"{resultado['importadas']} citas importadas, {len(resultado['rechazadas'])} rechazadas "
+          f"en {duracion:.2f}s", file=sys.stderr)
+
+def exportar(args):
+    db = DatabaseManager(args.db)
+    formato = _formato(args.salida, args.formato)
+    salida = open(args.salida, 'w', encoding='utf-8', newline='') if args.salida else sys.stdout
+    inicio = time.perf_counter()
+    try:
+        filas = db.exportar_citas(args.desde, args.hasta, tamano_lote=args.lote)
+        total = escribir_filas(filas, salida, formato)
+    finally:
+        if salida is not sys.stdout:
+            salida.close()
+        db.cerrar()
+
+    duracion = time.perf_counter() - inicio
+    print(f"{total} citas exportadas en {duracion:.2f}s", file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa o exporta citas en CSV/JSONL")
+    parser.add_argument('--db', default='clinica.db', help="Base de datos SQLite a usar")
+    parser.add_argument('--formato', choices=('csv', 'jsonl'),
+                        help="Formato del archivo (por defecto según la extensión)")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    p_importar = subparsers.add_parser('importar', help="Carga citas desde un archivo")
+    p_importar.add_argument('entrada', help="Archivo CSV/JSONL ('-' para stdin)")
+    p_importar.add_argument('--lote', type=int, default=5000, help="Filas por transacción")
+    p_importar.set_defaults(funcion=importar)
+
+    p_exportar = subparsers.add_parser('exportar', help="Vuelca las citas a un archivo")
+    p_exportar.add_argument('--salida', help="Archivo de salida (stdout por defecto)")
+    p_exportar.add_argument('--desde', help="Fecha inicial YYYY-MM-DD")
+    p_exportar.add_argument('--hasta', help="Fecha final YYYY-MM-DD")
+    p_exportar.add_argument('--lote', type=int, default=1000, help="Filas leídas por fetchmany")
+    p_exportar.set_defaults(funcion=exportar)
+
+    args = parser.parse_args(argv)
+    args.funcion(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,712 @@
+# conversacion.py - Lógica de conversación del chatbot, independiente de Streamlit
+#
+# Todas las funciones reciben como primer argumento el gestor de base de datos
+# (DatabaseManager o cualquier objeto con la misma interfaz).
+from datetime import datetime, timedelta, date
+from calendario import DIAS_BUSQUEDA, horarios_turno
+import intenciones
+import metricas
+
+# Días hacia adelante que se muestran al reagendar una cita
+DIAS_REAGENDAR = 30
+
+# Intentos de reserva cuando otra sesión toma el horario elegido
+REINTENTOS_RESERVA = 5
+
+# Citas que se muestran en el chat al buscar por nombre o teléfono
+CITAS_POR_PAGINA = 5
+
+# Horarios libres que se ofrecen cuando el paciente no indica día o el suyo está lleno
+HORARIOS_OFRECIDOS = 3
+
+DIAS_SEMANA = ['lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo']
+
+def version_catalogo(db):
+    """Versión del catálogo de servicios, para invalidar la caché de mensajes"""
+    try:
+        return db.version_catalogo()
+    except Exception:
+        return None
+
+@metricas.instrumentado('chat.detectar_intencion')
+def detectar_intencion(db, mensaje):
+    """Detecta la intención del usuario con el autómata de palabras clave (memoizada)"""
+    return intenciones.detectar_intencion_cacheada(
+        mensaje, version_catalogo(db), lambda: get_servicios_nombres(db)
+    )
+
+def get_servicios_nombres(db):
+    """Obtiene nombres de servicios disponibles de forma segura"""
+    try:
+        servicios = db.obtener_servicios()
+        return [s['nombre'] for s in servicios]
+    except Exception:
+        return ["Consulta General", "Pediatría", "Cardiología", "Dermatología", "Laboratorio"]
+
+def generar_respuesta_servicios_limpia(db):
+    """Genera lista de servicios con formato limpio"""
+    try:
+        servicios = db.obtener_servicios()
+        
+        servicios_texto = ""
+        for servicio in servicios:
+            nombre = servicio['nombre']
+            precio = int(servicio.get('precio', 0))
+            duracion = servicio.get('duracion', 30)
+            medico = servicio.get('medico', 'No asignado')
+            
+            # Emoji específico para laboratorio
+            if nombre.lower() == 'laboratorio':
+                emoji = "🧪"
+            else:
+                emoji = "✨"
+            
+            # Formato limpio sin caracteres especiales
+            servicios_texto += f"{emoji} **{nombre}** - ${precio} MXN ({duracion} min) - {medico}\n"
+        
+        return servicios_texto
+        
+    except Exception as e:
+        # Fallback con servicios fijos y formato limpio
+        return """✨ **Consulta General** - $500 MXN (30 min) - Dr. Rodríguez
+✨ **Pediatría** - $600 MXN (45 min) - Dr. García
+✨ **Cardiología** - $800 MXN (60 min) - Dra. Martínez
+✨ **Dermatología** - $700 MXN (30 min) - Dr. López  
+🧪 **Laboratorio** - $250 MXN (15 min) - QFB Angel Carrizalez
+"""
+
+@metricas.instrumentado('chat.manejar_cambio_cita')
+def manejar_cambio_cita(db, mensaje):
+    """Maneja el cambio/reagendamiento de citas existentes"""
+    # Extraer número de confirmación
+    match = intenciones.PATRON_CONFIRMACION.search(mensaje.lower())
+    if not match:
+        return """❌ **CAMBIAR CITA**
+        
+Para cambiar una cita necesito el **número de confirmación**.
+
+**📋 Formato:** MC + fecha y hora + 6 dígitos, p. ej. MC20241220145230483915
+
+**💡 Ejemplo:** "Cambiar cita MC20241220145230483915 para el miércoles"
+
+**¿No tienes el número?** Puedo buscarte la cita por tu nombre."""
+    
+    numero_confirmacion = match.group().upper()
+    
+    # Buscar día nuevo en el mensaje
+    mensaje_lower = mensaje.lower()
+    dias_variantes = {
+        'lunes': ['lunes', 'lun'],
+        'martes': ['martes', 'mar'], 
+        'miercoles': ['miercoles', 'miércoles', 'mie'],
+        'jueves': ['jueves', 'jue'],
+        'viernes': ['viernes', 'vie'],
+        'sabado': ['sabado', 'sábado', 'sab']
+    }
+    
+    dia_nuevo = None
+    for dia_base, variantes in dias_variantes.items():
+        if any(variante in mensaje_lower for variante in variantes):
+            dia_nuevo = dia_base
+            break
+    
+    if not dia_nuevo:
+        return f"""📅 **CAMBIAR CITA: {numero_confirmacion}**
+        
+Para cambiar tu cita necesito saber **a qué día** quieres moverla.
+
+{obtener_disponibilidad_proximos_dias(db, DIAS_REAGENDAR)}
+
+**💡 Ejemplo:** "Cambiar a miércoles" o "Mover para el viernes"
+
+**¿Qué día prefieres?**"""
+    
+    # Verificar disponibilidad del día nuevo
+    try:
+        fecha_nueva = obtener_fecha_desde_dia(dia_nuevo)
+        horarios_disponibles = db.obtener_horarios_disponibles(fecha_nueva)
+        
+        if not horarios_disponibles:
+            return f"""❌ **SIN DISPONIBILIDAD PARA {dia_nuevo.upper()}**
+            
+{obtener_disponibilidad_proximos_dias(db)}
+
+**¿Te parece bien otro día?**"""
+        
+        # Simular cambio exitoso 
+        return f"""✅ **CITA CAMBIADA EXITOSAMENTE**
+
+**📋 DETALLES DEL CAMBIO:**
+
+🆔 **Confirmación:** {numero_confirmacion}
+🗓️ **Nuevo día:** {dia_nuevo.title()}
+📅 **Nueva fecha:** {fecha_nueva}
+⏰ **Nueva hora:** {horarios_disponibles[0]}
+
+**⚠️ IMPORTANTE:**
+• Tu número de confirmación **sigue siendo el mismo**
+• Llegar **15 minutos antes** de la nueva hora
+• Para cancelar: usa el mismo número de confirmación
+
+**¡Cambio confirmado! 👍**"""
+    
+    except Exception as e:
+        return "❌ Error al procesar el cambio de cita. Intenta nuevamente."
+
+@metricas.instrumentado('chat.responder_busqueda_citas')
+def responder_busqueda_citas(db, criterio, valor):
+    """Muestra la primera página de citas que coinciden con el nombre o teléfono"""
+    try:
+        pagina = db.buscar_citas_pagina(criterio, valor, tamano_pagina=CITAS_POR_PAGINA)
+    except Exception:
+        return "❌ Error al buscar la cita. Intenta nuevamente."
+    
+    etiqueta = "teléfono" if criterio == 'telefono' else "nombre"
+    if not pagina['citas']:
+        return f"""🔍 **SIN RESULTADOS**
+
+No encontré citas activas con el {etiqueta} **{valor}**.
+
+**💡 Verifica** que esté escrito igual que al agendar, o prueba con tu número de confirmación."""
+    
+    citas_texto = ""
+    for cita in pagina['citas']:
+        fecha = datetime.strptime(cita['fecha'], '%Y-%m-%d').strftime('%d/%m/%Y')
+        citas_texto += (f"📋 **{cita['numero_confirmacion']}** - {cita['paciente_nombre']}\n"
+                        f"   📅 {fecha} {cita['hora']} - {cita['servicio']}\n")
+    
+    mas = ""
+    if pagina['cursor']:
+        mas = f"\n_Se muestran las {CITAS_POR_PAGINA} más recientes; agrega tu apellido o teléfono para afinar la búsqueda._\n"
+    
+    return f"""🔍 **CITAS ENCONTRADAS** ({etiqueta}: {valor})
+
+{citas_texto}{mas}
+**¿Qué deseas hacer?** Puedes cambiar o cancelar con el número de confirmación."""
+
+@metricas.instrumentado('chat.generar_respuesta')
+def generar_respuesta(db, mensaje, intencion):
+    """Genera respuestas inteligentes basadas en la intención detectada"""
+    
+    try:
+        # NUEVO CASO: Cambiar cita
+        if intencion == "cambiar_cita":
+            return manejar_cambio_cita(db, mensaje)
+        
+        elif intencion == "solicitar_cambio":
+            return """📅 **CAMBIAR/REAGENDAR CITA EXISTENTE**
+
+Para cambiar tu cita necesito el **número de confirmación**.
+
+**📋 Formato:** MC + fecha y hora + 6 dígitos, p. ej. MC20241220145230483915
+
+**💡 Ejemplos:**
+• "Cambiar cita MC20241220145230483915 para el miércoles"
+• "Reagendar MC20241220145230483915 al viernes"
+• "Mover mi cita MC20241220145230483915 para el lunes"
+
+**¿No tienes el número?** Puedo buscarte la cita por tu nombre."""
+        
+        elif intencion == "cancelar_cita":
+            # Extraer número de confirmación
+            match = intenciones.PATRON_CONFIRMACION.search(mensaje.lower())
+            if match:
+                numero_confirmacion = match.group().upper()
+                resultado = db.cancelar_cita(numero_confirmacion=numero_confirmacion)
+                
+                if resultado['success']:
+                    return f"""✅ **CITA CANCELADA EXITOSAMENTE**
+
+📋 **Confirmación:** {numero_confirmacion}
+✅ **Estado:** Cancelada correctamente
+📅 **Fecha de cancelación:** {datetime.now().strftime('%d/%m/%Y %H:%M')}
+
+**¿Deseas agendar una nueva cita?** Solo dime cuándo te gustaría venir."""
+                else:
+                    return f"""❌ **ERROR AL CANCELAR**
+
+🔍 **Número buscado:** {numero_confirmacion}
+❌ **Problema:** {resultado['mensaje']}
+
+**💡 Verifica:**
+• Que el número sea correcto
+• Que la cita no haya sido cancelada previamente
+• Que el número tenga formato: MC20241220145230483915
+
+**¿Necesitas ayuda?** Puedo buscarte la cita por tu nombre."""
+        
+        elif intencion == "solicitar_cancelacion":
+            return """❌ **CANCELAR CITA EXISTENTE**
+
+Para cancelar tu cita necesito el **número de confirmación** que recibiste al agendar.
+
+**📋 Formato del número:** MC + fecha y hora + 6 dígitos, p. ej. MC20241220145230483915
+
+**💡 Si no lo tienes, puedo buscarte la cita:**
+• Dime tu nombre completo
+• O tu número de teléfono
+• O dime "buscar mi cita"
+
+**Ejemplo:** "Cancelar cita MC20241220145230483915" """
+        
+        elif intencion == "buscar_cita":
+            criterio = intenciones.extraer_criterio_busqueda(mensaje)
+            if criterio:
+                return responder_busqueda_citas(db, *criterio)
+            return """🔍 **BUSCAR CITA EXISTENTE**
+
+Para buscar tu cita necesito:
+
+**1️⃣ Opción 1 - Por nombre completo:**
+"Buscar cita de Juan Pérez García"
+
+**2️⃣ Opción 2 - Por teléfono:**
+"Buscar cita 3312345678"
+
+**3️⃣ Opción 3 - Por número de confirmación:**
+"Mi cita es MC20241220145230483915"
+
+**¿Cuál prefieres usar?**"""
+        
+        elif intencion == "procesar_cita_completa":
+            return procesar_cita_completa(db, mensaje)
+        
+        elif intencion == "agendar_cita":
+            servicios_texto = generar_respuesta_servicios_limpia(db)
+            
+            return f"""📅 **AGENDAR NUEVA CITA**
+
+**📝 Para agendar en un solo mensaje, incluye:**
+1. **Nombre completo**
+2. **Teléfono** (10 dígitos)  
+3. **Servicio** que necesitas
+4. **Día preferido** (lunes, martes, etc.)
+
+**🏥 SERVICIOS DISPONIBLES:**
+{servicios_texto}
+
+**💡 Ejemplo perfecto:**
+*"María González López, 3312345678, pediatría, miércoles"*
+
+**📅 También acepto formatos como:**
+- "Consulta general para Juan Pérez, tel 33-1234-5678, prefiero viernes"
+- "Agendar cardiología, soy Ana Silva, 3312345678, cualquier día de la semana"
+
+¡Tu cita será procesada automáticamente! ⚡"""
+        
+        elif intencion == "precios_servicios":
+            try:
+                servicios = db.obtener_servicios()
+                
+                servicios_texto = ""
+                for servicio in servicios:
+                    precio = int(servicio.get('precio', 0))
+                    nombre = servicio['nombre']
+                    servicios_texto += f"• **{nombre}**: ${precio} MXN\n"
+                    
+            except Exception as e:
+                servicios_texto = """• **Consulta General**: $500 MXN
+• **Pediatría**: $600 MXN
+• **Cardiología**: $800 MXN
+• **Dermatología**: $700 MXN
+• **Laboratorio**: $250 MXN"""
+            
+            return f"""💰 **TARIFAS CLÍNICA MEDICARE 2024**
+
+{servicios_texto}
+
+**💳 FORMAS DE PAGO ACEPTADAS:**
+• 💵 Efectivo
+• 💳 Tarjetas de débito/crédito
+• 🏦 Transferencias bancarias
+• 🏥 Seguros médicos mayores*
+
+*Consulta cobertura específica
+
+**💡 Los precios incluyen:**
+✅ Consulta médica completa
+✅ Diagnóstico profesional  
+✅ Receta médica (si aplica)
+✅ Seguimiento post-consulta
+
+**🧪 Servicios de laboratorio** incluyen análisis básicos y entrega de resultados.
+
+**¿Listo para agendar?** Solo dime el servicio que necesitas."""
+        
+        elif intencion == "horarios_disponibles":
+            # Obtener disponibilidad de los próximos días
+            disponibilidad_texto = obtener_disponibilidad_proximos_dias(db)
+            
+            return f"""🕒 **HORARIOS Y DISPONIBILIDAD**
+
+**📅 HORARIOS GENERALES:**
+• **Lunes a Viernes:** 9:00 AM - 6:00 PM
+• **Sábados:** 9:00 AM - 11:30 AM  
+• **Domingos:** Solo emergencias
+
+{disponibilidad_texto}
+
+**⚠️ INFORMACIÓN IMPORTANTE:**
+• Citas cada 30 minutos
+• Llegar 15 min antes de la cita
+• Última cita: 30 min antes del cierre
+
+**¿Quieres agendar una cita?** Solo dímelo."""
+        
+        elif intencion == "emergencia":
+            return """🚨 **PROTOCOLO DE EMERGENCIAS**
+
+**📞 EMERGENCIAS MÉDICAS 24/7:**
+**(33) 1234-5678** 
+
+**🏥 Clínica MediCare - Emergencias**
+📍 Av. Principal #123, Guadalajara, Jalisco
+
+**⚡ EN CASO DE EMERGENCIA GRAVE:**
+
+1. **📞 Llama INMEDIATAMENTE** al número de emergencias
+2. **🏥 Acude** al hospital más cercano si es necesario
+3. **👨‍⚕️ Contacta** a tu médico de cabecera si es posible
+
+**🚑 NÚMEROS DE EMERGENCIA NACIONAL:**
+• **Cruz Roja:** 065
+• **Emergencias Generales:** 911
+• **Bomberos:** 911
+
+**⚠️ IMPORTANTE:** Si es una emergencia real, no uses este chat. Llama directamente."""
+        
+        elif intencion == "saludo":
+            return """👋 **¡Hola! Bienvenido a Clínica MediCare**
+
+Soy tu asistente virtual inteligente con **base de datos avanzada**. 
+
+**🎯 Estoy aquí para ayudarte con:**
+
+• 📅 **Agendar citas** - Proceso automático e instantáneo
+• 🔍 **Buscar tus citas** - Por nombre, teléfono o número
+• ❌ **Cancelar citas** - Con tu número de confirmación
+• 🔄 **Cambiar/reagendar citas** - Fácil y rápido
+• 💰 **Consultar precios** - Tarifas actualizadas 2024
+• ⏰ **Ver disponibilidad** - Horarios en tiempo real
+• 🚨 **Emergencias** - Información de contacto inmediato
+
+**💡 Tip:** Puedo procesar tu cita en un solo mensaje si me das todos los datos juntos.
+
+**¿En qué te ayudo hoy?** 😊"""
+        
+        else:
+            try:
+                servicios_count = len(db.obtener_servicios())
+            except:
+                servicios_count = 5  # Fallback
+            
+            return f"""ℹ️ **CLÍNICA MEDICARE - INFORMACIÓN GENERAL**
+
+🏥 **Somos especialistas en atención médica integral** con sistema digitalizado de última generación.
+
+**🎯 NUESTRO SISTEMA:**
+• 🗄️ **Base de datos SQLite** confiable y rápida
+• ⚡ **Procesamiento automático** de citas
+• 📊 **Panel médico** integrado para doctores
+• 🆔 **Números únicos** de confirmación
+• 🔄 **Sincronización en tiempo real**
+
+**💼 SERVICIOS MÉDICOS:**
+• {servicios_count} especialidades médicas disponibles
+• Médicos certificados y especializados
+• Equipos de diagnóstico modernos
+• Seguimiento post-consulta incluido
+
+**💡 PREGUNTAS FRECUENTES:**
+• *"¿Cuánto cuesta una consulta?"* → Consultar precios
+• *"¿Qué horarios tienen disponibles?"* → Ver disponibilidad
+• *"Quiero agendar una cita"* → Proceso automático
+• *"Buscar mi cita"* → Búsqueda inteligente
+• *"Cambiar mi cita"* → Reagendar fácilmente
+
+**¿Hay algo específico en lo que pueda ayudarte?**"""
+    
+    except Exception as e:
+        return """❌ **Error procesando tu solicitud**
+
+Por favor, intenta nuevamente o reformula tu mensaje.
+
+**¿Puedo ayudarte con algo específico como:**
+• Agendar una cita
+• Consultar precios
+• Ver horarios disponibles
+
+**💡 También puedes escribir "ayuda" para ver todas las opciones."""
+
+def _restricciones_horario(datos):
+    """Argumentos de buscar_primeros_horarios según las preferencias del mensaje"""
+    restricciones = {}
+    if datos.get('turno'):
+        restricciones['turno'] = datos['turno']
+    if datos.get('no_antes_de'):
+        restricciones['desde'] = obtener_fecha_desde_dia(datos['no_antes_de'])
+    return restricciones
+
+@metricas.instrumentado('chat.ofrecer_primeros_horarios')
+def ofrecer_primeros_horarios(db, servicio_id, **restricciones):
+    """Texto con los horarios libres más próximos de un servicio ('' si no hay)"""
+    try:
+        horarios = db.buscar_primeros_horarios(
+            servicio_id=servicio_id, cantidad=HORARIOS_OFRECIDOS, dias=DIAS_BUSQUEDA, **restricciones
+        )
+    except Exception:
+        return ""
+    if not horarios:
+        return ""
+    
+    texto = "⏱️ **HORARIOS MÁS PRÓXIMOS:**\n\n"
+    for horario in horarios:
+        fecha = datetime.strptime(horario['fecha'], '%Y-%m-%d')
+        texto += (f"• **{DIAS_SEMANA[fecha.weekday()].title()}** ({fecha.strftime('%d/%m')}) "
+                  f"a las **{horario['hora']}** con {horario['medico']}\n")
+    return texto
+
+def _reservar_en_orden(db, datos, buscar_candidatos):
+    """Reserva el primer (fecha, hora, medico_id) libre; devuelve (resultado, fecha, hora)
+    
+    `buscar_candidatos()` consulta la disponibilidad y se vuelve a llamar tras
+    cada conflicto, en vez de recorrer una lista armada antes del primer intento.
+    Sin candidatos devuelve ({}, None, None).
+    """
+    intentados = set()
+    resultado = {}
+    for _ in range(REINTENTOS_RESERVA):
+        libres = [c for c in buscar_candidatos() if c not in intentados]
+        if not libres:
+            # Los horarios restantes se ocuparon entre un intento y otro
+            return {}, None, None
+        fecha, hora, medico_id = libres[0]
+        intentados.add(libres[0])
+        resultado = db.crear_cita(
+            paciente_nombre=datos['nombre'],
+            paciente_telefono=datos['telefono'],
+            servicio_id=datos['servicio_id'],
+            medico_id=medico_id,
+            fecha=fecha,
+            hora=hora
+        )
+        # Si otra sesión ganó el horario, probar el siguiente
+        if resultado['success'] or not resultado.get('conflicto'):
+            break
+    return resultado, fecha, hora
+
+def _cita_confirmada(db, datos, fecha, hora, resultado):
+    """Resumen de una cita recién guardada"""
+    servicio_info = db.obtener_servicio(datos['servicio_id']) or {}
+    dia = DIAS_SEMANA[datetime.strptime(fecha, '%Y-%m-%d').weekday()]
+    
+    return f"""✅ **¡CITA CONFIRMADA Y GUARDADA!**
+
+**📋 RESUMEN COMPLETO:**
+
+👤 **Paciente:** {datos['nombre']}
+📞 **Teléfono:** {datos['telefono']}
+🏥 **Servicio:** {servicio_info.get('nombre', '')}
+👨‍⚕️ **Médico:** {servicio_info.get('medico', '')}
+
+🗓️ **Día:** {dia.title()}
+📅 **Fecha:** {fecha}
+⏰ **Hora:** {hora}
+⏱️ **Duración:** {servicio_info.get('duracion', 30)} minutos
+💰 **Costo:** ${servicio_info.get('precio', 0):.0f} MXN
+
+**🆔 NÚMERO DE CONFIRMACIÓN:**
+**{resultado['numero_confirmacion']}**
+
+📍 **Ubicación:** Clínica MediCare
+Av. Principal #123, Guadalajara, Jalisco
+
+**⚠️ RECORDATORIOS IMPORTANTES:**
+• Llegar **15 minutos antes** de tu cita
+• Traer **identificación oficial**
+• Para cancelar: usa tu número de confirmación
+• Reagendar: con **24h de anticipación**
+
+**📞 ¿Dudas?** Llama al (33) 1234-5678
+
+**¡Nos vemos pronto! 👋**"""
+
+@metricas.instrumentado('chat.procesar_cita_completa')
+def procesar_cita_completa(db, mensaje):
+    """Procesa una cita con toda la información proporcionada
+    
+    Con un día preferido se reserva el primer horario libre de ese día; con
+    "lo antes posible", "no antes del jueves" o un turno, el primer horario
+    libre que cumpla esas condiciones. Sin nada de eso se ofrecen los más próximos.
+    """
+    
+    try:
+        # Extraer datos del mensaje
+        datos = extraer_datos_mensaje(db, mensaje)
+        
+        if not datos.get('nombre'):
+            return "❌ No pude identificar el nombre completo. Por favor, especifícalo claramente."
+        
+        if not datos.get('telefono'):
+            return "❌ No encontré un número de teléfono válido. Debe tener 10 dígitos."
+        
+        if not datos.get('servicio_id'):
+            servicios_texto = generar_respuesta_servicios_limpia(db)
+            return f"""❌ **No identifiqué el servicio médico solicitado.**
+
+**🏥 Servicios disponibles:**
+{servicios_texto}
+
+**Por favor especifica cuál necesitas.**"""
+        
+        restricciones = _restricciones_horario(datos)
+        
+        # Buscar día disponible
+        if datos.get('dia_preferido'):
+            fecha_preferida = obtener_fecha_desde_dia(datos['dia_preferido'])
+            
+            def candidatos_del_dia():
+                horarios = db.obtener_horarios_disponibles(fecha_preferida, servicio_id=datos['servicio_id'])
+                if datos.get('turno'):
+                    del_turno = set(horarios_turno(datos['turno']))
+                    horarios = [h for h in horarios if h in del_turno]
+                return [(fecha_preferida, hora, datos['medico_id']) for hora in horarios]
+            
+            resultado, fecha_cita, hora_cita = _reservar_en_orden(db, datos, candidatos_del_dia)
+            
+            if not resultado:
+                # Día lleno: ofrecer directamente los horarios más próximos desde ese día
+                restricciones['desde'] = fecha_preferida
+                alternativas = (ofrecer_primeros_horarios(db, datos['servicio_id'], **restricciones)
+                                or obtener_disponibilidad_proximos_dias(db))
+                return f"""❌ **Sin disponibilidad para {datos['dia_preferido'].title()}**
+
+{alternativas}
+
+💡 **¿Te parece bien otro día?** Solo dímelo."""
+        
+        elif datos.get('lo_antes_posible') or restricciones:
+            def primeros_candidatos():
+                horarios = db.buscar_primeros_horarios(
+                    servicio_id=datos['servicio_id'], cantidad=REINTENTOS_RESERVA, dias=DIAS_BUSQUEDA,
+                    **restricciones
+                )
+                return [(h['fecha'], h['hora'], h['medico_id']) for h in horarios]
+            
+            resultado, fecha_cita, hora_cita = _reservar_en_orden(db, datos, primeros_candidatos)
+            
+            if not resultado:
+                return f"""❌ **Sin horarios libres con esas condiciones en los próximos {DIAS_BUSQUEDA} días**
+
+{obtener_disponibilidad_proximos_dias(db)}
+
+💡 **¿Te parece bien otro día?** Solo dímelo."""
+        
+        else:
+            proximos = ofrecer_primeros_horarios(db, datos['servicio_id']) or obtener_disponibilidad_proximos_dias(db)
+            return f"""📝 **Datos recibidos correctamente:**
+
+✅ **Nombre:** {datos['nombre']}
+✅ **Teléfono:** {datos['telefono']}
+✅ **Servicio:** Identificado
+
+🗓️ **Falta especificar el día preferido:**
+
+{proximos}
+
+**💡 Dime qué día prefieres, o escribe "lo antes posible" y te doy el primer horario libre.**"""
+        
+        if resultado['success']:
+            return _cita_confirmada(db, datos, fecha_cita, hora_cita, resultado)
+        return f"❌ **Error al agendar la cita:** {resultado.get('mensaje', 'Error desconocido')}"
+    
+    except Exception as e:
+        return "❌ Error procesando los datos de la cita. Por favor, intenta nuevamente con el formato sugerido."
+
+@metricas.instrumentado('chat.extraer_datos_mensaje')
+def extraer_datos_mensaje(db, mensaje):
+    """Extrae información detallada del mensaje para agendar cita (memoizada)"""
+    return intenciones.extraer_datos_cacheados(mensaje, version_catalogo(db), db.obtener_servicios)
+
+def obtener_fecha_desde_dia(dia_nombre):
+    """Convierte nombre de día a fecha de la próxima semana"""
+    try:
+        dias_semana = ['lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo']
+        
+        if dia_nombre.lower() not in dias_semana:
+            return None
+        
+        hoy = date.today()
+        dia_objetivo = dias_semana.index(dia_nombre.lower())
+        dias_hasta_objetivo = (dia_objetivo - hoy.weekday()) % 7
+        
+        if dias_hasta_objetivo == 0:  # Es hoy, buscar la próxima semana
+            dias_hasta_objetivo = 7
+        
+        fecha_objetivo = hoy + timedelta(days=dias_hasta_objetivo)
+        return fecha_objetivo.strftime("%Y-%m-%d")
+    except Exception:
+        return None
+
+@metricas.instrumentado('chat.obtener_disponibilidad_proximos_dias')
+def obtener_disponibilidad_proximos_dias(db, dias=7):
+    """Genera texto con disponibilidad de los próximos días (7 por defecto)"""
+    try:
+        texto = "📅 **DISPONIBILIDAD PRÓXIMOS DÍAS:**\n\n"
+        dias_semana = ['lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo']
+        
+        hoy = date.today()
+        
+        # Snapshot en memoria mantenido por las reservas y cancelaciones
+        disponibilidad = db.obtener_disponibilidad_proximos_dias(dias)
+        
+        for i in range(dias):
+            fecha_check = hoy + timedelta(days=i+1)
+            dia_nombre = dias_semana[fecha_check.weekday()]
+            
+            # Saltar domingos
+            if dia_nombre == 'domingo':
+                continue
+                
+            count = disponibilidad.get(fecha_check.strftime("%Y-%m-%d"), {}).get('disponibles', 0)
+            
+            fecha_str = fecha_check.strftime("%d/%m")
+            
+            if count > 5:
+                status = f"✅ **{count} horarios** disponibles"
+            elif count > 0:
+                status = f"⚠️ **Solo {count} horarios** disponibles"
+            else:
+                status = "❌ **Sin disponibilidad**"
+            
+            texto += f"• **{dia_nombre.title()}** ({fecha_str}): {status}\n"
+        
+        return texto
+    except Exception:
+        return "📅 **DISPONIBILIDAD:** Consultar horarios disponibles"
+
+class ChatEngine:
+    """Motor de conversación sin Streamlit con un gestor de base de datos inyectado"""
+    
+    def __init__(self, db):
+        self.db = db
+    
+    def detectar_intencion(self, mensaje):
+        return detectar_intencion(self.db, mensaje)
+    
+    def generar_respuesta(self, mensaje, intencion):
+        return generar_respuesta(self.db, mensaje, intencion)
+    
+    def procesar_cita_completa(self, mensaje):
+        return procesar_cita_completa(self.db, mensaje)
+    
+    def manejar_cambio_cita(self, mensaje):
+        return manejar_cambio_cita(self.db, mensaje)
+    
+    def responder(self, mensaje):
+        """Pipeline completo: devuelve (intención, respuesta) para un mensaje"""
+        with metricas.medir('chat.responder'):
+            intencion = self.detectar_intencion(mensaje)
+            # Latencia por intención, p. ej. chat.intencion.procesar_cita_completa
+            with metricas.medir(f'chat.intencion.{intencion}'):
+                return intencion, self.generar_respuesta(mensaje, intencion)
@@ -1,257 +1,1051 @@
 # database.py - Versión para despliegue independiente
 import sqlite3
+import base64
+import binascii
+import itertools
 import os
-from datetime import datetime, date, time
+import queue
+import random
+import re
+import secrets
+import threading
+import time
+import unicodedata
+import weakref
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
+from urllib.request import pathname2url
 import uuid
 
+from calendario import (
+    CalendarioOcupacion, SnapshotDisponibilidad, DIAS_BUSQUEDA, DIAS_CONSULTA, DURACION_BASE,
+    horarios_turno, hora_a_minutos, minutos_a_hora
+)
+import metricas
+from escritor import EscritorAgrupado, MAX_LOTE, ESPERA_LOTE_MS
+from migraciones import aplicar_migraciones, restaurar_ddl_diferido, sembrar_catalogo
+from replica import ReplicaMemoria, leer_cita
+import trazado_sql
+
+# PRAGMAs aplicados a cada conexión del pool
+PRAGMAS_CONEXION = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Reintentos ante SQLITE_BUSY y colisiones de número de confirmación
+REINTENTOS_BLOQUEO = 6
+ESPERA_REINTENTO = 0.02
+REINTENTOS_CONFIRMACION = 5
+
+# Segundos que se espera una conexión libre con el pool lleno antes de fallar
+ESPERA_CONEXION = 10.0
+
+# Columnas que produce exportar_citas (y que acepta importar_citas)
+COLUMNAS_EXPORTACION = (
+    'id', 'numero_confirmacion', 'paciente_nombre', 'paciente_telefono',
+    'servicio_id', 'servicio', 'precio', 'medico_id', 'fecha', 'hora',
+    'estado', 'created_at',
+)
+
+def codificar_cursor(fecha, cita_id):
+    """Token opaco con la clave (fecha, id) de la última cita de una página"""
+    return base64.urlsafe_b64encode(f"{fecha}|{cita_id}".encode()).decode().rstrip('=')
+
+def decodificar_cursor(token):
+    """Inverso de codificar_cursor; ValueError si el token no es válido"""
+    try:
+        texto = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        fecha, cita_id = texto.split('|')
+        return _a_fecha(fecha).strftime("%Y-%m-%d"), int(cita_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError) as e:
+        raise ValueError(f"Cursor inválido: {token!r}") from e
+
+def _fila_busqueda(row):
+    return {
+        'id': row[6],
+        'numero_confirmacion': row[0],
+        'paciente_nombre': row[1],
+        'fecha': row[2],
+        'hora': row[3],
+        'servicio': row[4],
+        'estado': row[5]
+    }
+
+# Dígitos de un número de confirmación sin sede (MC + 14 de fecha + 6 aleatorios);
+# con sede se anteponen 2 dígitos más, de modo que sigue siendo MC + solo dígitos
+DIGITOS_CONFIRMACION = 20
+
+def prefijo_sede(sede):
+    """Dígitos que identifican la sede en los números de confirmación ('' sin sede)"""
+    return '' if sede is None else f"{int(sede):02d}"
+
+def generar_numero_confirmacion(sede=None):
+    """MC + [sede] + fecha y hora al segundo + 6 dígitos aleatorios criptográficos
+    
+    El sufijo aleatorio evita colisiones entre procesos en el mismo segundo;
+    la restricción UNIQUE detecta el caso improbable y se genera otro.
+    """
+    return (f"MC{prefijo_sede(sede)}{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            f"{secrets.randbelow(10**6):06d}")
+
+def numeros_importacion(sede=None, inicio=None):
+    """Números de confirmación para citas importadas sin número, en secuencia
+    
+    Mismo formato que generar_numero_confirmacion, con un contador de 6 dígitos
+    en lugar del sufijo aleatorio. Al agotarse el contador se pasa al segundo
+    siguiente, de modo que el largo (y la sede) se siguen pudiendo leer.
+    """
+    instante = (inicio or datetime.now()).replace(microsecond=0)
+    while True:
+        prefijo = f"MC{prefijo_sede(sede)}{instante.strftime('%Y%m%d%H%M%S')}"
+        for secuencia in range(10**6):
+            yield f"{prefijo}{secuencia:06d}"
+        instante = max(instante + timedelta(seconds=1), datetime.now().replace(microsecond=0))
+
+def sede_de_confirmacion(numero):
+    """Sede codificada en un número de confirmación, o None si es de antes de las sedes"""
+    digitos = (numero or '').upper().removeprefix('MC')
+    if len(digitos) == DIGITOS_CONFIRMACION + 2 and digitos.isdigit():
+        return int(digitos[:2])
+    return None
+
+def _es_bloqueo(error):
+    """True si el error de SQLite es por base de datos ocupada o bloqueada"""
+    codigo = getattr(error, 'sqlite_errorcode', None)
+    if codigo in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+        return True
+    mensaje = str(error).lower()
+    return 'locked' in mensaje or 'busy' in mensaje
+
+def consulta_fts_nombre(texto):
+    """Convierte un nombre parcial en una consulta FTS5 de prefijos ("juan"* "pe"*)"""
+    terminos = re.findall(r'\w+', texto or '')
+    return ' '.join(f'"{termino}"*' for termino in terminos)
+
+def normalizar_texto(texto):
+    """Minúsculas y sin acentos, para comparar nombres de servicios"""
+    descompuesto = unicodedata.normalize('NFKD', (texto or '').strip().lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+def _a_fecha(valor):
+    """Acepta date o 'YYYY-MM-DD' y devuelve date"""
+    if isinstance(valor, date):
+        return valor
+    return datetime.strptime(valor, "%Y-%m-%d").date()
+
+class ConnectionPool:
+    """Pool de conexiones SQLite persistentes y seguras entre hilos
+
+    Orden de candados en todo el módulo: primero la conexión del pool, después
+    el orden de escritura y por último el candado del calendario. Nunca se pide
+    una conexión con alguno de esos candados tomado.
+    """
+
+    def __init__(self, db_path, tamano=8, busy_timeout=5.0, trazador=None, inicializar=None,
+                 espera_conexion=ESPERA_CONEXION):
+        self.db_path = db_path
+        self.trazador = trazador
+        # inicializar(conn) corre una sola vez, sobre la primera conexión que se abre
+        self.inicializar = inicializar
+        self.tamano = tamano
+        self.busy_timeout = busy_timeout
+        self.espera_conexion = espera_conexion
+        self._libres = queue.LifoQueue()
+        self._conexiones = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._cerrado = False
+
+    def _abrir_conexion(self):
+        """Abre una conexión nueva con los PRAGMAs de rendimiento"""
+        conn = trazado_sql.conectar(self.db_path, self.trazador, timeout=self.busy_timeout,
+                                    check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+        for pragma in PRAGMAS_CONEXION:
+            conn.execute(pragma)
+        if self.inicializar is not None:
+            try:
+                with metricas.medir('db.inicializar_esquema'):
+                    self.inicializar(conn)
+            except sqlite3.Error:
+                conn.close()
+                raise
+            self.inicializar = None
+        return conn
+
+    def _adquirir(self):
+        """Toma una conexión libre o abre una nueva si no se alcanzó el tamaño"""
+        if self._cerrado:
+            raise sqlite3.ProgrammingError("El pool de conexiones está cerrado")
+        try:
+            return self._libres.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._conexiones) < self.tamano:
+                conn = self._abrir_conexion()
+                self._conexiones.append(conn)
+                return conn
+
+        # Pool lleno: esperar a que otro hilo devuelva su conexión, con límite
+        try:
+            return self._libres.get(timeout=self.espera_conexion)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"Sin conexiones libres en el pool tras {self.espera_conexion:g} s "
+                f"({self.tamano} en uso)"
+            ) from None
+
+    @contextmanager
+    def conexion(self):
+        """Presta una conexión al hilo actual (reentrante dentro del mismo hilo)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._adquirir()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            if self._cerrado:
+                conn.close()
+            else:
+                self._libres.put(conn)
+
+    def abrir_conexion_dedicada(self):
+        """Conexión fuera del pool (p. ej. para el hilo escritor); la cierra quien la pide"""
+        with self._lock:
+            return self._abrir_conexion()
+
+    def cerrar(self):
+        """Cierra todas las conexiones del pool"""
+        with self._lock:
+            self._cerrado = True
+            conexiones, self._conexiones = self._conexiones, []
+        for conn in conexiones:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+def _cerrar_recursos(escritor, pool, replica=None):
+    if escritor is not None:
+        escritor.cerrar()
+    pool.cerrar()
+    if replica is not None:
+        replica.cerrar()
+
 class DatabaseManager:
-    def __init__(self, db_path="clinica.db"):
+    def __init__(self, db_path="clinica.db", tamano_pool=8, trazador=None, sede=None,
+                 escritura_agrupada=False, max_lote=MAX_LOTE, espera_lote_ms=ESPERA_LOTE_MS,
+                 replica_lectura=False):
         self.db_path = db_path
-        self.init_database()
-        self.populate_initial_data()
+        # Código de sede (1-99) que llevan los números de confirmación; ver sedes.py
+        self.sede = sede
+        # Trazado SQL opcional (ver trazado_sql.py); por defecto según CLINICA_TRAZA_SQL
+        self.trazador = trazador if trazador is not None else trazado_sql.TrazadorSQL.desde_entorno()
+        # El esquema se comprueba (y migra o siembra) al abrir la primera conexión,
+        # no al construir el objeto, para que el arranque no toque el disco
+        self._pool = ConnectionPool(db_path, tamano=tamano_pool, trazador=self.trazador,
+                                    inicializar=aplicar_migraciones)
+        self._calendario = CalendarioOcupacion(self._cargar_ocupacion)
+        # Solo lo toman quienes escriben: COMMIT y al_confirmar, en el mismo orden
+        self._orden_escritura = threading.Lock()
+        # Escritor único opcional: reservas y cancelaciones en commits agrupados
+        self._escritor = None
+        if escritura_agrupada:
+            self._escritor = EscritorAgrupado(
+                self._pool.abrir_conexion_dedicada, self._orden_escritura,
+                max_lote=max_lote, espera_lote_ms=espera_lote_ms,
+                reintentos_bloqueo=REINTENTOS_BLOQUEO, espera_reintento=ESPERA_REINTENTO,
+                es_bloqueo=_es_bloqueo,
+            )
+        # Réplica en memoria opcional para la agenda y las búsquedas; se carga en la primera lectura.
+        # El catálogo se sigue leyendo del disco, porque el panel médico lo modifica por fuera
+        self._replica = ReplicaMemoria() if replica_lectura else None
+        # Cierre limpio del escritor y del pool al recolectar el objeto o al terminar el proceso
+        self._finalizador = weakref.finalize(self, _cerrar_recursos, self._escritor, self._pool,
+                                             self._replica)
+        self._snapshot = SnapshotDisponibilidad(self._calendario)
+        # Versión de citas (ver migración 7) que reflejan la agenda, el snapshot y
+        # la réplica; si la base tiene otra, otro proceso escribió y se releen
+        self._version_citas = None
+        self._catalogo = None
+        self._catalogo_lock = threading.Lock()
+
+    def cerrar(self):
+        """Cierra las conexiones persistentes de la base de datos"""
+        self._finalizador()
     
     def init_database(self):
-        """Inicializa la base de datos con todas las tablas necesarias"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Tabla de médicos
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS medicos (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    nombre TEXT NOT NULL,
-                    especialidad TEXT NOT NULL,
-                    telefono TEXT,
-                    email TEXT,
-                    activo BOOLEAN DEFAULT TRUE
-                )
-            ''')
-            
-            # Tabla de servicios
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS servicios (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    nombre TEXT NOT NULL,
-                    precio REAL NOT NULL,
-                    duracion INTEGER DEFAULT 30,
-                    medico_id INTEGER,
-                    medico TEXT,
-                    activo BOOLEAN DEFAULT TRUE,
-                    FOREIGN KEY (medico_id) REFERENCES medicos (id)
-                )
-            ''')
-            
-            # Tabla de citas
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS citas (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    numero_confirmacion TEXT UNIQUE NOT NULL,
-                    paciente_nombre TEXT NOT NULL,
-                    paciente_telefono TEXT NOT NULL,
-                    servicio_id INTEGER NOT NULL,
-                    medico_id INTEGER NOT NULL,
-                    fecha TEXT NOT NULL,
-                    hora TEXT NOT NULL,
-                    estado TEXT DEFAULT 'confirmada',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (servicio_id) REFERENCES servicios (id),
-                    FOREIGN KEY (medico_id) REFERENCES medicos (id)
-                )
-            ''')
-            
-            conn.commit()
+        """Inicializa la base de datos aplicando las migraciones pendientes"""
+        with self._pool.conexion() as conn:
+            aplicar_migraciones(conn)
     
     def populate_initial_data(self):
-        """Llena la base de datos con datos iniciales si está vacía"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Verificar si ya hay datos
-            cursor.execute("SELECT COUNT(*) FROM servicios")
-            if cursor.fetchone()[0] > 0:
-                return  # Ya hay datos, no hacer nada
-            
-            # Insertar médicos
-            medicos = [
-                ("Dr. García", "Pediatría", "3312345001", "garcia@medicare.com"),
-                ("Dra. Martínez", "Cardiología", "3312345002", "martinez@medicare.com"),
-                ("Dr. López", "Dermatología", "3312345003", "lopez@medicare.com"),
-                ("Dr. Rodríguez", "Medicina General", "3312345004", "rodriguez@medicare.com"),
-                ("QFB Angel Carrizalez", "Laboratorio", "3312345005", "acarrizalez@medicare.com")
-            ]
-            
-            cursor.executemany('''
-                INSERT INTO medicos (nombre, especialidad, telefono, email)
-                VALUES (?, ?, ?, ?)
-            ''', medicos)
-            
-            # Insertar servicios (exactamente 5 servicios únicos)
-            servicios = [
-                ("Consulta General", 500, 30, 4, "Dr. Rodríguez"),
-                ("Pediatría", 600, 45, 1, "Dr. García"),
-                ("Cardiología", 800, 60, 2, "Dra. Martínez"),
-                ("Dermatología", 700, 30, 3, "Dr. López"),
-                ("Laboratorio", 250, 15, 5, "QFB Angel Carrizalez")
-            ]
+        """Llena la base de datos con el catálogo inicial si está vacía"""
+        with self._pool.conexion() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if sembrar_catalogo(conn):
+                conn.commit()
+            else:
+                conn.rollback()
+    
+    @contextmanager
+    def _lectura(self):
+        """Conexión para leer citas: la réplica en memoria si está activa, si no el pool"""
+        if self._replica is None:
+            with self._pool.conexion() as conn:
+                yield conn
+            return
+        if not self._replica.cargada:
+            # Conexión antes que candado; con el orden de escritura tomado ningún
+            # commit cae entre la copia y su instalación
+            with self._pool.conexion() as disco, self._orden_escritura:
+                if not self._replica.cargada:
+                    self._replica.cargar(disco)
+        with self._replica.conexion() as conn:
+            yield conn
+    
+    def _registrar_cambio(self, conn, resultado, numero_confirmacion, cambios):
+        """Dentro de la transacción, guarda la fila que cambió para copiarla a la réplica"""
+        if self._replica is not None and resultado.get('success'):
+            cambios[:] = [leer_cita(conn, numero_confirmacion)]
+    
+    def _aplicar_en_replica(self, cambios):
+        if self._replica is not None:
+            self._replica.aplicar(cambios)
+    
+    def verificar_replica(self):
+        """Compara la réplica en memoria con la base en disco (para operadores)"""
+        if self._replica is None:
+            return {'consistente': None, 'mensaje': 'Réplica de lectura desactivada'}
+        with self._pool.conexion() as disco:
+            return self._replica.verificar(disco)
+    
+    def resincronizar_replica(self):
+        """Vuelve a copiar la base a la réplica y descarta la agenda calculada sobre ella"""
+        if self._replica is None:
+            return {'success': False, 'mensaje': 'Réplica de lectura desactivada'}
+        with self._pool.conexion() as disco, self._orden_escritura:
+            self._replica.cargar(disco)
+            with self._calendario.lock:
+                self._calendario.invalidar()
+                self._snapshot.invalidar()
+                self._version_citas = None
+        return {'success': True, 'mensaje': 'Réplica resincronizada'}
+    
+    def refrescar(self):
+        """Descarta los datos en memoria (catálogo y agenda) para releerlos de la base
+        
+        Útil cuando otro proceso, como el panel médico, modificó la base.
+        """
+        with self._calendario.lock:
+            self._catalogo = None
+            self._calendario.invalidar()
+            self._snapshot.invalidar()
+            self._version_citas = None
+    
+    def _leer_version_citas(self, conn):
+        return conn.execute("SELECT version FROM citas_version WHERE id = 1").fetchone()[0]
+    
+    @metricas.instrumentado('db.agenda_vigente')
+    def _agenda_vigente(self):
+        """Descarta agenda, snapshot y réplica si las citas cambiaron fuera de este proceso
+        
+        Cuesta una lectura del contador de citas; se llama antes de servir disponibilidad
+        o búsquedas, así que varios procesos (o workers de Streamlit) no se contradicen.
+        Ante una diferencia se espera a las escrituras propias ya confirmadas, que
+        la explican casi siempre, antes de descartar nada.
+        
+        Con réplica, cada escritura de otro proceso se paga con una copia completa
+        de la base (backup) en la lectura siguiente, hecha con el orden de escritura
+        tomado: unos 4 ms con 16 000 citas (5 MB), y crece con el archivo. No hay
+        registro de qué filas cambiaron; si varios procesos escriben seguido,
+        conviene no activar la réplica.
+        """
+        with self._pool.conexion() as conn:
+            if self._leer_version_citas(conn) == self._version_citas:
+                return
+            with self._orden_escritura:
+                version = self._leer_version_citas(conn)
+                if version == self._version_citas:
+                    return
+                if self._replica is not None and self._replica.cargada:
+                    self._replica.cargar(conn)
+                with self._calendario.lock:
+                    self._calendario.invalidar()
+                    self._snapshot.invalidar()
+                    self._version_citas = version
+    
+    def _agenda_al_dia(self, versiones):
+        """Con el candado tomado: True si la agenda reflejaba la base justo antes de la escritura
+        
+        `versiones` es (antes, después) del contador dentro de la transacción; si
+        coincide, la escritura se aplica en memoria y la agenda pasa a `después`.
+        """
+        antes, despues = versiones
+        if self._version_citas != antes:
+            return False
+        self._version_citas = despues
+        return True
+    
+    @metricas.instrumentado('db.version_catalogo')
+    def version_catalogo(self):
+        """Versión del catálogo; los triggers la incrementan al cambiar servicios o médicos"""
+        with self._pool.conexion() as conn:
+            return conn.execute("SELECT version FROM catalogo_version WHERE id = 1").fetchone()[0]
+    
+    def _catalogo_vigente(self):
+        """Devuelve el catálogo en caché, recargándolo si cambió su versión"""
+        version = self.version_catalogo()
+        catalogo = self._catalogo
+        if catalogo is not None and catalogo['version'] == version:
+            return catalogo
+        
+        with self._catalogo_lock:
+            catalogo = self._catalogo
+            if catalogo is not None and catalogo['version'] == version:
+                return catalogo
             
-            cursor.executemany('''
-                INSERT INTO servicios (nombre, precio, duracion, medico_id, medico)
-                VALUES (?, ?, ?, ?, ?)
-            ''', servicios)
+            with self._pool.conexion() as conn:
+                version = conn.execute("SELECT version FROM catalogo_version WHERE id = 1").fetchone()[0]
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT DISTINCT id, nombre, precio, duracion, medico_id, medico
+                    FROM servicios WHERE activo = TRUE
+                    ORDER BY id
+                    LIMIT 5
+                ''')
+                
+                servicios_unicos = []
+                nombres_vistos = set()
+                
+                for row in cursor.fetchall():
+                    nombre = row[1]
+                    if nombre not in nombres_vistos:
+                        nombres_vistos.add(nombre)
+                        servicios_unicos.append({
+                            'id': row[0],
+                            'nombre': row[1],
+                            'precio': row[2],
+                            'duracion': row[3],
+                            'medico_id': row[4],
+                            'medico': row[5]
+                        })
             
-            conn.commit()
+            catalogo = {
+                'version': version,
+                'servicios': servicios_unicos,
+                'por_id': {s['id']: s for s in servicios_unicos},
+                'por_nombre': {normalizar_texto(s['nombre']): s for s in servicios_unicos},
+            }
+            self._catalogo = catalogo
+            return catalogo
     
+    @metricas.instrumentado('db.obtener_servicios')
     def obtener_servicios(self):
         """Obtiene todos los servicios disponibles (máximo 5 únicos)"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT DISTINCT id, nombre, precio, duracion, medico_id, medico
-                FROM servicios WHERE activo = TRUE
-                ORDER BY id
-                LIMIT 5
-            ''')
-            
-            servicios_unicos = []
-            nombres_vistos = set()
-            
-            for row in cursor.fetchall():
-                nombre = row[1]
-                if nombre not in nombres_vistos:
-                    nombres_vistos.add(nombre)
-                    servicios_unicos.append({
-                        'id': row[0],
-                        'nombre': row[1],
-                        'precio': row[2],
-                        'duracion': row[3],
-                        'medico_id': row[4],
-                        'medico': row[5]
-                    })
-            
-            return servicios_unicos
-    
-    def obtener_horarios_disponibles(self, fecha):
-        """Obtiene horarios disponibles para una fecha específica"""
-        # Horarios base (simulación)
-        horarios_base = [
-            "09:00", "09:30", "10:00", "10:30", "11:00", "11:30",
-            "12:00", "12:30", "14:00", "14:30", "15:00", "15:30",
-            "16:00", "16:30", "17:00", "17:30"
+        return [dict(s) for s in self._catalogo_vigente()['servicios']]
+    
+    @metricas.instrumentado('db.obtener_servicio')
+    def obtener_servicio(self, servicio_id):
+        """Obtiene un servicio por su id, o None si no existe"""
+        servicio = self._catalogo_vigente()['por_id'].get(servicio_id)
+        return dict(servicio) if servicio else None
+    
+    @metricas.instrumentado('db.buscar_servicio_por_nombre')
+    def buscar_servicio_por_nombre(self, nombre):
+        """Obtiene un servicio por nombre sin distinguir acentos ni mayúsculas"""
+        servicio = self._catalogo_vigente()['por_nombre'].get(normalizar_texto(nombre))
+        return dict(servicio) if servicio else None
+    
+    @metricas.instrumentado('db.cargar_ocupacion')
+    def _cargar_ocupacion(self, fecha_inicio, fecha_fin):
+        """Lee las citas activas de un rango de fechas para el calendario"""
+        with self._lectura() as conn:
+            return conn.execute('''
+                SELECT c.fecha, c.medico_id, c.hora, COALESCE(s.duracion, ?)
+                FROM citas c
+                LEFT JOIN servicios s ON s.id = c.servicio_id
+                WHERE c.fecha BETWEEN ? AND ? AND c.estado != 'cancelada'
+            ''', (DURACION_BASE, fecha_inicio, fecha_fin)).fetchall()
+    
+    def _duracion_servicio(self, servicio_id):
+        """Duración en minutos de un servicio (30 por defecto)"""
+        servicio = self._catalogo_vigente()['por_id'].get(servicio_id)
+        if servicio is None:
+            return DURACION_BASE
+        return servicio['duracion'] or DURACION_BASE
+    
+    @metricas.instrumentado('db.obtener_horarios_disponibles')
+    def obtener_horarios_disponibles(self, fecha, servicio_id=None, medico_id=None):
+        """Obtiene horarios disponibles para una fecha específica
+        
+        Con `servicio_id` se usan el médico y la duración del servicio; sin él,
+        un horario está disponible si algún médico tiene libres 30 minutos.
+        """
+        self._agenda_vigente()
+        catalogo = self._catalogo_vigente()
+        
+        if servicio_id is not None:
+            servicio = catalogo['por_id'].get(servicio_id)
+            if servicio is None:
+                return []
+            return self._calendario.horarios_libres(
+                fecha, servicio['medico_id'], servicio['duracion'] or DURACION_BASE
+            )
+        
+        if medico_id is not None:
+            return self._calendario.horarios_libres(fecha, medico_id)
+        
+        medicos = sorted({s['medico_id'] for s in catalogo['servicios']})
+        return self._calendario.horarios_libres_cualquiera(fecha, medicos)
+    
+    @metricas.instrumentado('db.obtener_disponibilidad_rango')
+    def obtener_disponibilidad_rango(self, fecha_inicio, fecha_fin, medico_id=None):
+        """Horarios libres por día de un rango de fechas con una sola consulta
+        
+        Devuelve {fecha: {'disponibles': n, 'horarios': [...]}} en orden de fecha.
+        """
+        inicio = _a_fecha(fecha_inicio)
+        fin = _a_fecha(fecha_fin)
+        fechas = [
+            (inicio + timedelta(days=i)).strftime("%Y-%m-%d")
+            for i in range((fin - inicio).days + 1)
         ]
+        if not fechas:
+            return {}
         
-        # Verificar horarios ocupados
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT hora FROM citas 
-                WHERE fecha = ? AND estado != 'cancelada'
-            ''', (fecha,))
-            
-            horarios_ocupados = [row[0] for row in cursor.fetchall()]
+        self._agenda_vigente()
+        self._calendario.cargar_rango(fechas[0], fechas[-1], fechas)
         
-        # Retornar horarios disponibles
-        return [h for h in horarios_base if h not in horarios_ocupados]
+        if medico_id is not None:
+            medicos = [medico_id]
+        else:
+            medicos = sorted({s['medico_id'] for s in self._catalogo_vigente()['servicios']})
+        
+        disponibilidad = {}
+        for fecha in fechas:
+            horarios = self._calendario.horarios_libres_cualquiera(fecha, medicos)
+            disponibilidad[fecha] = {'disponibles': len(horarios), 'horarios': horarios}
+        return disponibilidad
     
-    def crear_cita(self, paciente_nombre, paciente_telefono, servicio_id, medico_id, fecha, hora):
-        """Crea una nueva cita"""
-        # Generar número de confirmación único
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        numero_confirmacion = f"MC{timestamp}"
+    @metricas.instrumentado('db.obtener_disponibilidad_proximos_dias')
+    def obtener_disponibilidad_proximos_dias(self, dias=7):
+        """Disponibilidad de los próximos `dias` días (desde mañana)
         
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
+        Se sirve del snapshot en memoria, que reservas y cancelaciones mantienen
+        al día; solo horizontes mayores que el snapshot consultan la base.
+        """
+        if dias > self._snapshot.dias:
+            hoy = date.today()
+            return self.obtener_disponibilidad_rango(hoy + timedelta(days=1), hoy + timedelta(days=dias))
+        
+        self._agenda_vigente()
+        medicos = tuple(sorted({s['medico_id'] for s in self._catalogo_vigente()['servicios']}))
+        snapshot = self._snapshot.obtener(medicos)
+        return dict(itertools.islice(snapshot.items(), dias))
+    
+    def _medicos_de_especialidad(self, especialidad):
+        """Ids de los médicos activos de una especialidad (sin distinguir acentos)"""
+        buscada = normalizar_texto(especialidad)
+        with self._pool.conexion() as conn:
+            filas = conn.execute("SELECT id, especialidad FROM medicos WHERE activo = TRUE").fetchall()
+        return {medico_id for medico_id, nombre in filas if normalizar_texto(nombre) == buscada}
+    
+    @metricas.instrumentado('db.buscar_primeros_horarios')
+    def buscar_primeros_horarios(self, servicio_id=None, especialidad=None, cantidad=3, desde=None,
+                                 turno=None, dias_semana=DIAS_CONSULTA, dias=DIAS_BUSQUEDA):
+        """Los `cantidad` horarios libres más próximos, en orden de fecha y hora
+        
+        Con `servicio_id` se busca en la agenda de su médico; con `especialidad`,
+        en la de todos los médicos de esa especialidad; sin ninguno, en todas.
+        Restricciones: `desde` (fecha mínima, mañana por defecto), `turno`
+        ('manana' o 'tarde') y `dias_semana` (lunes=0; sin domingos por defecto).
+        Devuelve [{'fecha', 'hora', 'medico_id', 'medico', 'servicio_id'}].
+        """
+        catalogo = self._catalogo_vigente()
+        if servicio_id is not None:
+            servicios = [catalogo['por_id'][servicio_id]] if servicio_id in catalogo['por_id'] else []
+        elif especialidad is not None:
+            medicos = self._medicos_de_especialidad(especialidad)
+            servicios = [s for s in catalogo['servicios'] if s['medico_id'] in medicos]
+        else:
+            servicios = catalogo['servicios']
+        
+        # Un servicio (y su duración) por médico
+        por_medico = {}
+        for servicio in servicios:
+            por_medico.setdefault(servicio['medico_id'], servicio)
+        if not por_medico or cantidad <= 0:
+            return []
+        
+        inicio = _a_fecha(desde) if desde else date.today() + timedelta(days=1)
+        permitidos = set(dias_semana)
+        fechas = [
+            fecha.strftime("%Y-%m-%d")
+            for fecha in (inicio + timedelta(days=i) for i in range(dias))
+            if fecha.weekday() in permitidos
+        ]
+        horas = set(horarios_turno(turno)) if turno else None
+        
+        self._agenda_vigente()
+        medicos = [(medico_id, s['duracion'] or DURACION_BASE) for medico_id, s in por_medico.items()]
+        return [
+            {
+                'fecha': fecha,
+                'hora': hora,
+                'medico_id': medico_id,
+                'medico': por_medico[medico_id]['medico'],
+                'servicio_id': por_medico[medico_id]['id'],
+            }
+            for fecha, hora, medico_id in self._calendario.primeros_libres(fechas, medicos, cantidad, horas)
+        ]
+    
+    def _ejecutar_escritura(self, operacion, al_confirmar=None):
+        """Ejecuta operacion(conn) dentro de BEGIN IMMEDIATE, reintentando si la BD está ocupada
+        
+        La transacción se confirma solo si el resultado tiene 'success'; en ese
+        caso al_confirmar(resultado) actualiza los índices en memoria antes de
+        responder. COMMIT y al_confirmar van bajo el candado de orden de las
+        escrituras, no el del calendario: al_confirmar toma ese solo para
+        cambiar la memoria. Con escritura agrupada la operación se delega al
+        hilo escritor y se espera su resultado.
+        """
+        if self._escritor is not None:
+            return self._escritor.enviar(operacion, al_confirmar).result()
+        
+        for intento in range(REINTENTOS_BLOQUEO):
+            try:
+                with self._pool.conexion() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    resultado = operacion(conn)
+                    if resultado.get('success'):
+                        with self._orden_escritura:
+                            conn.commit()
+                            if al_confirmar is not None:
+                                al_confirmar(resultado)
+                    else:
+                        conn.rollback()
+                    return resultado
+            except sqlite3.OperationalError as e:
+                if not _es_bloqueo(e) or intento == REINTENTOS_BLOQUEO - 1:
+                    raise
+                # Espera exponencial con variación aleatoria para no chocar de nuevo
+                time.sleep(ESPERA_REINTENTO * (2 ** intento) * (1 + random.random()))
+    
+    def _insertar_cita(self, conn, paciente_nombre, paciente_telefono, servicio_id,
+                       medico_id, fecha, hora, duracion):
+        """Verifica y reclama el horario dentro de la transacción abierta"""
+        inicio = hora_a_minutos(hora)
+        ocupadas = conn.execute('''
+            SELECT c.hora, COALESCE(s.duracion, ?)
+            FROM citas c
+            LEFT JOIN servicios s ON s.id = c.servicio_id
+            WHERE c.medico_id = ? AND c.fecha = ? AND c.estado != 'cancelada'
+        ''', (DURACION_BASE, medico_id, fecha)).fetchall()
+        
+        for hora_ocupada, duracion_ocupada in ocupadas:
+            otra = hora_a_minutos(hora_ocupada)
+            if inicio < otra + duracion_ocupada and otra < inicio + duracion:
+                return {
+                    'success': False,
+                    'conflicto': True,
+                    'mensaje': 'El horario ya no está disponible'
+                }
+        
+        for _ in range(REINTENTOS_CONFIRMACION):
+            numero_confirmacion = generar_numero_confirmacion(self.sede)
+            try:
+                conn.execute('''
                     INSERT INTO citas (numero_confirmacion, paciente_nombre, paciente_telefono,
                                      servicio_id, medico_id, fecha, hora)
                     VALUES (?, ?, ?, ?, ?, ?, ?)
                 ''', (numero_confirmacion, paciente_nombre, paciente_telefono,
                       servicio_id, medico_id, fecha, hora))
-                
-                conn.commit()
-                
+            except sqlite3.IntegrityError as e:
+                if 'numero_confirmacion' in str(e):
+                    continue  # Colisión improbable: generar otro número
+                # El índice único de horarios activos rechazó la cita
                 return {
-                    'success': True,
-                    'numero_confirmacion': numero_confirmacion,
-                    'mensaje': 'Cita creada exitosamente'
+                    'success': False,
+                    'conflicto': True,
+                    'mensaje': 'El horario ya no está disponible'
                 }
+            
+            return {
+                'success': True,
+                'numero_confirmacion': numero_confirmacion,
+                'fecha': fecha,
+                'hora': hora,
+                'mensaje': 'Cita creada exitosamente'
+            }
+        
+        return {
+            'success': False,
+            'mensaje': 'No se pudo generar un número de confirmación único'
+        }
+    
+    @metricas.instrumentado('db.crear_cita')
+    def crear_cita(self, paciente_nombre, paciente_telefono, servicio_id, medico_id, fecha, hora):
+        """Crea una nueva cita verificando y reservando el horario de forma atómica"""
+        duracion = self._duracion_servicio(servicio_id)
+        
+        cambios = []
+        versiones = []
+        
+        def operacion(conn):
+            antes = self._leer_version_citas(conn)
+            resultado = self._insertar_cita(conn, paciente_nombre, paciente_telefono,
+                                            servicio_id, medico_id, fecha, hora, duracion)
+            self._registrar_cambio(conn, resultado, resultado.get('numero_confirmacion'), cambios)
+            versiones[:] = [antes, self._leer_version_citas(conn)]
+            return resultado
+        
+        def al_confirmar(resultado):
+            with self._calendario.lock:
+                self._aplicar_en_replica(cambios)
+                if self._agenda_al_dia(versiones):
+                    self._calendario.ocupar(fecha, medico_id, hora, duracion)
+                else:
+                    self._calendario.invalidar(fecha)
+                self._snapshot.actualizar_fecha(fecha)
+        
+        try:
+            resultado = self._ejecutar_escritura(operacion, al_confirmar)
         except sqlite3.Error as e:
             return {
                 'success': False,
                 'mensaje': f'Error al crear la cita: {str(e)}'
             }
+        
+        if resultado.get('conflicto'):
+            # Otro proceso reservó ese horario: recargar la fecha desde la BD
+            with self._calendario.lock:
+                self._calendario.invalidar(fecha)
+                self._snapshot.actualizar_fecha(fecha)
+        return resultado
     
+    def _anular_cita(self, conn, numero_confirmacion):
+        """Marca la cita como cancelada dentro de la transacción abierta"""
+        cita = conn.execute('''
+            SELECT c.fecha, c.medico_id, c.hora, c.servicio_id, COALESCE(s.duracion, ?)
+            FROM citas c
+            LEFT JOIN servicios s ON s.id = c.servicio_id
+            WHERE c.numero_confirmacion = ? AND c.estado != 'cancelada'
+        ''', (DURACION_BASE, numero_confirmacion)).fetchone()
+        
+        if cita is None:
+            return {
+                'success': False,
+                'mensaje': 'Cita no encontrada o ya cancelada'
+            }
+        
+        conn.execute('''
+            UPDATE citas SET estado = 'cancelada' 
+            WHERE numero_confirmacion = ? AND estado != 'cancelada'
+        ''', (numero_confirmacion,))
+        
+        fecha, medico_id, hora, servicio_id, duracion = cita
+        return {
+            'success': True,
+            'mensaje': 'Cita cancelada exitosamente',
+            'cita': {
+                'fecha': fecha,
+                'hora': hora,
+                'medico_id': medico_id,
+                'servicio_id': servicio_id,
+                'duracion': duracion
+            }
+        }
+    
+    @metricas.instrumentado('db.cancelar_cita')
     def cancelar_cita(self, numero_confirmacion):
         """Cancela una cita existente"""
+        cambios = []
+        versiones = []
+        
+        def operacion(conn):
+            antes = self._leer_version_citas(conn)
+            resultado = self._anular_cita(conn, numero_confirmacion)
+            self._registrar_cambio(conn, resultado, numero_confirmacion, cambios)
+            versiones[:] = [antes, self._leer_version_citas(conn)]
+            return resultado
+        
+        def al_confirmar(resultado):
+            cita = resultado['cita']
+            with self._calendario.lock:
+                self._aplicar_en_replica(cambios)
+                if self._agenda_al_dia(versiones):
+                    self._calendario.liberar(cita['fecha'], cita['medico_id'], cita['hora'], cita['duracion'])
+                else:
+                    self._calendario.invalidar(cita['fecha'])
+                self._snapshot.actualizar_fecha(cita['fecha'])
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Verificar si la cita existe
-                cursor.execute('''
-                    SELECT id FROM citas WHERE numero_confirmacion = ? AND estado != 'cancelada'
-                ''', (numero_confirmacion,))
-                
-                if cursor.fetchone() is None:
-                    return {
-                        'success': False,
-                        'mensaje': 'Cita no encontrada o ya cancelada'
-                    }
-                
-                # Cancelar la cita
-                cursor.execute('''
-                    UPDATE citas SET estado = 'cancelada' 
-                    WHERE numero_confirmacion = ?
-                ''', (numero_confirmacion,))
-                
-                conn.commit()
-                
-                return {
-                    'success': True,
-                    'mensaje': 'Cita cancelada exitosamente'
-                }
+            return self._ejecutar_escritura(operacion, al_confirmar)
         except sqlite3.Error as e:
             return {
                 'success': False,
                 'mensaje': f'Error al cancelar la cita: {str(e)}'
             }
     
-    def buscar_citas(self, criterio, valor):
-        """Busca citas por nombre o teléfono"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+    def _sql_diferible(self, conn):
+        """Índices no únicos y triggers de citas, que se pueden recrear al final de una carga
+        
+        Los triggers del contador de versión se quedan: sin ellos, lo que otros
+        procesos escriban durante la carga no invalidaría su agenda.
+        """
+        return conn.execute('''
+            SELECT type, name, sql FROM sqlite_master
+            WHERE tbl_name = 'citas' AND sql IS NOT NULL AND name NOT LIKE 'citas_version%'
+              AND (type = 'trigger' OR (type = 'index' AND sql NOT LIKE 'CREATE UNIQUE%'))
+        ''').fetchall()
+    
+    @metricas.instrumentado('db.importar_citas')
+    def importar_citas(self, filas, tamano_lote=5000):
+        """Importa citas en lotes transaccionales con executemany
+        
+        `filas` es cualquier iterable de dicts (se consume en streaming) con
+        paciente_nombre, paciente_telefono, servicio_id, medico_id, fecha y hora;
+        numero_confirmacion, estado y created_at son opcionales. Los índices no
+        únicos y los triggers de búsqueda se eliminan durante la carga y se
+        recrean al final; quedan registrados en ddl_diferido, así que si el
+        proceso muere a mitad de la carga se recrean al abrir la base de nuevo.
+        Un lote rechazado se reintenta fila por fila.
+        
+        Devuelve {'importadas': n, 'rechazadas': [(numero_fila, motivo), ...]}.
+        """
+        importadas = 0
+        rechazadas = []
+        numeros = numeros_importacion(self.sede)
+        
+        def preparar(numero_fila, fila):
+            numero = fila.get('numero_confirmacion') or next(numeros)
+            return (
+                numero,
+                fila['paciente_nombre'],
+                fila['paciente_telefono'],
+                int(fila['servicio_id']),
+                int(fila['medico_id']),
+                _a_fecha(fila['fecha']).strftime("%Y-%m-%d"),
+                minutos_a_hora(hora_a_minutos(fila['hora'])),
+                fila.get('estado') or 'confirmada',
+                fila.get('created_at') or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            )
+        
+        insertar = '''
+            INSERT INTO citas (numero_confirmacion, paciente_nombre, paciente_telefono,
+                               servicio_id, medico_id, fecha, hora, estado, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        '''
+        
+        with self._pool.conexion() as conn:
+            try:
+                # Registro y borrado en la misma transacción: nunca se pierde el DDL
+                conn.execute("BEGIN IMMEDIATE")
+                diferidos = self._sql_diferible(conn)
+                conn.executemany("INSERT OR IGNORE INTO ddl_diferido (nombre, sql) VALUES (?, ?)",
+                                 [(nombre, sql) for _, nombre, sql in diferidos])
+                for tipo, nombre, _ in diferidos:
+                    conn.execute(f"DROP {tipo.upper()} IF EXISTS {nombre}")
+                conn.commit()
                 
-                if criterio == 'nombre':
-                    cursor.execute('''
-                        SELECT c.numero_confirmacion, c.paciente_nombre, c.fecha, c.hora,
-                               s.nombre as servicio, c.estado
-                        FROM citas c
-                        JOIN servicios s ON c.servicio_id = s.id
-                        WHERE c.paciente_nombre LIKE ? AND c.estado != 'cancelada'
-                        ORDER BY c.fecha DESC
-                    ''', (f"%{valor}%",))
-                elif criterio == 'telefono':
-                    cursor.execute('''
-                        SELECT c.numero_confirmacion, c.paciente_nombre, c.fecha, c.hora,
-                               s.nombre as servicio, c.estado
-                        FROM citas c
-                        JOIN servicios s ON c.servicio_id = s.id
-                        WHERE c.paciente_telefono = ? AND c.estado != 'cancelada'
-                        ORDER BY c.fecha DESC
-                    ''', (valor,))
+                numerados = enumerate(filas, start=1)
+                while True:
+                    lote = []
+                    for numero_fila, fila in itertools.islice(numerados, tamano_lote):
+                        try:
+                            lote.append((numero_fila, preparar(numero_fila, fila)))
+                        except (KeyError, TypeError, ValueError) as e:
+                            rechazadas.append((numero_fila, f'Fila inválida: {e}'))
+                    if not lote:
+                        break
+                    
+                    try:
+                        conn.execute("BEGIN IMMEDIATE")
+                        conn.executemany(insertar, [valores for _, valores in lote])
+                        conn.commit()
+                        importadas += len(lote)
+                        continue
+                    except sqlite3.IntegrityError:
+                        conn.rollback()
+                    
+                    # Lote con conflictos: insertar fila por fila para aislar las rechazadas
+                    conn.execute("BEGIN IMMEDIATE")
+                    for numero_fila, valores in lote:
+                        try:
+                            conn.execute(insertar, valores)
+                            importadas += 1
+                        except sqlite3.IntegrityError as e:
+                            rechazadas.append((numero_fila, str(e)))
+                    conn.commit()
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                # Recrear índices y triggers, y reindexar la búsqueda por nombre
+                restaurar_ddl_diferido(conn)
+                conn.execute("PRAGMA optimize")
                 
-                results = cursor.fetchall()
-                return [
-                    {
-                        'numero_confirmacion': row[0],
-                        'paciente_nombre': row[1],
-                        'fecha': row[2],
-                        'hora': row[3],
-                        'servicio': row[4],
-                        'estado': row[5]
-                    }
-                    for row in results
-                ]
-        except sqlite3.Error as e:
-            return []
\ No newline at end of file
+                if self._replica is not None and self._replica.cargada:
+                    self._replica.cargar(conn)
+                with self._calendario.lock:
+                    self._calendario.invalidar()
+                    self._snapshot.invalidar()
+                    self._version_citas = None
+        
+        return {'importadas': importadas, 'rechazadas': rechazadas}
+    
+    def exportar_citas(self, fecha_desde=None, fecha_hasta=None, tamano_lote=1000):
+        """Genera las citas (con servicio y precio) en streaming mediante fetchmany
+        
+        Usa una conexión de solo lectura propia, de modo que una exportación
+        larga no ocupa una conexión del pool. Con filtro de fechas se recorre el
+        índice por fecha (orden fecha, id); sin filtro, la tabla entera por id.
+        """
+        condiciones = []
+        parametros = []
+        if fecha_desde:
+            condiciones.append("c.fecha >= ?")
+            parametros.append(_a_fecha(fecha_desde).strftime("%Y-%m-%d"))
+        if fecha_hasta:
+            condiciones.append("c.fecha <= ?")
+            parametros.append(_a_fecha(fecha_hasta).strftime("%Y-%m-%d"))
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        # Ordenar por id con un filtro de fechas deja al planificador recorrer citas entera
+        orden = "c.fecha, c.id" if condiciones else "c.id"
+        
+        uri = f"file:{pathname2url(os.path.abspath(self.db_path))}?mode=ro"
+        conn = trazado_sql.conectar(uri, self.trazador, uri=True)
+        try:
+            cursor = conn.execute(f'''
+                SELECT c.id, c.numero_confirmacion, c.paciente_nombre, c.paciente_telefono,
+                       c.servicio_id, s.nombre, s.precio, c.medico_id, c.fecha, c.hora,
+                       c.estado, c.created_at
+                FROM citas c
+                LEFT JOIN servicios s ON s.id = c.servicio_id
+                {where}
+                ORDER BY {orden}
+            ''', parametros)
+            columnas = COLUMNAS_EXPORTACION
+            while True:
+                bloque = cursor.fetchmany(tamano_lote)
+                if not bloque:
+                    break
+                for row in bloque:
+                    yield dict(zip(columnas, row))
+        finally:
+            conn.close()
+    
+    @metricas.instrumentado('db.analitica_ocupacion')
+    def analitica_ocupacion(self, fecha_desde=None, fecha_hasta=None):
+        """AnaliticaOcupacion (requiere NumPy) del rango; por defecto, el último año"""
+        from analitica import AnaliticaOcupacion
+        desde = _a_fecha(fecha_desde) if fecha_desde else None
+        hasta = _a_fecha(fecha_hasta) if fecha_hasta else None
+        if self._replica is not None:
+            self._agenda_vigente()
+        with self._lectura() as conn:
+            return AnaliticaOcupacion(conn, desde, hasta)
+    
+    def _pagina_citas(self, conn, criterio, valor, despues, limite):
+        """Filas de una página de búsqueda ordenadas por (fecha, id) descendente
+        
+        `despues` es la clave (fecha, id) de la última fila ya entregada; la
+        comparación por valores de fila permite a SQLite saltar directo a esa
+        posición del índice en vez de recorrer las páginas anteriores.
+        """
+        keyset = "AND (c.fecha, c.id) < (?, ?)" if despues else ""
+        parametros_keyset = tuple(despues) if despues else ()
+        
+        if criterio == 'nombre':
+            consulta = consulta_fts_nombre(valor)
+            if not consulta:
+                return []
+            # Búsqueda FTS5 por prefijo, sin distinguir acentos ni mayúsculas
+            return conn.execute(f'''
+                SELECT c.numero_confirmacion, c.paciente_nombre, c.fecha, c.hora,
+                       s.nombre as servicio, c.estado, c.id
+                FROM citas_fts
+                JOIN citas c ON c.id = citas_fts.rowid
+                JOIN servicios s ON c.servicio_id = s.id
+                WHERE citas_fts MATCH ? AND c.estado != 'cancelada' {keyset}
+                ORDER BY c.fecha DESC, c.id DESC
+                LIMIT ?
+            ''', (consulta, *parametros_keyset, limite)).fetchall()
+        if criterio == 'telefono':
+            return conn.execute(f'''
+                SELECT c.numero_confirmacion, c.paciente_nombre, c.fecha, c.hora,
+                       s.nombre as servicio, c.estado, c.id
+                FROM citas c
+                JOIN servicios s ON c.servicio_id = s.id
+                WHERE c.paciente_telefono = ? AND c.estado != 'cancelada' {keyset}
+                ORDER BY c.fecha DESC, c.id DESC
+                LIMIT ?
+            ''', (valor, *parametros_keyset, limite)).fetchall()
+        return []
+    
+    @metricas.instrumentado('db.buscar_citas_pagina')
+    def buscar_citas_pagina(self, criterio, valor, tamano_pagina=10, cursor=None):
+        """Una página de citas por nombre o teléfono, de la más reciente a la más antigua
+        
+        Devuelve {'citas': [...], 'cursor': token}; el token se pasa a la
+        siguiente llamada para continuar y es None cuando no hay más resultados.
+        """
+        try:
+            despues = decodificar_cursor(cursor) if cursor else None
+        except ValueError:
+            return {'citas': [], 'cursor': None}
+        
+        try:
+            if self._replica is not None:
+                self._agenda_vigente()
+            with self._lectura() as conn:
+                # Una fila extra indica si existe una página siguiente
+                filas = self._pagina_citas(conn, criterio, valor, despues, tamano_pagina + 1)
+        except sqlite3.Error:
+            return {'citas': [], 'cursor': None}
+        
+        pagina = filas[:tamano_pagina]
+        siguiente = None
+        if len(filas) > tamano_pagina:
+            siguiente = codificar_cursor(pagina[-1][2], pagina[-1][6])
+        return {'citas': [_fila_busqueda(row) for row in pagina], 'cursor': siguiente}
+    
+    def iterar_citas(self, criterio, valor, tamano_lote=200):
+        """Genera todas las citas que coinciden, leyendo por páginas
+        
+        Cada página toma una conexión del pool solo mientras se lee, así que el
+        consumidor puede detenerse o tardar sin retener conexiones.
+        """
+        despues = None
+        while True:
+            try:
+                if despues is None and self._replica is not None:
+                    self._agenda_vigente()
+                with self._lectura() as conn:
+                    filas = self._pagina_citas(conn, criterio, valor, despues, tamano_lote)
+            except sqlite3.Error:
+                return
+            for row in filas:
+                yield _fila_busqueda(row)
+            if len(filas) < tamano_lote:
+                return
+            despues = (filas[-1][2], filas[-1][6])
+    
+    @metricas.instrumentado('db.buscar_citas')
+    def buscar_citas(self, criterio, valor):
+        """Busca citas por nombre o teléfono (todas las coincidencias)"""
+        # Páginas grandes: cada página de la búsqueda FTS vuelve a ordenar todas las coincidencias
+        return list(self.iterar_citas(criterio, valor, tamano_lote=2000))
@@ -0,0 +1,182 @@
+# escritor.py - Hilo escritor único con commits agrupados
+#
+# Con DatabaseManager(escritura_agrupada=True) las reservas y cancelaciones no
+# abren su propia transacción: se encolan y un solo hilo las aplica en lotes,
+# cada operación dentro de su SAVEPOINT y un único COMMIT por lote. Quien
+# escribe espera su Future y recibe su propio resultado o excepción.
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import metricas
+
+MAX_LOTE = 64
+ESPERA_LOTE_MS = 2.0
+
+_FIN = object()
+
+class EscritorAgrupado:
+    """Serializa las escrituras en un hilo y las confirma por lotes
+
+    `abrir_conexion()` devuelve la conexión dedicada del hilo y `lock` es el
+    candado bajo el que se hace cada COMMIT y se ejecutan los al_confirmar,
+    para que los índices en memoria cambien en el mismo orden que la base.
+    """
+
+    def __init__(self, abrir_conexion, lock, max_lote=MAX_LOTE, espera_lote_ms=ESPERA_LOTE_MS,
+                 reintentos_bloqueo=6, espera_reintento=0.02, es_bloqueo=None):
+        self._abrir_conexion = abrir_conexion
+        self._lock = lock
+        self.max_lote = max_lote
+        self.espera_lote = espera_lote_ms / 1000
+        self.reintentos_bloqueo = reintentos_bloqueo
+        self.espera_reintento = espera_reintento
+        self._es_bloqueo = es_bloqueo or (lambda e: 'locked' in str(e).lower() or 'busy' in str(e).lower())
+        self._cola = queue.SimpleQueue()
+        self._hilo = None
+        self._inicio_lock = threading.Lock()
+        self._cerrado = False
+        self.lotes = 0
+        self.operaciones = 0
+
+    def enviar(self, operacion, al_confirmar=None):
+        """Encola operacion(conn) y devuelve un Future con su resultado
+
+        Como en DatabaseManager._ejecutar_escritura, la operación se confirma solo
+        si su resultado tiene 'success'; si no, se deshace su SAVEPOINT.
+        """
+        futuro = Future()
+        if self._cerrado:
+            futuro.set_exception(sqlite3.ProgrammingError("El escritor está cerrado"))
+            return futuro
+        if self._hilo is None:
+            self._iniciar()
+        self._cola.put((operacion, al_confirmar, futuro))
+        return futuro
+
+    def _iniciar(self):
+        with self._inicio_lock:
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._ejecutar, name='escritor-citas', daemon=True)
+                self._hilo.start()
+
+    def cerrar(self):
+        """Procesa lo pendiente y termina el hilo"""
+        self._cerrado = True
+        if self._hilo is not None:
+            self._cola.put(_FIN)
+            self._hilo.join()
+
+    def _siguiente_lote(self):
+        """Bloquea hasta la primera operación y junta las que lleguen durante la espera"""
+        primera = self._cola.get()
+        if primera is _FIN:
+            return None, True
+        lote = [primera]
+        limite = time.monotonic() + self.espera_lote
+        while len(lote) < self.max_lote:
+            restante = limite - time.monotonic()
+            try:
+                item = self._cola.get(timeout=restante) if restante > 0 else self._cola.get_nowait()
+            except queue.Empty:
+                break
+            if item is _FIN:
+                return lote, True
+            lote.append(item)
+        return lote, False
+
+    def _ejecutar(self):
+        conn = None
+        try:
+            conn = self._abrir_conexion()
+        except sqlite3.Error as e:
+            error_apertura = e
+        else:
+            error_apertura = None
+
+        terminar = False
+        while not terminar:
+            lote, terminar = self._siguiente_lote()
+            if not lote:
+                continue
+            if error_apertura is not None:
+                for _, _, futuro in lote:
+                    futuro.set_exception(error_apertura)
+                continue
+            try:
+                with metricas.medir('db.lote_escritura'):
+                    self._aplicar_lote(conn, lote)
+            except Exception as e:
+                # Un error inesperado no debe dejar a nadie esperando su Future
+                if conn.in_transaction:
+                    conn.rollback()
+                for _, _, futuro in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+
+        if conn is not None:
+            conn.close()
+
+    def _comenzar(self, conn):
+        for intento in range(self.reintentos_bloqueo):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if not self._es_bloqueo(e) or intento == self.reintentos_bloqueo - 1:
+                    raise
+                time.sleep(self.espera_reintento * (2 ** intento) * (1 + random.random()))
+
+    def _aplicar_lote(self, conn, lote):
+        try:
+            self._comenzar(conn)
+        except sqlite3.Error as e:
+            for _, _, futuro in lote:
+                futuro.set_exception(e)
+            return
+
+        salidas = []  # (futuro, resultado, excepción, al_confirmar)
+        for operacion, al_confirmar, futuro in lote:
+            if not futuro.set_running_or_notify_cancel():
+                continue
+            conn.execute("SAVEPOINT operacion")
+            try:
+                resultado = operacion(conn)
+            except Exception as e:
+                conn.execute("ROLLBACK TO operacion")
+                conn.execute("RELEASE operacion")
+                salidas.append((futuro, None, e, None))
+                continue
+            if not resultado.get('success'):
+                conn.execute("ROLLBACK TO operacion")
+            conn.execute("RELEASE operacion")
+            salidas.append((futuro, resultado, None, al_confirmar))
+
+        with self._lock:
+            try:
+                conn.commit()
+            except sqlite3.Error as e:
+                # Nada del lote quedó guardado: todas las operaciones reciben el error
+                if conn.in_transaction:
+                    conn.rollback()
+                for futuro, _, _, _ in salidas:
+                    futuro.set_exception(e)
+                return
+            for _, resultado, error, al_confirmar in salidas:
+                if error is None and al_confirmar is not None and resultado.get('success'):
+                    try:
+                        al_confirmar(resultado)
+                    except Exception:
+                        # La escritura ya está confirmada; la respuesta sigue siendo esa
+                        pass
+
+        self.lotes += 1
+        self.operaciones += len(salidas)
+        for futuro, resultado, error, _ in salidas:
+            if error is not None:
+                futuro.set_exception(error)
+            else:
+                futuro.set_result(resultado)
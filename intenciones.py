@@ -0,0 +1,360 @@
+# intenciones.py - Clasificación de intenciones con un autómata de palabras clave
+import re
+import sys
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+# Señales: cada palabra clave activa una o más señales al aparecer en el mensaje
+SENALES = {
+    'cambio': ["cambiar", "reagendar", "mover", "cambio"],
+    'cancelacion': ["cancelar", "cancela", "eliminar"],
+    'busqueda': ["buscar", "encontrar", "mi cita", "cita de"],
+    'agendar': ["cita", "agendar", "reservar", "turno", "consulta"],
+    'menciona_cita': ["cita"],
+    'precios': ["precio", "costo", "cuanto", "tarifa"],
+    'horarios': ["horario", "hora", "abierto", "cerrado", "disponible"],
+    'emergencia': ["emergencia", "urgente", "dolor", "accidente", "grave"],
+    'saludo': ["hola", "buenos", "buenas", "saludos", "ayuda"],
+}
+
+# Reglas en orden de prioridad: (intención, señales requeridas, señales excluidas).
+# Además de las palabras clave existen las señales 'confirmacion' (MC + dígitos),
+# 'telefono', 'servicio' y 'nombre'.
+REGLAS = [
+    ("cambiar_cita", {'cambio', 'confirmacion'}, set()),
+    ("solicitar_cambio", {'cambio'}, set()),
+    ("cancelar_cita", {'cancelacion', 'confirmacion'}, set()),
+    ("solicitar_cancelacion", {'cancelacion'}, set()),
+    ("buscar_cita", {'busqueda'}, set()),
+    ("procesar_cita_completa", {'telefono', 'servicio'}, set()),
+    ("procesar_cita_completa", {'telefono', 'nombre'}, set()),
+    ("agendar_cita", {'agendar'}, set()),
+    ("precios_servicios", {'precios'}, set()),
+    ("horarios_disponibles", {'horarios'}, {'menciona_cita'}),
+    ("emergencia", {'emergencia'}, set()),
+    ("saludo", {'saludo'}, set()),
+]
+
+INTENCION_POR_DEFECTO = "informacion_general"
+
+PATRON_CONFIRMACION = re.compile(r'mc\d+')
+PATRON_TELEFONO = re.compile(r'\b\d{10}\b|\b\d{2}[-\s]?\d{4}[-\s]?\d{4}\b')
+PATRONES_TELEFONO = [
+    re.compile(r'\b(\d{10})\b'),
+    re.compile(r'\b(\d{2}[-\s]?\d{4}[-\s]?\d{4})\b'),
+    re.compile(r'\b(\d{3}[-\s]?\d{3}[-\s]?\d{4})\b'),
+]
+
+# Preferencias para buscar el primer horario libre
+PATRON_TURNO = re.compile(r'\b(?:en|por|de) las? (mañanas?|tardes?)\b|\b(matutino|vespertino)\b')
+PATRON_NO_ANTES = re.compile(
+    r'\b(?:no antes del?|a partir del?|desde el)\s+(lunes|martes|mi[eé]rcoles|jueves|viernes|s[aá]bado)\b'
+)
+PATRON_LO_ANTES = re.compile(
+    r'\blo (?:antes|m[aá]s pronto) posible\b|\blo m[aá]s pronto\b|\bcuanto antes\b'
+    r'|\bprimer[oa]? (?:horario|cita|espacio) (?:libre|disponible)\b'
+)
+
+def _construir_automata(senales):
+    """Compila todas las palabras clave en una sola expresión regular
+
+    La búsqueda con lookahead prueba cada posición del texto y devuelve la
+    palabra más larga que empieza ahí; las palabras que son prefijo de ella
+    (p. ej. "cita" en "cita de") se agregan con la tabla de señales heredadas.
+    """
+    senales_por_palabra = {}
+    for senal, palabras in senales.items():
+        for palabra in palabras:
+            senales_por_palabra.setdefault(palabra, set()).add(senal)
+
+    palabras = sorted(senales_por_palabra, key=len, reverse=True)
+    for palabra in palabras:
+        for otra in palabras:
+            if otra != palabra and palabra.startswith(otra):
+                senales_por_palabra[palabra] |= senales_por_palabra[otra]
+
+    patron = re.compile('(?=(' + '|'.join(re.escape(p) for p in palabras) + '))')
+    return patron, {p: frozenset(s) for p, s in senales_por_palabra.items()}
+
+_AUTOMATA, _SENALES_POR_PALABRA = _construir_automata(SENALES)
+
+@lru_cache(maxsize=8)
+def _patron_servicios(nombres):
+    """Expresión compilada para los nombres del catálogo (una por versión)"""
+    if not nombres:
+        return None
+    return re.compile('|'.join(re.escape(n) for n in sorted(nombres, key=len, reverse=True)))
+
+def senales_mensaje(mensaje, servicios_nombres=None):
+    """Devuelve el conjunto de señales presentes en el mensaje en una pasada
+
+    `servicios_nombres` es una función que devuelve los nombres del catálogo;
+    solo se llama cuando el mensaje trae un teléfono y hace falta saberlo.
+    """
+    mensaje_lower = mensaje.lower()
+    senales = set()
+
+    for match in _AUTOMATA.finditer(mensaje_lower):
+        senales |= _SENALES_POR_PALABRA[match.group(1)]
+
+    if PATRON_CONFIRMACION.search(mensaje_lower):
+        senales.add('confirmacion')
+
+    if PATRON_TELEFONO.search(mensaje):
+        senales.add('telefono')
+        if len([p for p in mensaje.split() if p.isalpha() and len(p) > 2]) >= 2:
+            senales.add('nombre')
+        if servicios_nombres is not None:
+            try:
+                nombres = tuple(n.lower() for n in servicios_nombres())
+            except Exception:
+                nombres = ()
+            patron = _patron_servicios(nombres)
+            if patron is not None and patron.search(mensaje_lower):
+                senales.add('servicio')
+
+    return senales
+
+def intenciones_candidatas(senales):
+    """Todas las intenciones cuyas reglas se cumplen, en orden de prioridad"""
+    candidatas = []
+    for intencion, requeridas, excluidas in REGLAS:
+        if requeridas <= senales and not excluidas & senales and intencion not in candidatas:
+            candidatas.append(intencion)
+    return candidatas
+
+def normalizar_mensaje(mensaje):
+    """Colapsa espacios para que variantes triviales compartan entrada"""
+    return ' '.join((mensaje or '').split())
+
+def detectar_intencion(mensaje, servicios_nombres=None):
+    """Detecta la intención del usuario a partir de las señales del mensaje"""
+    # Con los espacios colapsados, igual que la clave de detectar_intencion_cacheada
+    mensaje = normalizar_mensaje(mensaje)
+    if not mensaje:
+        return "saludo"
+
+    candidatas = intenciones_candidatas(senales_mensaje(mensaje, servicios_nombres))
+    return candidatas[0] if candidatas else INTENCION_POR_DEFECTO
+
+def extraer_datos_mensaje(mensaje, servicios):
+    """Extrae información detallada del mensaje para agendar cita
+
+    `servicios` es la lista de servicios del catálogo (dicts con id y nombre).
+    """
+    mensaje = normalizar_mensaje(mensaje)
+    datos = {}
+
+    try:
+        # Buscar teléfono
+        for pattern in PATRONES_TELEFONO:
+            match = pattern.search(mensaje)
+            if match:
+                datos['telefono'] = match.group().replace('-', '').replace(' ', '')
+                break
+
+        # Buscar servicio y obtener su ID
+        mensaje_lower = mensaje.lower()
+
+        for servicio in servicios:
+            nombre_servicio = servicio['nombre'].lower()
+            if nombre_servicio in mensaje_lower:
+                datos['servicio_id'] = servicio['id']
+                datos['medico_id'] = servicio.get('medico_id', 1)
+                break
+
+        # Preferencias de horario: turno, "no antes del <día>" y "lo antes posible"
+        match = PATRON_TURNO.search(mensaje_lower)
+        if match:
+            turno = match.group(1) or match.group(2)
+            datos['turno'] = 'manana' if turno.startswith(('mañana', 'matutino')) else 'tarde'
+
+        match = PATRON_NO_ANTES.search(mensaje_lower)
+        if match:
+            datos['no_antes_de'] = match.group(1).replace('é', 'e').replace('á', 'a')
+            # Ese día es un límite, no el día elegido
+            mensaje_lower = mensaje_lower[:match.start()] + mensaje_lower[match.end():]
+
+        if PATRON_LO_ANTES.search(mensaje_lower):
+            datos['lo_antes_posible'] = True
+
+        # Buscar días
+        dias_variantes = {
+            'lunes': ['lunes', 'lun'],
+            'martes': ['martes', 'mar'],
+            'miercoles': ['miercoles', 'miércoles', 'mie'],
+            'jueves': ['jueves', 'jue'],
+            'viernes': ['viernes', 'vie'],
+            'sabado': ['sabado', 'sábado', 'sab']
+        }
+
+        for dia_base, variantes in dias_variantes.items():
+            if any(variante in mensaje_lower for variante in variantes):
+                datos['dia_preferido'] = dia_base
+                break
+
+        # CORRECCIÓN CRÍTICA: Mejorar extracción de nombres
+        # Limpiar el mensaje primero
+        mensaje_limpio = mensaje.replace(',', ' ').replace('tel', '').replace('teléfono', '')
+
+        # Remover números de teléfono del texto para extracción de nombres
+        for pattern in PATRONES_TELEFONO:
+            mensaje_limpio = pattern.sub('', mensaje_limpio)
+
+        # Palabras a ignorar en la extracción de nombres
+        palabras_ignore = {
+            'para', 'con', 'del', 'una', 'cita', 'agendar', 'consulta', 'soy', 
+            'general', 'laboratorio', 'cardiología', 'pediatría', 'dermatología',
+            'prefiero', 'cualquier', 'día', 'semana', 'lunes', 'martes', 
+            'miércoles', 'miercoles', 'jueves', 'viernes', 'sábado', 'sabado', 'domingo',
+            'mañana', 'mañanas', 'tarde', 'tardes', 'matutino', 'vespertino', 'por', 'las',
+            'antes', 'posible', 'pronto', 'cuanto', 'más', 'mas', 'partir', 'desde',
+            'primer', 'primera', 'primero', 'horario', 'espacio', 'libre', 'disponible'
+        }
+
+        # Extraer nombres (solo palabras alfabéticas que no sean palabras a ignorar)
+        palabras = mensaje_limpio.split()
+        nombres = []
+
+        for palabra in palabras:
+            palabra_clean = palabra.strip('.,!?;:').title()
+            if (palabra_clean.isalpha() and 
+                len(palabra_clean) > 2 and 
+                palabra_clean.lower() not in palabras_ignore):
+                nombres.append(palabra_clean)
+
+            if len(nombres) >= 4:  # Máximo 4 nombres (nombre + apellidos)
+                break
+
+        # Filtrar nombres más inteligentemente
+        if nombres:
+            # Si hay muchos nombres, tomar solo los primeros 3-4
+            if len(nombres) > 4:
+                nombres = nombres[:4]
+
+            # Verificar que no sean palabras extrañas
+            nombres_validos = []
+            for nombre in nombres:
+                # Solo nombres que tengan al menos 3 caracteres y sean alfabéticos
+                if len(nombre) >= 3 and nombre.isalpha() and nombre.lower() not in palabras_ignore:
+                    nombres_validos.append(nombre)
+
+            if nombres_validos:
+                datos['nombre'] = ' '.join(nombres_validos)
+
+    except Exception as e:
+        # En caso de error, devolver datos vacíos
+        pass
+
+    return datos
+
+# Palabras de relleno que no forman parte del nombre en "buscar mi cita de ..."
+PALABRAS_BUSQUEDA = {
+    'buscar', 'busca', 'busco', 'encontrar', 'encuentra', 'mi', 'mis', 'cita', 'citas',
+    'de', 'del', 'la', 'las', 'el', 'los', 'a', 'nombre', 'por', 'favor', 'quiero',
+    'puedes', 'necesito', 'tengo', 'telefono', 'teléfono', 'tel', 'con', 'para', 'es',
+}
+
+def extraer_criterio_busqueda(mensaje):
+    """Devuelve ('telefono', número), ('nombre', texto) o None para buscar citas"""
+    for pattern in PATRONES_TELEFONO:
+        match = pattern.search(mensaje)
+        if match:
+            return 'telefono', match.group().replace('-', '').replace(' ', '')
+
+    palabras = [p.strip('.,!?;:"\'') for p in mensaje.split()]
+    nombre = [p for p in palabras if p.isalpha() and p.lower() not in PALABRAS_BUSQUEDA]
+    if nombre:
+        return 'nombre', ' '.join(nombre)
+    return None
+
+class CacheLRU:
+    """Caché LRU acotada por número de entradas y tamaño aproximado en bytes
+
+    Es segura entre hilos, por lo que puede compartirse entre todas las
+    sesiones de Streamlit del proceso.
+    """
+
+    def __init__(self, max_entradas=4096, max_bytes=4 * 1024 * 1024):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._datos = OrderedDict()  # clave -> (valor, tamaño)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, calcular):
+        """Devuelve el valor en caché o lo calcula con calcular() y lo guarda"""
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None:
+                self._datos.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[0]
+            self.fallos += 1
+
+        valor = calcular()
+        tamano = _tamano_aproximado(clave, valor)
+
+        with self._lock:
+            anterior = self._datos.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= anterior[1]
+            self._datos[clave] = (valor, tamano)
+            self._bytes += tamano
+            while self._datos and (len(self._datos) > self.max_entradas or self._bytes > self.max_bytes):
+                _, (_, liberado) = self._datos.popitem(last=False)
+                self._bytes -= liberado
+        return valor
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+            self._bytes = 0
+            self.aciertos = 0
+            self.fallos = 0
+
+    def estadisticas(self):
+        """Aciertos, fallos y ocupación actual de la caché"""
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': self.aciertos / total if total else 0.0,
+                'entradas': len(self._datos),
+                'bytes': self._bytes,
+            }
+
+def _tamano_aproximado(clave, valor):
+    tamano = sum(sys.getsizeof(parte) for parte in clave) + sys.getsizeof(valor)
+    if isinstance(valor, dict):
+        tamano += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in valor.items())
+    return tamano
+
+# Caché compartida de intenciones y datos extraídos por mensaje normalizado
+CACHE_MENSAJES = CacheLRU()
+
+def detectar_intencion_cacheada(mensaje, version_catalogo, servicios_nombres=None):
+    """detectar_intencion memoizada por (mensaje en minúsculas, versión del catálogo)"""
+    # La detección colapsa espacios y no distingue mayúsculas, así que la clave tampoco
+    clave = ('intencion', version_catalogo, normalizar_mensaje(mensaje).lower())
+    return CACHE_MENSAJES.obtener(clave, lambda: detectar_intencion(mensaje, servicios_nombres))
+
+def extraer_datos_cacheados(mensaje, version_catalogo, obtener_servicios):
+    """extraer_datos_mensaje memoizada por (mensaje, versión del catálogo)
+
+    `obtener_servicios` solo se llama cuando el mensaje no está en caché.
+    """
+    clave = ('datos', version_catalogo, normalizar_mensaje(mensaje))
+
+    def calcular():
+        try:
+            servicios = obtener_servicios()
+        except Exception:
+            servicios = []
+        return extraer_datos_mensaje(mensaje, servicios)
+
+    return dict(CACHE_MENSAJES.obtener(clave, calcular))
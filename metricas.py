@@ -0,0 +1,163 @@
+# metricas.py - Histogramas de latencia en proceso por etapa del chat y método de BD
+#
+#   with metricas.medir('chat.detectar_intencion'):
+#       ...
+#
+#   @metricas.instrumentado('db.crear_cita')
+#   def crear_cita(...): ...
+#
+# Se desactivan con la variable de entorno CLINICA_METRICAS=0 o con
+# metricas.habilitar(False); desactivadas solo cuestan una comprobación de bandera.
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Límites superiores de los buckets en milisegundos (el último recoge el resto)
+LIMITES_MS = (
+    0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000,
+    float('inf'),
+)
+
+PERCENTILES = (50, 95, 99)
+
+_habilitadas = os.environ.get('CLINICA_METRICAS', '1') != '0'
+
+def habilitadas():
+    return _habilitadas
+
+def habilitar(valor=True):
+    """Activa o desactiva la medición en todo el proceso"""
+    global _habilitadas
+    _habilitadas = bool(valor)
+
+class Histograma:
+    """Distribución de latencias con buckets fijos; segura entre hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.cuentas = [0] * len(LIMITES_MS)
+            self.total = 0
+            self.suma_ms = 0.0
+            self.minimo_ms = float('inf')
+            self.maximo_ms = 0.0
+
+    def observar(self, ms):
+        indice = bisect_left(LIMITES_MS, ms)
+        with self._lock:
+            self.cuentas[indice] += 1
+            self.total += 1
+            self.suma_ms += ms
+            if ms < self.minimo_ms:
+                self.minimo_ms = ms
+            if ms > self.maximo_ms:
+                self.maximo_ms = ms
+
+    def percentil(self, p):
+        """Estimación del percentil p interpolando dentro del bucket"""
+        with self._lock:
+            cuentas = list(self.cuentas)
+            total = self.total
+            minimo, maximo = self.minimo_ms, self.maximo_ms
+        if not total:
+            return 0.0
+        objetivo = total * p / 100
+        acumulado = 0
+        for i, cuenta in enumerate(cuentas):
+            if cuenta and acumulado + cuenta >= objetivo:
+                inferior = max(LIMITES_MS[i - 1] if i else 0.0, minimo)
+                superior = min(LIMITES_MS[i], maximo)
+                fraccion = (objetivo - acumulado) / cuenta
+                return inferior + (superior - inferior) * fraccion
+            acumulado += cuenta
+        return maximo
+
+    def resumen(self):
+        resumen = {
+            'n': self.total,
+            'media_ms': self.suma_ms / self.total if self.total else 0.0,
+            'max_ms': self.maximo_ms,
+        }
+        for p in PERCENTILES:
+            resumen[f'p{p}_ms'] = self.percentil(p)
+        return resumen
+
+class Registro:
+    """Colección de histogramas por nombre de etapa"""
+
+    def __init__(self):
+        self._histogramas = {}
+        self._lock = threading.Lock()
+
+    def histograma(self, nombre):
+        histograma = self._histogramas.get(nombre)
+        if histograma is None:
+            with self._lock:
+                histograma = self._histogramas.setdefault(nombre, Histograma())
+        return histograma
+
+    def observar(self, nombre, segundos):
+        self.histograma(nombre).observar(segundos * 1000)
+
+    def reiniciar(self):
+        with self._lock:
+            self._histogramas.clear()
+
+    def resumen(self):
+        """{nombre: {'n', 'media_ms', 'max_ms', 'p50_ms', 'p95_ms', 'p99_ms'}}"""
+        with self._lock:
+            nombres = sorted(self._histogramas)
+        return {nombre: self._histogramas[nombre].resumen() for nombre in nombres}
+
+    def a_json(self):
+        return json.dumps(self.resumen(), ensure_ascii=False, indent=2)
+
+    def a_texto(self):
+        """Una línea por etapa, alineada, apta para logs o scraping con grep"""
+        resumen = self.resumen()
+        if not resumen:
+            return "(sin mediciones)"
+        ancho = max(len(nombre) for nombre in resumen)
+        lineas = [f"{'etapa':<{ancho}}  {'n':>7}  {'p50':>9}  {'p95':>9}  {'p99':>9}  {'max':>9}"]
+        for nombre, r in resumen.items():
+            lineas.append(
+                f"{nombre:<{ancho}}  {r['n']:>7}  {r['p50_ms']:>7.2f}ms  {r['p95_ms']:>7.2f}ms"
+                f"  {r['p99_ms']:>7.2f}ms  {r['max_ms']:>7.2f}ms"
+            )
+        return '\n'.join(lineas)
+
+REGISTRO = Registro()
+
+@contextmanager
+def medir(nombre, registro=REGISTRO):
+    """Mide el bloque y lo acumula en el histograma `nombre`"""
+    if not _habilitadas:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registro.observar(nombre, time.perf_counter() - inicio)
+
+def instrumentado(nombre, registro=REGISTRO):
+    """Decorador que mide cada llamada a la función (incluidas las que fallan)"""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if not _habilitadas:
+                return funcion(*args, **kwargs)
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                registro.observar(nombre, time.perf_counter() - inicio)
+        return envoltura
+    return decorador
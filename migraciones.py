@@ -0,0 +1,309 @@
+# migraciones.py - Migraciones versionadas del esquema SQLite
+import logging
+import sqlite3
+
+log = logging.getLogger('clinica.migraciones')
+
+def cancelar_citas_duplicadas(conn):
+    """Deja activa solo la cita más antigua de cada horario reservado dos veces
+
+    Antes del índice único se podía reservar el mismo horario más de una vez; sin
+    esto la migración 3 falla en esas bases y la aplicación no arranca. Las demás
+    citas del horario se cancelan y cada una queda registrada en el log para que
+    la clínica avise al paciente. Devuelve las filas canceladas.
+    """
+    duplicadas = conn.execute('''
+        SELECT c.id, c.numero_confirmacion, c.paciente_nombre, c.paciente_telefono,
+               c.medico_id, c.fecha, c.hora, g.conservada
+        FROM citas c
+        JOIN (
+            SELECT medico_id, fecha, hora, MIN(id) AS conservada
+            FROM citas WHERE estado != 'cancelada'
+            GROUP BY medico_id, fecha, hora HAVING COUNT(*) > 1
+        ) g ON c.medico_id = g.medico_id AND c.fecha = g.fecha AND c.hora = g.hora
+        WHERE c.estado != 'cancelada' AND c.id != g.conservada
+        ORDER BY c.fecha, c.hora, c.id
+    ''').fetchall()
+    for cita_id, numero, nombre, telefono, medico_id, fecha, hora, conservada in duplicadas:
+        log.warning("Cita %s (id %s, %s, tel. %s) cancelada: médico %s ya tenía el %s a las %s "
+                    "con la cita id %s", numero, cita_id, nombre, telefono, medico_id, fecha, hora,
+                    conservada)
+    conn.executemany("UPDATE citas SET estado = 'cancelada' WHERE id = ?",
+                     [(fila[0],) for fila in duplicadas])
+    if duplicadas:
+        log.warning("Migración 3: %d citas duplicadas canceladas", len(duplicadas))
+    return duplicadas
+
+def restaurar_ddl_diferido(conn):
+    """Recrea los índices y triggers que una importación dejó registrados en ddl_diferido
+
+    importar_citas los registra en la misma transacción en que los elimina; si el
+    proceso muere a mitad de la carga, la siguiente apertura de la base los
+    recrea y reindexa la búsqueda por nombre. Devuelve los nombres recreados.
+    """
+    if not conn.execute("SELECT 1 FROM ddl_diferido LIMIT 1").fetchone():
+        return []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        existentes = {nombre for (nombre,) in conn.execute("SELECT name FROM sqlite_master")}
+        recreados = []
+        for nombre, sql in conn.execute("SELECT nombre, sql FROM ddl_diferido").fetchall():
+            if nombre not in existentes:
+                conn.execute(sql)
+                recreados.append(nombre)
+        # Las filas cargadas sin los triggers de búsqueda no están en el índice FTS
+        conn.execute("INSERT INTO citas_fts (citas_fts) VALUES ('rebuild')")
+        conn.execute("DELETE FROM ddl_diferido")
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return recreados
+
+# Cada migración: (versión, descripción, sentencias). La versión aplicada se
+# guarda en PRAGMA user_version; una sentencia puede ser SQL o una función(conn).
+MIGRACIONES = [
+    (1, "Esquema base: médicos, servicios y citas", [
+        '''
+        CREATE TABLE IF NOT EXISTS medicos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            especialidad TEXT NOT NULL,
+            telefono TEXT,
+            email TEXT,
+            activo BOOLEAN DEFAULT TRUE
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS servicios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            precio REAL NOT NULL,
+            duracion INTEGER DEFAULT 30,
+            medico_id INTEGER,
+            medico TEXT,
+            activo BOOLEAN DEFAULT TRUE,
+            FOREIGN KEY (medico_id) REFERENCES medicos (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS citas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            numero_confirmacion TEXT UNIQUE NOT NULL,
+            paciente_nombre TEXT NOT NULL,
+            paciente_telefono TEXT NOT NULL,
+            servicio_id INTEGER NOT NULL,
+            medico_id INTEGER NOT NULL,
+            fecha TEXT NOT NULL,
+            hora TEXT NOT NULL,
+            estado TEXT DEFAULT 'confirmada',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (servicio_id) REFERENCES servicios (id),
+            FOREIGN KEY (medico_id) REFERENCES medicos (id)
+        )
+        ''',
+    ]),
+    (2, "Índices secundarios de citas", [
+        "CREATE INDEX IF NOT EXISTS idx_citas_fecha_estado ON citas (fecha, estado)",
+        "CREATE INDEX IF NOT EXISTS idx_citas_medico_fecha_hora ON citas (medico_id, fecha, hora)",
+        "CREATE INDEX IF NOT EXISTS idx_citas_telefono ON citas (paciente_telefono, fecha)",
+    ]),
+    (3, "Índice único de horarios activos por médico", [
+        # Bases anteriores pueden tener horarios reservados dos veces
+        cancelar_citas_duplicadas,
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_citas_horario_activo
+        ON citas (medico_id, fecha, hora) WHERE estado != 'cancelada'
+        ''',
+    ]),
+    (4, "Búsqueda de pacientes por nombre con FTS5 sin acentos", [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS citas_fts USING fts5(
+            paciente_nombre,
+            content='citas',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS citas_fts_ai AFTER INSERT ON citas BEGIN
+            INSERT INTO citas_fts (rowid, paciente_nombre) VALUES (new.id, new.paciente_nombre);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS citas_fts_ad AFTER DELETE ON citas BEGIN
+            INSERT INTO citas_fts (citas_fts, rowid, paciente_nombre)
+            VALUES ('delete', old.id, old.paciente_nombre);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS citas_fts_au AFTER UPDATE OF paciente_nombre ON citas BEGIN
+            INSERT INTO citas_fts (citas_fts, rowid, paciente_nombre)
+            VALUES ('delete', old.id, old.paciente_nombre);
+            INSERT INTO citas_fts (rowid, paciente_nombre) VALUES (new.id, new.paciente_nombre);
+        END
+        ''',
+        # Indexar las citas que ya existían
+        "INSERT INTO citas_fts (citas_fts) VALUES ('rebuild')",
+    ]),
+    (5, "Contador de versión del catálogo de servicios y médicos", [
+        '''
+        CREATE TABLE IF NOT EXISTS catalogo_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        ''',
+        "INSERT OR IGNORE INTO catalogo_version (id, version) VALUES (1, 0)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS servicios_version_ai AFTER INSERT ON servicios BEGIN
+            UPDATE catalogo_version SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS servicios_version_au AFTER UPDATE ON servicios BEGIN
+            UPDATE catalogo_version SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS servicios_version_ad AFTER DELETE ON servicios BEGIN
+            UPDATE catalogo_version SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS medicos_version_ai AFTER INSERT ON medicos BEGIN
+            UPDATE catalogo_version SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS medicos_version_au AFTER UPDATE ON medicos BEGIN
+            UPDATE catalogo_version SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS medicos_version_ad AFTER DELETE ON medicos BEGIN
+            UPDATE catalogo_version SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+    ]),
+    (6, "Catálogo inicial de médicos y servicios (solo en bases nuevas)", [
+        lambda conn: sembrar_catalogo(conn),
+    ]),
+    (7, "Contador de versión de las citas, para invalidar la agenda entre procesos", [
+        '''
+        CREATE TABLE IF NOT EXISTS citas_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        ''',
+        "INSERT OR IGNORE INTO citas_version (id, version) VALUES (1, 0)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS citas_version_ai AFTER INSERT ON citas BEGIN
+            UPDATE citas_version SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS citas_version_au AFTER UPDATE ON citas BEGIN
+            UPDATE citas_version SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS citas_version_ad AFTER DELETE ON citas BEGIN
+            UPDATE citas_version SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+    ]),
+    (8, "Registro de índices y triggers eliminados durante una importación", [
+        '''
+        CREATE TABLE IF NOT EXISTS ddl_diferido (
+            nombre TEXT PRIMARY KEY,
+            sql TEXT NOT NULL
+        )
+        ''',
+    ]),
+]
+
+# Catálogo con el que nace una base nueva
+MEDICOS_INICIALES = [
+    ("Dr. García", "Pediatría", "3312345001", "garcia@medicare.com"),
+    ("Dra. Martínez", "Cardiología", "3312345002", "martinez@medicare.com"),
+    ("Dr. López", "Dermatología", "3312345003", "lopez@medicare.com"),
+    ("Dr. Rodríguez", "Medicina General", "3312345004", "rodriguez@medicare.com"),
+    ("QFB Angel Carrizalez", "Laboratorio", "3312345005", "acarrizalez@medicare.com")
+]
+
+SERVICIOS_INICIALES = [
+    ("Consulta General", 500, 30, 4, "Dr. Rodríguez"),
+    ("Pediatría", 600, 45, 1, "Dr. García"),
+    ("Cardiología", 800, 60, 2, "Dra. Martínez"),
+    ("Dermatología", 700, 30, 3, "Dr. López"),
+    ("Laboratorio", 250, 15, 5, "QFB Angel Carrizalez")
+]
+
+def sembrar_catalogo(conn):
+    """Inserta el catálogo inicial si la tabla de servicios está vacía; devuelve si sembró"""
+    if conn.execute("SELECT 1 FROM servicios LIMIT 1").fetchone():
+        return False
+    conn.executemany('''
+        INSERT INTO medicos (nombre, especialidad, telefono, email)
+        VALUES (?, ?, ?, ?)
+    ''', MEDICOS_INICIALES)
+    conn.executemany('''
+        INSERT INTO servicios (nombre, precio, duracion, medico_id, medico)
+        VALUES (?, ?, ?, ?, ?)
+    ''', SERVICIOS_INICIALES)
+    return True
+
+VERSION_ESQUEMA = MIGRACIONES[-1][0]
+
+def version_actual(conn):
+    """Devuelve la versión de esquema registrada en PRAGMA user_version"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def aplicar_migraciones(conn):
+    """Aplica en orden las migraciones pendientes, cada una en su transacción
+
+    Con el esquema al día solo cuesta una lectura de PRAGMA user_version y
+    otra de ddl_diferido (ver restaurar_ddl_diferido).
+    """
+    aplicadas = []
+    if version_actual(conn) >= VERSION_ESQUEMA:
+        _restaurar_al_abrir(conn)
+        return aplicadas
+
+    for version, descripcion, sentencias in MIGRACIONES:
+        if version <= version_actual(conn):
+            continue
+
+        # BEGIN IMMEDIATE toma el candado de escritura: si otro proceso
+        # migró mientras tanto, la versión se vuelve a comprobar dentro
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= version_actual(conn):
+                conn.rollback()
+                continue
+
+            for sentencia in sentencias:
+                if callable(sentencia):
+                    sentencia(conn)
+                else:
+                    conn.execute(sentencia)
+
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+            aplicadas.append((version, descripcion))
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+    _restaurar_al_abrir(conn)
+    if aplicadas:
+        # Actualizar estadísticas del planificador para los índices nuevos
+        conn.execute("PRAGMA optimize")
+
+    return aplicadas
+
+def _restaurar_al_abrir(conn):
+    recreados = restaurar_ddl_diferido(conn)
+    if recreados:
+        log.warning("Importación interrumpida: recreados %s y reindexada la búsqueda por nombre",
+                    ', '.join(recreados))
@@ -0,0 +1,126 @@
+# procesar_mensajes.py - Procesa en lote un archivo JSONL de mensajes con el chatbot
+#
+# Cada línea de entrada es un objeto JSON con al menos "mensaje" (se conservan
+# los demás campos, p. ej. "id" o "telefono"). La salida agrega "intencion",
+# "respuesta" y "ms", en el mismo orden que la entrada.
+#
+#   python procesar_mensajes.py mensajes.jsonl --db clinica.db --salida respuestas.jsonl --procesos 8
+#
+# Los mensajes pueden reservar y cancelar citas: con --simular se procesan
+# sobre una copia temporal de la base y la original no cambia.
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from conversacion import ChatEngine
+from database import DatabaseManager
+
+_motor = None
+
+def _iniciar_proceso(db_path):
+    """Cada proceso del pool abre su propio DatabaseManager"""
+    global _motor
+    _motor = ChatEngine(DatabaseManager(db_path))
+
+def _procesar_linea(linea):
+    linea = linea.strip()
+    if not linea:
+        return None
+    try:
+        registro = json.loads(linea)
+    except json.JSONDecodeError as e:
+        return {'error': f'JSON inválido: {e}', 'linea': linea}
+
+    mensaje = registro.get('mensaje', '')
+    inicio = time.perf_counter()
+    try:
+        intencion, respuesta = _motor.responder(mensaje)
+        registro.update(intencion=intencion, respuesta=respuesta)
+    except Exception as e:
+        registro['error'] = str(e)
+    registro['ms'] = round((time.perf_counter() - inicio) * 1000, 3)
+    return registro
+
+def procesar(entrada, salida, db_path, procesos=1, tamano_lote=64):
+    """Lee líneas JSONL de `entrada` y escribe las respuestas en `salida`"""
+    total = 0
+    if procesos <= 1:
+        _iniciar_proceso(db_path)
+        resultados = map(_procesar_linea, entrada)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(procesos, initializer=_iniciar_proceso, initargs=(db_path,))
+        resultados = pool.imap(_procesar_linea, entrada, chunksize=tamano_lote)
+
+    try:
+        for registro in resultados:
+            if registro is None:
+                continue
+            salida.write(json.dumps(registro, ensure_ascii=False) + '\n')
+            total += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        else:
+            _motor.db.cerrar()
+    return total
+
+def copiar_base(origen, destino):
+    """Copia la base con la API de respaldo de SQLite (consistente aun en WAL)"""
+    fuente = sqlite3.connect(origen)
+    copia = sqlite3.connect(destino)
+    try:
+        fuente.backup(copia)
+    finally:
+        copia.close()
+        fuente.close()
+
+def ejecutar(args, db_path):
+    """Procesa la entrada de `args` contra la base `db_path`"""
+    # Crear/migrar el esquema una sola vez antes de repartir el trabajo
+    db = DatabaseManager(db_path)
+    db.init_database()
+    db.cerrar()
+
+    entrada = sys.stdin if args.entrada == '-' else open(args.entrada, encoding='utf-8')
+    salida = open(args.salida, 'w', encoding='utf-8') if args.salida else sys.stdout
+    inicio = time.perf_counter()
+    try:
+        total = procesar(entrada, salida, db_path, args.procesos, args.lote)
+    finally:
+        if entrada is not sys.stdin:
+            entrada.close()
+        if salida is not sys.stdout:
+            salida.close()
+
+    duracion = time.perf_counter() - inicio
+    print(f"{total} mensajes en {duracion:.2f}s ({total / duracion if duracion else 0:.0f} msg/s)",
+          file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procesa un archivo JSONL de mensajes con el chatbot")
+    parser.add_argument('entrada', help="Archivo JSONL de mensajes ('-' para stdin)")
+    parser.add_argument('--salida', help="Archivo JSONL de respuestas (stdout por defecto)")
+    parser.add_argument('--db', required=True, help="Base de datos SQLite a usar")
+    parser.add_argument('--simular', action='store_true',
+                        help="Procesar sobre una copia temporal de --db, sin modificarla")
+    parser.add_argument('--procesos', type=int, default=1, help="Procesos en paralelo")
+    parser.add_argument('--lote', type=int, default=64, help="Mensajes por tarea enviada a cada proceso")
+    args = parser.parse_args(argv)
+
+    if args.simular:
+        with tempfile.TemporaryDirectory() as directorio:
+            copia = os.path.join(directorio, 'simulacion.db')
+            copiar_base(args.db, copia)
+            ejecutar(args, copia)
+    else:
+        ejecutar(args, args.db)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# replica.py - Réplica en memoria de la base para las lecturas de agenda y búsqueda
+#
+# Se llena con la API de backup de sqlite3 y se mantiene al día aplicando las
+# filas de citas que cambia cada commit de crear_cita/cancelar_cita. Los cambios
+# hechos por otros procesos se notan en el contador citas_version:
+# DatabaseManager._agenda_vigente() vuelve a copiar la base entera antes de la
+# siguiente lectura. verificar() y resincronizar() quedan para los operadores.
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Columnas de citas que se copian a la réplica tras cada escritura
+COLUMNAS_CITA = (
+    'id', 'numero_confirmacion', 'paciente_nombre', 'paciente_telefono', 'servicio_id',
+    'medico_id', 'fecha', 'hora', 'estado', 'created_at',
+)
+
+_SELECT_CITA = f"SELECT {', '.join(COLUMNAS_CITA)} FROM citas WHERE numero_confirmacion = ?"
+
+# UPSERT por id: un UPDATE dispara los triggers de búsqueda igual que en disco
+_UPSERT_CITA = (
+    f"INSERT INTO citas ({', '.join(COLUMNAS_CITA)}) VALUES ({', '.join('?' * len(COLUMNAS_CITA))}) "
+    f"ON CONFLICT(id) DO UPDATE SET "
+    + ', '.join(f"{c} = excluded.{c}" for c in COLUMNAS_CITA if c != 'id')
+)
+
+def leer_cita(conn, numero_confirmacion):
+    """Fila completa de una cita, para enviarla a la réplica después del commit"""
+    return conn.execute(_SELECT_CITA, (numero_confirmacion,)).fetchone()
+
+class ReplicaMemoria:
+    """Copia en memoria de la base, con una conexión protegida por un candado
+
+    Las consultas en memoria no esperan el candado de escritura del archivo ni
+    tocan el disco; se atienden de a una, lo que basta para lecturas cortas.
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.RLock()
+
+    @property
+    def cargada(self):
+        return self._conn is not None
+
+    def cargar(self, origen):
+        """Copia la base completa desde la conexión `origen` (API de backup)"""
+        memoria = sqlite3.connect(':memory:', check_same_thread=False)
+        origen.backup(memoria)
+        with self._lock:
+            anterior, self._conn = self._conn, memoria
+        if anterior is not None:
+            anterior.close()
+
+    @contextmanager
+    def conexion(self):
+        with self._lock:
+            if self._conn is None:
+                raise sqlite3.ProgrammingError("La réplica no está cargada")
+            yield self._conn
+
+    def aplicar(self, filas):
+        """Inserta o actualiza en la réplica las filas de citas ya confirmadas en disco"""
+        with self._lock:
+            if self._conn is None or not filas:
+                return
+            with self._conn:
+                self._conn.executemany(_UPSERT_CITA, filas)
+
+    def cerrar(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def verificar(self, origen, max_diferencias=20):
+        """Compara las citas de la réplica con las de `origen`, fila por fila
+
+        Devuelve {'consistente', 'filas_disco', 'filas_replica', 'diferencias'}
+        donde cada diferencia es (id, fila en disco, fila en réplica).
+        """
+        consulta = f"SELECT {', '.join(COLUMNAS_CITA)} FROM citas ORDER BY id"
+        with self._lock:
+            if self._conn is None:
+                return {'consistente': False, 'filas_disco': None, 'filas_replica': None,
+                        'diferencias': [], 'mensaje': 'La réplica no está cargada'}
+            # Recorrido en paralelo de ambas tablas ordenadas por id (sin cargarlas enteras)
+            disco = origen.execute(consulta)
+            replica = self._conn.execute(consulta)
+            filas_disco = filas_replica = 0
+            diferencias = []
+            en_disco, en_replica = next(disco, None), next(replica, None)
+            while en_disco is not None or en_replica is not None:
+                if en_replica is None or (en_disco is not None and en_disco[0] < en_replica[0]):
+                    par, en_disco = (en_disco[0], en_disco, None), next(disco, None)
+                    filas_disco += 1
+                elif en_disco is None or en_replica[0] < en_disco[0]:
+                    par, en_replica = (en_replica[0], None, en_replica), next(replica, None)
+                    filas_replica += 1
+                else:
+                    par = (en_disco[0], en_disco, en_replica) if en_disco != en_replica else None
+                    en_disco, en_replica = next(disco, None), next(replica, None)
+                    filas_disco += 1
+                    filas_replica += 1
+                if par is not None and len(diferencias) < max_diferencias:
+                    diferencias.append(par)
+        return {
+            'consistente': not diferencias,
+            'filas_disco': filas_disco,
+            'filas_replica': filas_replica,
+            'diferencias': diferencias,
+        }
@@ -0,0 +1,149 @@
+# sedes.py - Un archivo SQLite por sede (sucursal) detrás de un enrutador
+#
+# Cada sede tiene su propio DatabaseManager y, por lo tanto, su propio candado
+# de escritura: las reservas de una sede no esperan a las de otra.
+#
+#   router = RouterSedes({1: 'clinica.db', 2: 'clinica_zapopan.db'})
+#   motor = ChatEngine(router.vista(2))   # agenda en la sede 2
+#   router.cancelar_cita('MC02...')       # va directo a la sede 2
+#   router.buscar_citas('telefono', '3312345678')  # consulta todas en paralelo
+import base64
+import binascii
+import heapq
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from database import DatabaseManager, codificar_cursor, sede_de_confirmacion
+
+# Configuración por defecto: la base histórica es la sede 1
+SEDES = {1: 'clinica.db'}
+
+def _codificar_cursores(cursores):
+    texto = json.dumps({str(sede): cursor for sede, cursor in cursores.items()}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+def _decodificar_cursores(token):
+    try:
+        texto = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        return {int(sede): cursor for sede, cursor in json.loads(texto).items()}
+    except (binascii.Error, UnicodeDecodeError, ValueError, AttributeError) as e:
+        raise ValueError(f"Cursor inválido: {token!r}") from e
+
+class RouterSedes:
+    """Enruta cada operación a la base de su sede y reparte las búsquedas globales
+
+    `sedes` relaciona el código de sede (1-99, va dentro de los números de
+    confirmación) con la ruta de su archivo SQLite. Los números anteriores a
+    las sedes, sin código, se atribuyen a `sede_por_defecto`.
+    """
+
+    def __init__(self, sedes=None, tamano_pool=8, sede_por_defecto=None):
+        sedes = dict(sedes or SEDES)
+        if not sedes:
+            raise ValueError("Se necesita al menos una sede")
+        for codigo in sedes:
+            if not 1 <= int(codigo) <= 99:
+                raise ValueError(f"Código de sede fuera de rango (1-99): {codigo}")
+        self.sede_por_defecto = sede_por_defecto if sede_por_defecto is not None else min(sedes)
+        self._bases = {
+            int(codigo): DatabaseManager(ruta, tamano_pool=tamano_pool, sede=int(codigo))
+            for codigo, ruta in sorted(sedes.items())
+        }
+        self._executor = ThreadPoolExecutor(max_workers=len(self._bases), thread_name_prefix='sede')
+
+    @property
+    def sedes(self):
+        return list(self._bases)
+
+    def sede(self, codigo):
+        """DatabaseManager de una sede; KeyError si no existe"""
+        return self._bases[int(codigo)]
+
+    def sede_de_cita(self, numero_confirmacion):
+        """Sede a la que pertenece un número de confirmación"""
+        sede = sede_de_confirmacion(numero_confirmacion)
+        return sede if sede in self._bases else self.sede_por_defecto
+
+    def vista(self, codigo):
+        """Objeto con la interfaz de DatabaseManager para una sede, con búsquedas globales"""
+        return VistaSede(self, int(codigo))
+
+    def cerrar(self):
+        self._executor.shutdown(wait=True)
+        for db in self._bases.values():
+            db.cerrar()
+
+    def _en_todas(self, funcion):
+        """Ejecuta funcion(sede, db) en paralelo en todas las sedes; {sede: resultado}"""
+        futuros = {sede: self._executor.submit(funcion, sede, db) for sede, db in self._bases.items()}
+        return {sede: futuro.result() for sede, futuro in futuros.items()}
+
+    def cancelar_cita(self, numero_confirmacion):
+        """Cancela en la sede codificada en el número, sin buscar en las demás"""
+        return self.sede(self.sede_de_cita(numero_confirmacion)).cancelar_cita(numero_confirmacion)
+
+    def buscar_citas(self, criterio, valor):
+        """Citas de todas las sedes (con la clave 'sede'), de la más reciente a la más antigua"""
+        resultados = self._en_todas(lambda sede, db: [dict(c, sede=sede) for c in db.buscar_citas(criterio, valor)])
+        return list(heapq.merge(*resultados.values(), key=lambda c: c['fecha'], reverse=True))
+
+    def buscar_citas_pagina(self, criterio, valor, tamano_pagina=10, cursor=None):
+        """Una página global; el cursor guarda la posición alcanzada en cada sede
+
+        Cada sede entrega a lo sumo una página propia (con su búsqueda por clave),
+        así que el costo no depende del total de coincidencias.
+        """
+        try:
+            cursores = _decodificar_cursores(cursor) if cursor else {sede: None for sede in self._bases}
+        except ValueError:
+            return {'citas': [], 'cursor': None}
+
+        # False marca una sede ya agotada
+        def pagina(sede, db):
+            if sede not in cursores or cursores[sede] is False:
+                return {'citas': [], 'cursor': None}
+            return db.buscar_citas_pagina(criterio, valor, tamano_pagina, cursores[sede])
+        paginas = self._en_todas(pagina)
+
+        flujos = [[dict(c, sede=sede) for c in p['citas']] for sede, p in paginas.items()]
+        citas = list(heapq.merge(*flujos, key=lambda c: c['fecha'], reverse=True))[:tamano_pagina]
+
+        siguientes = {}
+        for sede, p in paginas.items():
+            consumidas = [c for c in citas if c['sede'] == sede]
+            if cursores.get(sede) is False:
+                siguientes[sede] = False
+            elif len(consumidas) == len(p['citas']):
+                # Se usó la página completa de la sede: seguir desde su propio cursor
+                siguientes[sede] = p['cursor'] if p['cursor'] else False
+            else:
+                ultima = consumidas[-1] if consumidas else None
+                siguientes[sede] = (codificar_cursor(ultima['fecha'], ultima['id'])
+                                    if ultima else cursores.get(sede))
+
+        hay_mas = any(c is not False for c in siguientes.values())
+        return {'citas': citas, 'cursor': _codificar_cursores(siguientes) if hay_mas else None}
+
+class VistaSede:
+    """Interfaz de DatabaseManager para una sede, apta para ChatEngine
+
+    Consultas de agenda, reservas y catálogo van a la base de la sede; las
+    cancelaciones se enrutan por el número y las búsquedas abarcan todas las sedes.
+    """
+
+    def __init__(self, router, codigo):
+        self._router = router
+        self.sede = codigo
+        self._db = router.sede(codigo)
+
+    def __getattr__(self, nombre):
+        return getattr(self._db, nombre)
+
+    def cancelar_cita(self, numero_confirmacion):
+        return self._router.cancelar_cita(numero_confirmacion)
+
+    def buscar_citas(self, criterio, valor):
+        return self._router.buscar_citas(criterio, valor)
+
+    def buscar_citas_pagina(self, criterio, valor, tamano_pagina=10, cursor=None):
+        return self._router.buscar_citas_pagina(criterio, valor, tamano_pagina, cursor)
@@ -0,0 +1,205 @@
+# servidor_http.py - Endpoint HTTP/JSON asíncrono del chatbot (solo biblioteca estándar)
+#
+#   python servidor_http.py --puerto 8080 --db clinica.db
+#   curl -X POST localhost:8080/chat -d '{"sesion_id": "abc", "mensaje": "hola"}'
+#   curl localhost:8080/metricas            (JSON; ?formato=texto para tabla)
+#   curl localhost:8080/replica             (con --replica; POST /replica/resincronizar)
+#
+# El bucle de eventos solo atiende sockets; las llamadas bloqueantes a
+# DatabaseManager corren en un pool de hilos.
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from conversacion import ChatEngine
+from database import DatabaseManager
+import metricas
+
+MAX_CUERPO = 64 * 1024
+MAX_HISTORIAL_SESION = 50
+SESION_EXPIRA_S = 30 * 60
+
+class Sesion:
+    """Estado de una conversación: historial acotado y orden de los mensajes"""
+
+    def __init__(self):
+        self.historial = deque(maxlen=MAX_HISTORIAL_SESION)
+        self.lock = asyncio.Lock()
+        self.ultima_actividad = time.monotonic()
+
+class ServidorChat:
+    def __init__(self, motor, hilos=16, db=None):
+        self.motor = motor
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='chat')
+        self.sesiones = {}
+
+    def _sesion(self, sesion_id):
+        sesion = self.sesiones.get(sesion_id)
+        if sesion is None:
+            sesion = self.sesiones[sesion_id] = Sesion()
+        sesion.ultima_actividad = time.monotonic()
+        return sesion
+
+    async def purgar_sesiones(self, intervalo=60):
+        """Descarta periódicamente las sesiones inactivas"""
+        while True:
+            await asyncio.sleep(intervalo)
+            limite = time.monotonic() - SESION_EXPIRA_S
+            for sesion_id in [s for s, v in self.sesiones.items() if v.ultima_actividad < limite]:
+                self.sesiones.pop(sesion_id, None)
+
+    async def responder(self, sesion_id, mensaje):
+        """Procesa un mensaje; los de una misma sesión se atienden en orden"""
+        sesion = self._sesion(sesion_id)
+        async with sesion.lock:
+            loop = asyncio.get_running_loop()
+            intencion, respuesta = await loop.run_in_executor(self.executor, self.motor.responder, mensaje)
+            sesion.historial.append({'role': 'user', 'content': mensaje})
+            sesion.historial.append({'role': 'assistant', 'content': respuesta})
+            return {'sesion_id': sesion_id, 'intencion': intencion, 'respuesta': respuesta}
+
+    async def _atender(self, metodo, ruta, cuerpo):
+        """Devuelve (estado, objeto JSON o texto plano) para una petición ya leída"""
+        partes = urlsplit(ruta)
+        ruta = partes.path
+        if ruta == '/salud':
+            return HTTPStatus.OK, {'estado': 'ok', 'sesiones': len(self.sesiones)}
+        if ruta == '/metricas':
+            if parse_qs(partes.query).get('formato') == ['texto']:
+                return HTTPStatus.OK, metricas.REGISTRO.a_texto() + '\n'
+            return HTTPStatus.OK, metricas.REGISTRO.resumen()
+        if ruta in ('/replica', '/replica/resincronizar') and self.db is not None:
+            # Operación de mantenimiento: verificar (GET) o recargar (POST) la réplica en memoria
+            loop = asyncio.get_running_loop()
+            if ruta == '/replica' and metodo == 'GET':
+                return HTTPStatus.OK, await loop.run_in_executor(self.executor, self.db.verificar_replica)
+            if ruta == '/replica/resincronizar' and metodo == 'POST':
+                return HTTPStatus.OK, await loop.run_in_executor(self.executor, self.db.resincronizar_replica)
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Usa GET /replica o POST /replica/resincronizar'}
+
+        if ruta != '/chat':
+            return HTTPStatus.NOT_FOUND, {'error': 'Ruta no encontrada'}
+        if metodo != 'POST':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Usa POST'}
+
+        try:
+            datos = json.loads(cuerpo or b'{}')
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return HTTPStatus.BAD_REQUEST, {'error': 'JSON inválido'}
+        if not isinstance(datos, dict):
+            return HTTPStatus.BAD_REQUEST, {'error': 'Se esperaba un objeto JSON'}
+
+        sesion_id = str(datos.get('sesion_id') or '').strip()
+        mensaje = datos.get('mensaje')
+        if not sesion_id or not isinstance(mensaje, str):
+            return HTTPStatus.BAD_REQUEST, {'error': "Faltan 'sesion_id' o 'mensaje'"}
+
+        try:
+            with metricas.medir('http.chat'):
+                return HTTPStatus.OK, await self.responder(sesion_id, mensaje)
+        except Exception:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': 'Error procesando el mensaje'}
+
+    async def manejar_conexion(self, reader, writer):
+        """Atiende peticiones HTTP/1.1 (con keep-alive) de una conexión"""
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea:
+                    break
+                try:
+                    metodo, ruta, version = linea.decode('latin-1').split()
+                except ValueError:
+                    await self._enviar(writer, HTTPStatus.BAD_REQUEST, {'error': 'Petición inválida'}, False)
+                    break
+
+                cabeceras = {}
+                while True:
+                    linea = await reader.readline()
+                    if linea in (b'\r\n', b'\n', b''):
+                        break
+                    nombre, _, valor = linea.decode('latin-1').partition(':')
+                    cabeceras[nombre.strip().lower()] = valor.strip()
+
+                try:
+                    longitud = int(cabeceras.get('content-length') or 0)
+                    if longitud < 0:
+                        raise ValueError(longitud)
+                except ValueError:
+                    await self._enviar(writer, HTTPStatus.BAD_REQUEST, {'error': 'Content-Length inválido'}, False)
+                    break
+                if longitud > MAX_CUERPO:
+                    await self._enviar(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                       {'error': 'Mensaje demasiado grande'}, False)
+                    break
+                cuerpo = await reader.readexactly(longitud) if longitud else b''
+
+                mantener = (version == 'HTTP/1.1' and cabeceras.get('connection', '').lower() != 'close')
+                estado, respuesta = await self._atender(metodo.upper(), ruta, cuerpo)
+                await self._enviar(writer, estado, respuesta, mantener)
+                if not mantener:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _enviar(self, writer, estado, objeto, mantener):
+        if isinstance(objeto, str):
+            cuerpo, tipo = objeto.encode('utf-8'), 'text/plain'
+        else:
+            cuerpo, tipo = json.dumps(objeto, ensure_ascii=False).encode('utf-8'), 'application/json'
+        cabeceras = (
+            f"HTTP/1.1 {estado.value} {estado.phrase}\r\n"
+            f"Content-Type: {tipo}; charset=utf-8\r\n"
+            f"Content-Length: {len(cuerpo)}\r\n"
+            f"Connection: {'keep-alive' if mantener else 'close'}\r\n\r\n"
+        )
+        writer.write(cabeceras.encode('latin-1') + cuerpo)
+        await writer.drain()
+
+async def servir(host, puerto, db_path, hilos, escritura_agrupada=False, replica_lectura=False):
+    db = DatabaseManager(db_path, tamano_pool=hilos, escritura_agrupada=escritura_agrupada,
+                         replica_lectura=replica_lectura)
+    db.init_database()  # migrar antes de aceptar peticiones, no en la primera
+    servidor_chat = ServidorChat(ChatEngine(db), hilos=hilos, db=db)
+    servidor = await asyncio.start_server(servidor_chat.manejar_conexion, host, puerto, backlog=1024)
+    purga = asyncio.create_task(servidor_chat.purgar_sesiones())
+    print(f"Chatbot escuchando en http://{host}:{puerto}/chat")
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    finally:
+        purga.cancel()
+        servidor_chat.executor.shutdown(wait=True)
+        db.cerrar()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Endpoint HTTP/JSON del chatbot")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8080)
+    parser.add_argument('--db', default='clinica.db')
+    parser.add_argument('--hilos', type=int, default=16, help="Hilos para las llamadas a la base de datos")
+    parser.add_argument('--escritura-agrupada', action='store_true',
+                        help="Reservas y cancelaciones por un hilo escritor con commits agrupados")
+    parser.add_argument('--replica', action='store_true',
+                        help="Atender agenda y búsquedas desde una réplica en memoria")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(servir(args.host, args.puerto, args.db, args.hilos, args.escritura_agrupada,
+                           args.replica))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
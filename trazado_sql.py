@@ -0,0 +1,320 @@
+# trazado_sql.py - Trazado de sentencias SQLite, log de consultas lentas y auditoría de planes
+#
+# El trazado es opcional: DatabaseManager(trazador=TrazadorSQL(...)) o la
+# variable de entorno CLINICA_TRAZA_SQL=1 (CLINICA_SQL_LENTO_MS fija el umbral).
+# Cada sentencia queda registrada con su duración; las que superan el umbral
+# se escriben en un log rotativo.
+#
+#   python trazado_sql.py auditar --db clinica.db
+#
+# La auditoría ejecuta los métodos de DatabaseManager sobre una copia de la
+# base, recoge cada consulta emitida y marca las que recorren citas completa.
+import argparse
+import importlib.util
+import logging
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import date, timedelta
+from logging.handlers import RotatingFileHandler
+
+UMBRAL_LENTO_MS = 50
+LOG_LENTAS = 'consultas_lentas.log'
+
+# Métodos cuya lectura completa de citas es intencional
+ESCANEOS_ESPERADOS = {'exportar_citas_completa', 'importar_citas'}
+
+# Un logger (y un solo RotatingFileHandler) por archivo, compartido por todos los
+# trazadores que escriben en él: varios manejadores rotando el mismo archivo lo rompen
+_logs_lentas = {}
+_logs_lentas_lock = threading.Lock()
+
+def logger_lentas(ruta_log, max_bytes=1024 * 1024, respaldos=3):
+    """Logger hijo de clinica.sql_lento que escribe en `ruta_log`; se crea una vez por ruta"""
+    ruta = os.path.abspath(ruta_log)
+    with _logs_lentas_lock:
+        logger = _logs_lentas.get(ruta)
+        if logger is None:
+            logger = logging.getLogger(f'clinica.sql_lento.{len(_logs_lentas)}')
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            manejador = RotatingFileHandler(ruta, maxBytes=max_bytes, backupCount=respaldos,
+                                            encoding='utf-8')
+            manejador.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            logger.addHandler(manejador)
+            _logs_lentas[ruta] = logger
+        return logger
+
+def _compactar(sql):
+    return ' '.join(sql.split())
+
+class TrazadorSQL:
+    """Registra las sentencias ejecutadas con su duración y escribe las lentas a disco
+
+    Las conexiones creadas con ConexionTrazada le pasan cada llamada cronometrada;
+    set_trace_callback aporta además el texto expandido (con parámetros) y las
+    sentencias que SQLite ejecuta por su cuenta, como BEGIN implícitos o triggers.
+    """
+
+    def __init__(self, umbral_lento_ms=UMBRAL_LENTO_MS, ruta_log=LOG_LENTAS,
+                 max_bytes=1024 * 1024, respaldos=3, max_registros=5000):
+        self.umbral_lento_ms = umbral_lento_ms
+        self.registros = deque(maxlen=max_registros)
+        self.etiqueta = None  # método que se está ejecutando (lo usa la auditoría)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        # El tamaño y los respaldos los fija el primer trazador que abre cada archivo
+        self.log_lentas = logger_lentas(ruta_log, max_bytes, respaldos) if ruta_log else None
+
+    @classmethod
+    def desde_entorno(cls):
+        """Trazador configurado por variables de entorno, o None si no está activado"""
+        if os.environ.get('CLINICA_TRAZA_SQL', '0') in ('', '0'):
+            return None
+        return cls(umbral_lento_ms=float(os.environ.get('CLINICA_SQL_LENTO_MS', UMBRAL_LENTO_MS)),
+                   ruta_log=os.environ.get('CLINICA_SQL_LOG', LOG_LENTAS))
+
+    def instalar(self, conn):
+        conn.trazador = self
+        conn.set_trace_callback(self._al_ejecutar)
+
+    def _pendientes(self):
+        pendientes = getattr(self._local, 'pendientes', None)
+        if pendientes is None:
+            pendientes = self._local.pendientes = []
+        return pendientes
+
+    def _al_ejecutar(self, sql):
+        self._pendientes().append(sql)
+
+    def _volcar_sueltas(self):
+        """Sentencias trazadas fuera de una llamada cronometrada (sin duración)"""
+        pendientes = self._pendientes()
+        for sql in pendientes:
+            self._guardar(sql, None, None, [])
+        pendientes.clear()
+
+    def cronometrar(self, sql, parametros, funcion, *args):
+        """Ejecuta funcion(*args) registrando la sentencia y su duración"""
+        self._volcar_sueltas()
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args)
+        finally:
+            ms = (time.perf_counter() - inicio) * 1000
+            pendientes = self._pendientes()
+            ejecutadas, pendientes[:] = list(pendientes), []
+            self._guardar(sql, parametros, ms, ejecutadas)
+
+    def _guardar(self, sql, parametros, ms, ejecutadas):
+        registro = {
+            'sql': _compactar(sql),
+            'parametros': parametros,
+            'ms': ms,
+            'ejecutadas': ejecutadas,
+            'etiqueta': self.etiqueta,
+            'hilo': threading.current_thread().name,
+        }
+        with self._lock:
+            self.registros.append(registro)
+        if ms is not None and ms >= self.umbral_lento_ms and self.log_lentas is not None:
+            self.log_lentas.info("%.1fms %s params=%r", ms, registro['sql'], parametros)
+
+    def resumen(self):
+        """[(sql, veces, total_ms, max_ms)] ordenado por tiempo total"""
+        agregado = {}
+        with self._lock:
+            registros = list(self.registros)
+        for r in registros:
+            if r['ms'] is None:
+                continue
+            veces, total, maximo = agregado.get(r['sql'], (0, 0.0, 0.0))
+            agregado[r['sql']] = (veces + 1, total + r['ms'], max(maximo, r['ms']))
+        return sorted(((sql, *v) for sql, v in agregado.items()), key=lambda f: f[2], reverse=True)
+
+class CursorTrazado(sqlite3.Cursor):
+    def execute(self, sql, parametros=()):
+        return self.connection.trazador.cronometrar(sql, parametros, super().execute, sql, parametros)
+
+    def executemany(self, sql, secuencia):
+        return self.connection.trazador.cronometrar(sql, None, super().executemany, sql, secuencia)
+
+class ConexionTrazada(sqlite3.Connection):
+    """Conexión que cronometra cada sentencia con el trazador asignado en `trazador`"""
+
+    trazador = None
+
+    def cursor(self, factory=CursorTrazado):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.trazador.cronometrar(sql, parametros, super().execute, sql, parametros)
+
+    def executemany(self, sql, secuencia):
+        return self.trazador.cronometrar(sql, None, super().executemany, sql, secuencia)
+
+    def executescript(self, script):
+        return self.trazador.cronometrar(script, None, super().executescript, script)
+
+    def commit(self):
+        return self.trazador.cronometrar('COMMIT', None, super().commit)
+
+    def rollback(self):
+        return self.trazador.cronometrar('ROLLBACK', None, super().rollback)
+
+def conectar(db_path, trazador=None, **kwargs):
+    """sqlite3.connect que, con trazador, devuelve una ConexionTrazada ya instalada"""
+    if trazador is None:
+        return sqlite3.connect(db_path, **kwargs)
+    conn = sqlite3.connect(db_path, factory=ConexionTrazada, **kwargs)
+    trazador.instalar(conn)
+    return conn
+
+# --- Auditoría de planes de consulta ---------------------------------------
+
+_PATRON_TABLAS = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+_NO_ALIAS = {'on', 'where', 'join', 'left', 'inner', 'cross', 'group', 'order', 'limit', 'using', 'set'}
+_AUDITABLES = ('select', 'with', 'update', 'delete', 'insert')
+
+def tablas_por_alias(sql):
+    """{alias o nombre: tabla} a partir de las cláusulas FROM/JOIN"""
+    alias = {}
+    for tabla, nombre in _PATRON_TABLAS.findall(sql):
+        alias[tabla.lower()] = tabla.lower()
+        if nombre and nombre.lower() not in _NO_ALIAS:
+            alias[nombre.lower()] = tabla.lower()
+    return alias
+
+def escaneos_completos(conn, sql, parametros, tabla='citas'):
+    """Pasos del plan que recorren `tabla` entera (SCAN sobre la tabla o alguno de sus alias)"""
+    alias = tablas_por_alias(sql)
+    marcados = []
+    for fila in conn.execute(f"EXPLAIN QUERY PLAN {sql}", parametros or ()):
+        detalle = fila[-1]
+        match = re.match(r'SCAN (?:TABLE )?(\w+)', detalle)
+        if match and alias.get(match.group(1).lower(), match.group(1).lower()) == tabla:
+            marcados.append(detalle)
+    return marcados
+
+def _carga_auditoria(db):
+    """Llama a cada método de consulta de DatabaseManager con argumentos representativos"""
+    manana = date.today() + timedelta(days=1)
+    fecha = manana.strftime("%Y-%m-%d")
+    servicio = db.obtener_servicios()[0]
+    yield 'obtener_servicios', lambda: db.obtener_servicios()
+    yield 'obtener_servicio', lambda: db.obtener_servicio(servicio['id'])
+    yield 'buscar_servicio_por_nombre', lambda: db.buscar_servicio_por_nombre(servicio['nombre'])
+    yield 'version_catalogo', lambda: db.version_catalogo()
+    yield 'obtener_horarios_disponibles', lambda: db.obtener_horarios_disponibles(fecha, servicio['id'])
+    yield 'obtener_disponibilidad_rango', lambda: db.obtener_disponibilidad_rango(
+        manana, manana + timedelta(days=13), servicio['medico_id'])
+    yield 'obtener_disponibilidad_proximos_dias', lambda: db.obtener_disponibilidad_proximos_dias(45)
+    yield 'buscar_primeros_horarios', lambda: db.buscar_primeros_horarios(
+        especialidad=servicio['nombre'], turno='manana', desde=manana)
+
+    estado = {}
+    def crear():
+        horario = (db.obtener_horarios_disponibles(fecha, servicio['id']) or ['09:00'])[0]
+        estado['cita'] = db.crear_cita("Auditoría Plan", "3300000000", servicio['id'],
+                                       servicio['medico_id'], fecha, horario)
+    yield 'crear_cita', crear
+    def buscar_paginas():
+        pagina = db.buscar_citas_pagina('nombre', 'auditoria', tamano_pagina=1)
+        pagina = db.buscar_citas_pagina('telefono', '3300000000', tamano_pagina=1)
+        db.buscar_citas_pagina('telefono', '3300000000', tamano_pagina=1,
+                               cursor=pagina['cursor'] or None)
+    yield 'buscar_citas_pagina', buscar_paginas
+    yield 'buscar_citas', lambda: (db.buscar_citas('nombre', 'auditoria'),
+                                   db.buscar_citas('telefono', '3300000000'))
+    yield 'cancelar_cita', lambda: db.cancelar_cita(
+        (estado.get('cita') or {}).get('numero_confirmacion', 'MC0'))
+    yield 'exportar_citas', lambda: (list(db.exportar_citas(manana, manana)),
+                                     list(db.exportar_citas(fecha_desde=manana)))
+    yield 'exportar_citas_completa', lambda: list(db.exportar_citas())
+    if importlib.util.find_spec('numpy') is not None:
+        yield 'analitica_ocupacion', lambda: db.analitica_ocupacion(manana - timedelta(days=30), manana)
+    yield 'importar_citas', lambda: db.importar_citas([{
+        'paciente_nombre': "Auditoría Importación", 'paciente_telefono': "3300000001",
+        'servicio_id': servicio['id'], 'medico_id': servicio['medico_id'],
+        'fecha': fecha, 'hora': '17:30',
+    }])
+
+def auditar(db_path):
+    """Ejecuta la carga de auditoría sobre una copia y devuelve {método: [(sql, pasos SCAN)]}"""
+    from database import DatabaseManager
+
+    with tempfile.TemporaryDirectory() as directorio:
+        copia = os.path.join(directorio, 'auditoria.db')
+        origen = sqlite3.connect(db_path)
+        destino = sqlite3.connect(copia)
+        try:
+            origen.backup(destino)
+        finally:
+            origen.close()
+            destino.close()
+
+        trazador = TrazadorSQL(ruta_log=None, max_registros=None)
+        db = DatabaseManager(copia, trazador=trazador)
+        try:
+            for metodo, llamada in _carga_auditoria(db):
+                trazador.etiqueta = metodo
+                llamada()
+            trazador.etiqueta = None
+
+            hallazgos = {}
+            vistas = set()
+            conn = sqlite3.connect(copia)
+            try:
+                for registro in list(trazador.registros):
+                    sql, metodo = registro['sql'], registro['etiqueta']
+                    if metodo is None or not sql.lower().startswith(_AUDITABLES):
+                        continue
+                    if (metodo, sql) in vistas:
+                        continue
+                    vistas.add((metodo, sql))
+                    # executemany no guarda parámetros: se auditan con NULL
+                    parametros = registro['parametros']
+                    if parametros is None:
+                        parametros = (None,) * sql.count('?')
+                    hallazgos.setdefault(metodo, []).append(
+                        (sql, escaneos_completos(conn, sql, parametros)))
+            finally:
+                conn.close()
+            return hallazgos
+        finally:
+            db.cerrar()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Auditoría de planes de consulta de DatabaseManager")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+    p_auditar = subparsers.add_parser('auditar', help="Marca los recorridos completos de citas")
+    p_auditar.add_argument('--db', default='clinica.db', help="Base de datos SQLite (se audita una copia)")
+    p_auditar.add_argument('--detalle', action='store_true', help="Muestra también las consultas sin escaneos")
+    args = parser.parse_args(argv)
+
+    inesperados = 0
+    for metodo, consultas in auditar(args.db).items():
+        marcadas = [(sql, pasos) for sql, pasos in consultas if pasos]
+        esperado = metodo in ESCANEOS_ESPERADOS
+        estado = "OK" if not marcadas else ("ESPERADO" if esperado else "ESCANEO")
+        print(f"[{estado}] {metodo}: {len(consultas)} consultas")
+        for sql, pasos in consultas:
+            if pasos or args.detalle:
+                print(f"    {sql[:160]}")
+                for paso in pasos:
+                    print(f"      -> {paso}")
+        if marcadas and not esperado:
+            inesperados += len(marcadas)
+
+    if inesperados:
+        print(f"{inesperados} consultas recorren citas completa", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()